@@ -1,9 +1,10 @@
 import random
 from django.shortcuts import render, reverse
-from django.core.mail import send_mail
+from django.db import transaction
 from django.views import generic
 from django.contrib.auth.mixins import LoginRequiredMixin
 from leads.models import Agent, UserProfile
+from leads.outbox import queue_email
 from .forms import AgentModelForm
 from .mixins import OrganisorAndLoginRequiredMixin
 
@@ -14,11 +15,9 @@ class AgentListView(OrganisorAndLoginRequiredMixin, generic.ListView):
     # You can use this instead of queryset = Agent.objects.all()
     def get_queryset(self):
         # Super User can only see Agent created by his organisation
-        # To do this, you can filter the queryset to only return the organisation
-        organisation = self.request.user.userprofile # define organisation_1 | organisatio_1 right now = test_admin
-        return Agent.objects.filter(organisation=organisation) 
-        # assign organisation_1 (test_admin) to organisation_2 (new variable), 
-        # and only return Agents that belong to test_admin organisation
+        # for_user filters the queryset to only return the agents of the organisation (see OrganisationScopedQuerySet)
+        # with_user joins agent.user, which the template shows for every agent
+        return Agent.objects.for_user(self.request.user).with_user()
 
 
 class AgentCreateView(OrganisorAndLoginRequiredMixin, generic.CreateView):
@@ -28,6 +27,7 @@ class AgentCreateView(OrganisorAndLoginRequiredMixin, generic.CreateView):
     def get_success_url(self):
         return reverse("agents:agent-list")
 
+    @transaction.atomic # the user, the agent and the invitation email are committed together
     def form_valid(self, form):
         user = form.save(commit=False) # user = username entered by user
         user.is_agent = True # set Is agent field as True in django admin
@@ -36,10 +36,11 @@ class AgentCreateView(OrganisorAndLoginRequiredMixin, generic.CreateView):
         user.save()
         Agent.objects.create(
             user=user, #user = username entered by user
-            organisation=self.request.user.userprofile,
+            organisation=self.request.tenant.organisation,
         )
 
-        send_mail(
+        # queued in the outbox and sent by the run_outbox worker instead of blocking the request on SMTP
+        queue_email(
             subject="You are invited to be an agent",
             message="You were added as an agent on DJCRM. Please come login to start working.",
             from_email="admin@test.com",
@@ -53,8 +54,7 @@ class AgentDetailView(OrganisorAndLoginRequiredMixin, generic.DetailView):
     context_object_name = "agent" # allow you to use variable such as agent.firstname, agent.user.username, etc.
 
     def get_queryset(self):
-        organisation = self.request.user.userprofile # define organisation_1 | organisatio_1 right now = test_admin
-        return Agent.objects.filter(organisation=organisation)
+        return Agent.objects.for_user(self.request.user).with_user() # only the agents of the organisation
 
 
 class AgentUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
@@ -65,7 +65,7 @@ class AgentUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
         return reverse("agents:agent-list")
 
     def get_queryset(self):
-        return Agent.objects.all()
+        return Agent.objects.for_user(self.request.user) # only the agents of the organisation
 
 
 class AgentDeleteView(OrganisorAndLoginRequiredMixin, generic.DeleteView):
@@ -76,5 +76,4 @@ class AgentDeleteView(OrganisorAndLoginRequiredMixin, generic.DeleteView):
         return reverse("agents:agent-list")
 
     def get_queryset(self):
-        organisation = self.request.user.userprofile # define organisation_1 | organisatio_1 right now = test_admin
-        return Agent.objects.filter(organisation=organisation)
\ No newline at end of file
+        return Agent.objects.for_user(self.request.user).with_user() # only the agents of the organisation
\ No newline at end of file
@@ -0,0 +1,30 @@
+from django.templatetags.static import static
+from django.urls import reverse
+from jinja2 import ChainableUndefined, Environment, pass_context
+from markupsafe import Markup
+from leads.cache import cached_fragment
+
+
+def url(name, *args, **kwargs):
+    # {{ url('leads:lead-detail', lead.pk) }} = {% url 'leads:lead-detail' lead.pk %}
+    return reverse(name, args=args, kwargs=kwargs)
+
+
+@pass_context
+def organisation_cache(context, fragment_name, *vary_on, caller):
+    # {% call organisation_cache("agent_list") %} ... {% endcall %} = {% organisation_cache "agent_list" %} (see leads/cache.py)
+    # prefixed, a Jinja2 fragment never replaces the one of the Django template
+    return Markup(cached_fragment(context["request"], "jinja2:" + fragment_name, vary_on, caller))
+
+
+def environment(**options):
+    # ChainableUndefined => {{ lead.agent.user.first_name }} prints nothing when lead.agent is None, like Django templates do
+    options["undefined"] = ChainableUndefined
+    options["keep_trailing_newline"] = True # same whitespace as the Django templates
+    env = Environment(**options)
+    env.globals.update({
+        "static": static,
+        "url": url,
+        "organisation_cache": organisation_cache,
+    })
+    return env
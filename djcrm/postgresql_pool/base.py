@@ -0,0 +1,119 @@
+"""
+PostgreSQL backend with an in-process connection pool (Django 5.1 has one built in, for psycopg 3 only).
+
+    ENGINE = 'djcrm.postgresql_pool'
+    OPTIONS = {'pool': {'min_size': 2, 'max_size': 10, 'timeout': 10}}
+
+Closing a connection - at the end of a request with CONN_MAX_AGE = 0, or after a query of the async views - gives it
+back to the pool instead of closing the socket, so the next connect() skips the TCP + TLS + authentication handshake.
+Enabled from the environment with DB_POOL_MAX_SIZE, see djcrm/settings.py.
+"""
+
+import threading
+
+import psycopg2.extras
+from psycopg2 import pool as psycopg2_pool
+from django.db.backends.postgresql import base, creation
+
+# one pool per database and per process: created with the first connection, so after gunicorn forked the worker
+pools = {}
+pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, conn_params, min_size=2, max_size=10, timeout=10, check=False):
+        self.pool = psycopg2_pool.ThreadedConnectionPool(min_size, max_size, **conn_params)
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.timeout = timeout
+        self.check = check
+
+    def getconn(self):
+        # ThreadedConnectionPool raises as soon as max_size connections are taken, wait for one to come back instead
+        if not self.slots.acquire(timeout=self.timeout):
+            raise base.Database.OperationalError(f"No database connection came back to the pool within {self.timeout}s")
+        try:
+            connection = self.pool.getconn()
+            if self.check and not is_usable(connection):
+                # the server closed it while it was in the pool (restart, idle timeout): replace it
+                self.pool.putconn(connection, close=True)
+                connection = self.pool.getconn()
+            return connection
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, connection):
+        try:
+            # rolls back a transaction left open, a connection that was closed or broken is dropped instead of kept
+            self.pool.putconn(connection, close=bool(connection.closed))
+        finally:
+            self.slots.release()
+
+    def close(self):
+        self.pool.closeall()
+
+
+def is_usable(connection):
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        # Outside autocommit (a connection Django never set up yet) the ping opened a transaction, and set_session() -
+        # which Django's connect() calls through set_autocommit() - raises inside one
+        if not connection.autocommit:
+            connection.rollback()
+    except base.Database.Error:
+        return False
+    return True
+
+
+def get_pool(conn_params, options, check):
+    key = tuple(sorted(conn_params.items())) # the test database gets its own pool
+    with pools_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(conn_params, check=check, **options)
+        return pools[key]
+
+
+def close_pools():
+    with pools_lock:
+        for pool in pools.values():
+            pool.close()
+        pools.clear()
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # the connections kept in the pool would prevent DROP DATABASE
+        close_pools()
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        conn_params = super(DatabaseWrapper, self).get_connection_params()
+        conn_params.pop("pool", None) # ours, not a psycopg2.connect() argument
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        self.pool = get_pool(
+            conn_params, self.settings_dict["OPTIONS"].get("pool", {}), self.settings_dict.get("CONN_HEALTH_CHECKS", False)
+        )
+        connection = self.pool.getconn()
+        # the same set up as base.DatabaseWrapper.get_new_connection does after Database.connect()
+        options = self.settings_dict["OPTIONS"]
+        try:
+            self.isolation_level = options["isolation_level"]
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
@@ -0,0 +1,21 @@
+"""
+ASGI settings profile, used by gunicorn with uvicorn workers (see gunicorn_asgi.conf.py).
+
+The production profile, plus the async views and a middleware chain without sync-only middleware: one of them would
+run the rest of the chain and the view in a thread for every request, like a sync worker.
+"""
+
+from .settings_production import *  # noqa: F401,F403
+from .settings_production import MIDDLEWARE
+
+ASYNC_VIEWS = True
+
+MIDDLEWARE = [
+    # whitenoise 5 is sync only (and django_heroku adds it a second time), its sync and async version replaces it
+    'leads.middleware.StaticFilesMiddleware',
+    *[
+        middleware for middleware in MIDDLEWARE
+        # QueryInstrumentationMiddleware wraps the connections of the request's thread, the async views query in others
+        if middleware not in ('whitenoise.middleware.WhiteNoiseMiddleware', 'leads.middleware.QueryInstrumentationMiddleware')
+    ],
+]
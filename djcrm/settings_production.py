@@ -0,0 +1,27 @@
+"""
+Production settings profile, used by gunicorn (see gunicorn.conf.py).
+
+Everything comes from djcrm/settings.py, only what must differ in production is changed here.
+Run another command with it: DJANGO_SETTINGS_MODULE=djcrm.settings_production py manage.py <command>
+"""
+
+from copy import deepcopy
+
+from .settings import *  # noqa: F401,F403
+from .settings import TEMPLATES, env
+
+DEBUG = env('DEBUG') # False unless the DEBUG environment variable is set
+
+# With DEBUG = True Django reads and parses base.html, navbar.html and the crispy tailwind templates on every render.
+# The cached loader keeps every compiled template in memory for the lifetime of the worker process,
+# 'py manage.py warm_templates' fills it when a gunicorn worker starts.
+TEMPLATES = deepcopy(TEMPLATES)
+DJANGO_TEMPLATES = next(backend for backend in TEMPLATES if backend['BACKEND'].endswith('DjangoTemplates'))
+DJANGO_TEMPLATES['APP_DIRS'] = False # must be off when loaders is set, app_directories.Loader below does the same
+DJANGO_TEMPLATES['OPTIONS']['debug'] = False # no template debug info (line numbers for the error page) to track while rendering
+DJANGO_TEMPLATES['OPTIONS']['loaders'] = [
+    ('django.template.loaders.cached.Loader', [
+        'django.template.loaders.filesystem.Loader',
+        'django.template.loaders.app_directories.Loader',
+    ]),
+]
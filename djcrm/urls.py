@@ -16,6 +16,7 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from leads.views import SignupView, landing_page, LandingPageView
+from leads.metrics import metrics_view
 from django.contrib import admin
 from django.contrib.auth.views import (
     LoginView, LogoutView, PasswordResetView, 
@@ -31,6 +32,7 @@ urlpatterns = [
     # include chops off the duplicated part of the URL, and sends the remaining string to URLConf for processing
     # for example, leads/5/update => 5/update ("leads" is chopped off)
     path('agents/', include('agents.urls', namespace="agents")),
+    path('api/', include('leads.api_urls', namespace="api")), # JSON API over leads, agents and categories (leads/api.py)
     path('signup/', SignupView.as_view(), name="signup"),
     path('reset_password', PasswordResetView.as_view(), name="reset-password"),
     path('password-reset-done/', PasswordResetDoneView.as_view(), name="password_reset_done"),
@@ -38,6 +40,7 @@ urlpatterns = [
     path('password-reset-complete/', PasswordResetCompleteView.as_view(), name="password_reset_complete"),
     path('login/', LoginView.as_view(), name="login"),
     path('logout/', LogoutView.as_view(), name="logout"),
+    path('metrics', metrics_view, name="metrics"), # Prometheus text format, scraped by the monitoring server
 ]
 
 if settings.DEBUG:
@@ -0,0 +1,42 @@
+# gunicorn reads this file automatically when it's started from the project folder (see Procfile)
+import os
+import shutil
+import tempfile
+
+# prometheus_client multiprocess mode: every worker writes its metrics to files in this directory
+# and /metrics adds them up, so it doesn't matter which worker answers the scrape (see leads/metrics.py)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "djcrm-prometheus"))
+
+# production profile: DEBUG off and the cached template loader (see djcrm/settings_production.py)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djcrm.settings_production")
+
+
+def on_starting(server):
+    from django.conf import settings
+    # every worker would have its own cache: a cache version bumped by one worker (or by a command like seed_crm)
+    # wouldn't be seen by the others, which would keep serving the old fragments and choices (see leads/cache.py)
+    if settings.CACHES["default"]["BACKEND"] == "django.core.cache.backends.locmem.LocMemCache":
+        # gunicorn prints the message of a RuntimeError and exits
+        raise RuntimeError(
+            "The production profile needs a cache shared by the processes, set CACHE_URL "
+            "(filecache:///var/tmp/djcrm_cache or rediscache://..., see djcrm/settings.py)"
+        )
+
+    # the files of a previous run would be added to the new numbers
+    shutil.rmtree(os.environ["PROMETHEUS_MULTIPROC_DIR"], ignore_errors=True)
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"])
+
+
+def post_worker_init(worker):
+    # the worker has loaded Django, compile the templates now instead of during its first requests
+    from django.core.management import call_command
+    call_command("warm_templates", verbosity=0)
+
+
+def child_exit(server, worker):
+    try:
+        from prometheus_client import multiprocess
+    except ImportError:
+        return
+    # drop the live gauges of the worker that exited
+    multiprocess.mark_process_dead(worker.pid)
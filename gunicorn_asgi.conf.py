@@ -0,0 +1,13 @@
+# ASGI profile: gunicorn -c gunicorn_asgi.conf.py djcrm.asgi:application
+# Same hooks as gunicorn.conf.py, but uvicorn workers running the async views (see djcrm/settings_asgi.py):
+# a worker keeps answering other requests while the queries of one request wait for the database.
+import os
+import runpy
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djcrm.settings_asgi")
+globals().update(
+    (name, value) for name, value in runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")).items()
+    if not name.startswith("__")
+)
+
+worker_class = "uvicorn.workers.UvicornWorker"
@@ -1,10 +1,16 @@
 from django.contrib import admin
 
-from .models import User, Lead, Agent, UserProfile, Category
+from .models import User, Lead, Agent, UserProfile, Category, OutboxEmail
 
 # Register your models here.
 admin.site.register(User)
 admin.site.register(UserProfile) # Add UserProfile to the admin site
 admin.site.register(Lead)
 admin.site.register(Agent)
-admin.site.register(Category)
\ No newline at end of file
+admin.site.register(Category)
+
+
+@admin.register(OutboxEmail)
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ("subject", "status", "attempts", "next_attempt_at", "created_at")
+    list_filter = ("status",) # filter on 'Dead' to see the emails that gave up
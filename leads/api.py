@@ -0,0 +1,311 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+
+from django.core.exceptions import BadRequest, PermissionDenied
+from django.db import transaction
+from django.forms.models import model_to_dict
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, reverse
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
+from django.views import generic
+from django.views.decorators.http import condition
+from .cache import get_cache_version, get_last_modified
+from .changes import WatermarkExpired, decode_watermark, get_lead_changes
+from .forms import LeadApiForm, CategoryModelForm
+from .models import Lead, Agent, Category
+from .pagination import KeysetPaginationMixin, encode_cursor
+from .search import search_leads
+
+# JSON API over the leads, agents and categories, mounted at /api/ (see api_urls.py).
+#
+# - Same login (session cookie) and the same organisation scoping as the HTML pages: Model.objects.for_user(user).
+#   Writes are for organisors only and, like every POST of the site, need the CSRF token (X-CSRFToken header).
+# - Lists are keyset paginated like the lead list: {"results": [...], "next": <URL of the next page or null>}, ?limit=.
+# - ?fields=id,first_name => only these fields are returned, and only their columns are selected.
+# - Rows are read with values() and serialized as they are, no model instances are built.
+# - ETag/Last-Modified come from the organisation's cache version (see cache.py), which every write to its leads,
+#   agents and categories bumps. A poller sending If-None-Match gets a 304 without a single query on the data.
+# - /api/leads/changes/?since=<watermark> is the change feed (changes.py), for incremental syncs.
+
+
+def json_error(message, status):
+    return JsonResponse({"error": message}, status=status)
+
+
+def get_response_etag(request, *args, **kwargs):
+    organisation = request.tenant.organisation
+    if organisation is None:
+        return None
+    # the user is part of the ETag because an agent sees fewer leads than an organisor, the path because of the query string
+    version = get_cache_version(organisation.pk)
+    return hashlib.md5(f"{version}:{request.user.pk}:{request.get_full_path()}".encode()).hexdigest()
+
+
+def get_response_last_modified(request, *args, **kwargs):
+    # one second resolution (HTTP dates), two writes in the same second look the same => clients should prefer the ETag
+    organisation = request.tenant.organisation
+    if organisation is None:
+        return None
+    return datetime.fromtimestamp(get_last_modified(organisation.pk), tz=timezone.utc)
+
+
+class ApiMixin:
+    model = None
+    # name in the JSON => field for values(), the keys of ?fields= are these names
+    fields = {}
+    form_class = None # validates the JSON of POST and PATCH, gets the request like LeadModelForm
+    detail_url_name = None
+    conditional = True # ETag/Last-Modified, for responses that only change when the organisation's data is written
+    paginate_by = 50
+    max_paginate_by = 200
+
+    def dispatch(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return json_error("Authentication required", 401) # no redirect to the login page, it's not a browser
+        view = super(ApiMixin, self).dispatch
+        if self.conditional:
+            # condition() answers If-None-Match/If-Modified-Since with 304 and a failed If-Match with 412 before the view runs
+            view = condition(etag_func=get_response_etag, last_modified_func=get_response_last_modified)(view)
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as error:
+            return json_error(str(error), 400)
+        except PermissionDenied as error:
+            return json_error(str(error) or "Only organisors can change data", 403)
+        except Http404 as error:
+            return json_error(str(error) or "Not found", 404)
+
+    def get_queryset(self):
+        # an organisor sees ALL rows of the organisation, an agent ONLY their leads (see OrganisationScopedQuerySet)
+        return self.model.objects.for_user(self.request.user)
+
+    def get_fields(self):
+        if not self.request.GET.get("fields"):
+            return list(self.fields)
+        names = [name.strip() for name in self.request.GET["fields"].split(",") if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise BadRequest(f"Unknown fields: {', '.join(unknown)}. Available fields: {', '.join(self.fields)}")
+        return names
+
+    def get_page_size(self):
+        try:
+            page_size = int(self.request.GET.get("limit", self.paginate_by))
+        except ValueError:
+            raise BadRequest("limit must be a number")
+        if not 1 <= page_size <= self.max_paginate_by:
+            raise BadRequest(f"limit must be between 1 and {self.max_paginate_by}")
+        return page_size
+
+    def get_rows(self, queryset, fields, extra=()):
+        # dict.fromkeys => the columns in order, without duplicates
+        return queryset.values(*dict.fromkeys([self.fields[name] for name in fields] + list(extra)))
+
+    def serialize(self, row, fields):
+        return {name: row[self.fields[name]] for name in fields}
+
+    def get_json_body(self):
+        try:
+            data = json.loads(self.request.body or b"{}")
+        except ValueError:
+            raise BadRequest("The body is not valid JSON")
+        if not isinstance(data, dict):
+            raise BadRequest("The body must be a JSON object")
+        return data
+
+    def check_write_permission(self):
+        # the same rule as the HTML pages: only organisors create, change and delete (OrganisorAndLoginRequiredMixin)
+        if not self.request.user.is_organisor:
+            raise PermissionDenied()
+
+    def save_form(self, form, status=200):
+        if not form.is_valid():
+            return JsonResponse({"errors": form.errors.get_json_data()}, status=400)
+        with transaction.atomic(): # the row and the counters its signals move are committed together
+            instance = form.save(commit=False)
+            if instance.pk is None:
+                instance.organisation = self.request.tenant.organisation
+            instance.save()
+        fields = self.get_fields()
+        response = JsonResponse(self.serialize(self.get_rows(self.get_queryset(), fields).get(pk=instance.pk), fields), status=status)
+        if status == 201:
+            response["Location"] = reverse(self.detail_url_name, args=[instance.pk])
+        return response
+
+
+class ApiListView(ApiMixin, KeysetPaginationMixin, generic.View):
+    http_method_names = ["get", "head", "post", "options"]
+    # agents and categories are listed by id, leads newest first like the lead list
+    keyset_ordering = ("id",)
+    keyset_converters = (int,)
+
+    def filter_queryset(self, queryset):
+        return queryset
+
+    def get_keyset_values(self, obj):
+        return [obj[field.lstrip("-")] for field in self.keyset_ordering]
+
+    def get(self, request, *args, **kwargs):
+        fields = self.get_fields()
+        # the keyset fields are selected even when they're not in ?fields=, the cursor of the next page is made of them
+        rows = self.get_rows(
+            self.filter_queryset(self.get_queryset()), fields, [field.lstrip("-") for field in self.keyset_ordering]
+        )
+        _, page, rows, _ = self.paginate_queryset(rows, self.get_page_size())
+        next_url = None
+        if page.has_next():
+            next_url = request.build_absolute_uri(
+                f"{request.path}?{urlencode({**request.GET.dict(), self.cursor_kwarg: page.next_cursor})}"
+            )
+        return JsonResponse({"results": [self.serialize(row, fields) for row in rows], "next": next_url})
+
+    def post(self, request, *args, **kwargs):
+        self.check_write_permission()
+        return self.save_form(self.form_class(self.get_json_body(), request=request), status=201)
+
+
+class ApiDetailView(ApiMixin, generic.View):
+    http_method_names = ["get", "head", "patch", "delete", "options"]
+
+    def get_object(self):
+        return get_object_or_404(self.get_queryset(), pk=self.kwargs["pk"])
+
+    def get(self, request, *args, **kwargs):
+        fields = self.get_fields()
+        return JsonResponse(self.serialize(get_object_or_404(self.get_rows(self.get_queryset(), fields), pk=self.kwargs["pk"]), fields))
+
+    def patch(self, request, *args, **kwargs):
+        # only the fields in the body change, the others keep their current value
+        self.check_write_permission()
+        instance = self.get_object()
+        data = {**model_to_dict(instance, fields=self.form_class._meta.fields), **self.get_json_body()}
+        return self.save_form(self.form_class(data, instance=instance, request=request))
+
+    def delete(self, request, *args, **kwargs):
+        self.check_write_permission()
+        instance = self.get_object()
+        with transaction.atomic(): # the counters are moved by the delete signals
+            instance.delete()
+        return HttpResponse(status=204)
+
+
+class LeadApiMixin:
+    model = Lead
+    fields = {
+        "id": "id",
+        "first_name": "first_name",
+        "last_name": "last_name",
+        "age": "age",
+        "email": "email",
+        "phone_number": "phone_number",
+        "description": "description",
+        "date_added": "date_added",
+        "updated_at": "updated_at",
+        "agent": "agent_id",
+        "category": "category_id",
+    }
+    form_class = LeadApiForm
+    detail_url_name = "api:lead-detail"
+
+
+class LeadApiListView(LeadApiMixin, ApiListView):
+    keyset_ordering = ("-date_added", "-id")
+    keyset_converters = (parse_datetime, int)
+
+    def filter_queryset(self, queryset):
+        # ?q= is the search of the lead list, ?agent= and ?category= take an id or "none"
+        if self.request.GET.get("q"):
+            queryset = search_leads(queryset, self.request.GET["q"])
+        for name in ("agent", "category"):
+            value = self.request.GET.get(name)
+            if value == "none":
+                queryset = queryset.filter(**{f"{name}__isnull": True})
+            elif value:
+                try:
+                    queryset = queryset.filter(**{f"{name}_id": int(value)})
+                except ValueError:
+                    raise BadRequest(f"{name} must be an id or none")
+        return queryset
+
+
+class LeadApiDetailView(LeadApiMixin, ApiDetailView):
+    pass
+
+
+class LeadChangesApiView(LeadApiMixin, ApiMixin, generic.View):
+    # ?since=<watermark> => the leads created, updated or deleted since then, see changes.py
+    http_method_names = ["get", "head", "options"]
+    conditional = False # the feed also changes as time passes (LEAD_CHANGES_SETTLE_SECONDS), not only on writes
+    paginate_by = 500
+    max_paginate_by = 5000
+
+    def get(self, request, *args, **kwargs):
+        if not request.user.is_organisor:
+            # an agent would not see the leads that were moved away from them
+            raise PermissionDenied("Only organisors can read the change feed")
+        fields = self.get_fields()
+        since = request.GET.get("since") or None
+        try:
+            since = decode_watermark(since) if since else None
+        except Http404:
+            raise BadRequest("Invalid watermark, pass the watermark of the previous response")
+        try:
+            changes, watermark, has_more = get_lead_changes(
+                request.tenant.organisation,
+                since=since,
+                limit=self.get_page_size(),
+                columns=[self.fields[name] for name in fields],
+            )
+        except WatermarkExpired:
+            return json_error("The watermark is too old, deleted leads may have been missed: sync everything again", 410)
+        for change in changes:
+            if change["lead"] is not None:
+                change["lead"] = self.serialize(change["lead"], fields)
+        return JsonResponse({
+            "results": changes,
+            "watermark": encode_cursor(watermark) if watermark else None,
+            "has_more": has_more, # true => ask again with the new watermark right away
+        })
+
+
+class AgentApiMixin:
+    # read only: creating an agent creates its login and emails it, that stays on the agent pages
+    http_method_names = ["get", "head", "options"]
+    model = Agent
+    fields = {
+        "id": "id",
+        "email": "user__email",
+        "first_name": "user__first_name",
+        "last_name": "user__last_name",
+        "lead_count": "lead_count",
+        "capacity": "capacity",
+    }
+
+
+class AgentApiListView(AgentApiMixin, ApiListView):
+    pass
+
+
+class AgentApiDetailView(AgentApiMixin, ApiDetailView):
+    pass
+
+
+class CategoryApiMixin:
+    model = Category
+    fields = {
+        "id": "id",
+        "name": "name",
+        "lead_count": "lead_count",
+    }
+    form_class = CategoryModelForm
+    detail_url_name = "api:category-detail"
+
+
+class CategoryApiListView(CategoryApiMixin, ApiListView):
+    pass
+
+
+class CategoryApiDetailView(CategoryApiMixin, ApiDetailView):
+    pass
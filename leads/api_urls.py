@@ -0,0 +1,18 @@
+from django.urls import path
+from .api import (
+    LeadApiListView, LeadApiDetailView, LeadChangesApiView,
+    AgentApiListView, AgentApiDetailView,
+    CategoryApiListView, CategoryApiDetailView,
+)
+
+app_name = "api"
+
+urlpatterns = [
+    path('leads/', LeadApiListView.as_view(), name='lead-list'),
+    path('leads/<int:pk>/', LeadApiDetailView.as_view(), name='lead-detail'),
+    path('leads/changes/', LeadChangesApiView.as_view(), name='lead-changes'),
+    path('agents/', AgentApiListView.as_view(), name='agent-list'),
+    path('agents/<int:pk>/', AgentApiDetailView.as_view(), name='agent-detail'),
+    path('categories/', CategoryApiListView.as_view(), name='category-list'),
+    path('categories/<int:pk>/', CategoryApiDetailView.as_view(), name='category-detail'),
+]
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class LeadsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'leads'
+
+    def ready(self):
+        from .connections import install_health_checks, mark_as_checked, mark_for_health_check
+        install_health_checks()
+        request_started.connect(mark_for_health_check, dispatch_uid="leads.mark_for_health_check")
+        connection_created.connect(mark_as_checked, dispatch_uid="leads.mark_as_checked")
@@ -0,0 +1,92 @@
+import heapq
+from collections import Counter, defaultdict
+from itertools import cycle, islice
+
+from django.db import transaction
+from django.utils import timezone
+from .bulk import get_batch_size
+from .cache import invalidate_organisation_cache
+from .models import Agent, Lead, change_agent_counter
+
+# A strategy gets the agents of the organisation (ordered by id, with lead_count and capacity)
+# and the number of leads to assign, and returns the agent of every lead, in order.
+
+
+def round_robin(agents, count):
+    # agent 1, agent 2, ..., agent n, agent 1, ...
+    return list(islice(cycle(agents), count))
+
+
+def least_loaded(agents, count):
+    # every lead goes to the agent with the fewest leads at that moment, lead_count includes the leads assigned so far
+    heap = [(agent.lead_count, index, agent) for index, agent in enumerate(agents)]
+    heapq.heapify(heap)
+    assigned = []
+    for _ in range(count):
+        lead_count, index, agent = heapq.heappop(heap)
+        assigned.append(agent)
+        heapq.heappush(heap, (lead_count + 1, index, agent))
+    return assigned
+
+
+def weighted(agents, count):
+    # Smooth weighted round robin (like nginx): every agent gets leads in proportion to its capacity,
+    # spread evenly instead of all leads of the biggest agent first
+    agents = [agent for agent in agents if agent.capacity > 0]
+    if not agents: # nobody has capacity, the leads stay unassigned
+        return []
+    total = sum(agent.capacity for agent in agents)
+    current = [0] * len(agents)
+    assigned = []
+    for _ in range(count):
+        for index, agent in enumerate(agents):
+            current[index] += agent.capacity
+        best = max(range(len(agents)), key=lambda index: current[index])
+        current[best] -= total
+        assigned.append(agents[best])
+    return assigned
+
+
+ASSIGNMENT_STRATEGIES = {
+    "round-robin": round_robin,
+    "least-loaded": least_loaded,
+    "weighted": weighted,
+}
+
+
+@transaction.atomic
+def assign_leads(organisation, strategy="round-robin", limit=None):
+    """Assign the organisation's unassigned leads to its agents, oldest leads first, and return {agent: number of leads}.
+
+    The leads are updated with one UPDATE ... SET agent_id = %s WHERE id IN (...) per agent and batch instead of one save()
+    per lead, so the Lead signals don't run: the agent counters and the organisation cache are updated here, in the same
+    transaction.
+    """
+    agents = list(Agent.objects.for_organisation(organisation).order_by("id").only("id", "lead_count", "capacity"))
+    if not agents:
+        return Counter()
+
+    # select_for_update(skip_locked) => a lead someone is saving right now is left for the next run instead of waiting for it
+    leads = Lead.objects.for_organisation(organisation).filter(agent__isnull=True).select_for_update(skip_locked=True)
+    lead_ids = list(leads.order_by("date_added", "id").values_list("id", flat=True)[:limit])
+    assigned = ASSIGNMENT_STRATEGIES[strategy](agents, len(lead_ids))
+    lead_ids = lead_ids[:len(assigned)]
+
+    # grouped by agent rather than one CASE id WHEN ... per lead: building a CASE with hundreds of WHENs
+    # costs Django more than running the UPDATEs, and the number of agents is small
+    lead_ids_by_agent = defaultdict(list)
+    for lead_id, agent in zip(lead_ids, assigned):
+        lead_ids_by_agent[agent].append(lead_id)
+
+    batch_size = get_batch_size()
+    now = timezone.now() # queryset.update() doesn't set updated_at (auto_now)
+    counts = Counter()
+    for agent, agent_lead_ids in lead_ids_by_agent.items():
+        for start in range(0, len(agent_lead_ids), batch_size):
+            Lead.objects.filter(pk__in=agent_lead_ids[start:start + batch_size]).update(agent_id=agent.pk, updated_at=now)
+        counts[agent] = len(agent_lead_ids)
+
+    for agent, count in counts.items():
+        change_agent_counter(agent.pk, count)
+    invalidate_organisation_cache(organisation.pk)
+    return counts
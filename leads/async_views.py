@@ -0,0 +1,144 @@
+import asyncio
+from contextlib import nullcontext
+from functools import partial, update_wrapper
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import AccessMixin
+from django.db import close_old_connections, connection
+from django.views.generic.base import ContextMixin
+from .connections import mark_for_health_check
+from .replicas import ReplicaReadMixin
+from .views import LeadListView, LeadDetailView, CategoryListView, CategoryDetailView
+
+# Async variants of the read-only lead and category pages, served instead of the sync ones when ASYNC_VIEWS is on
+# (the ASGI profile, see djcrm/settings_asgi.py and gunicorn_asgi.conf.py). The ORM of Django 3.2 is sync only, so:
+#
+# - every query runs in a thread of the event loop's pool (sync_to_async with thread_sensitive=False), which has its
+#   own database connection, while the worker answers other requests;
+# - the queries of a page that don't depend on each other run at the same time, in several threads;
+# - the template is rendered in such a thread too. Django 3.2 would render it on its one thread for sync code,
+#   shared by all the requests of the process.
+#
+# The queries and the template are the same as the sync views' (the views below extend them), only where they run
+# changes. A thread closes its connection when it's done with it, unless CONN_MAX_AGE keeps it open.
+
+
+def load_tenant(request):
+    # request.user and request.tenant are lazy, loading them reads the session and the user: not in the event loop
+    request.tenant.organisation
+
+
+def close_connections_after(function):
+    # the pool threads get no request_started/request_finished signals, what their receivers do is done here
+    def run(*args, **kwargs):
+        mark_for_health_check()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return run
+
+
+class AsyncViewMixin(AccessMixin):
+    """Serve a class based view as a coroutine, for the async (ASGI) request handler.
+
+    The HTTP method handlers are coroutines, they run their sync code with run_queries().
+    Like LoginRequiredMixin, anonymous users are redirected to the login page.
+    """
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super(AsyncViewMixin, cls).as_view(**initkwargs)
+
+        # a coroutine function => Django awaits the view instead of running it in a thread (dispatch is a coroutine)
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+        update_wrapper(async_view, view) # view_class, view_initkwargs, csrf_exempt...
+        return async_view
+
+    async def dispatch(self, request, *args, **kwargs):
+        # Inside a transaction (the tests), the connections of other threads would not see what it wrote:
+        # everything then runs on the thread of the transaction, one function after the other.
+        self.in_transaction = await sync_to_async(lambda: connection.in_atomic_block)()
+        await self.run_queries(partial(load_tenant, request))
+        if not request.user.is_authenticated:
+            return self.handle_no_permission()
+        handler = getattr(self, request.method.lower(), None)
+        if request.method.lower() not in self.http_method_names or handler is None:
+            return self.http_method_not_allowed(request, *args, **kwargs)
+        # the sync views' ReplicaReadMixin.dispatch is replaced by this one: the pool threads get a copy of the context,
+        # so the queries of run_queries() read from the replica picked here
+        with self.read_from_replica() if isinstance(self, ReplicaReadMixin) else nullcontext():
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response): # options() is sync
+                response = await response
+        return response
+
+    async def run_queries(self, *functions):
+        """Call the functions, at the same time in threads of the pool, and return their results in order."""
+        if self.in_transaction:
+            return [await sync_to_async(function)() for function in functions]
+        return await asyncio.gather(*(
+            sync_to_async(close_connections_after(function), thread_sensitive=False)() for function in functions
+        ))
+
+    async def render(self, context):
+        response = self.render_to_response(context)
+        # rendered => Django doesn't render it again on its own sync thread
+        await self.run_queries(response.render)
+        return response
+
+
+class AsyncLeadListView(AsyncViewMixin, LeadListView):
+    async def get(self, request, *args, **kwargs):
+        # the page of assigned leads, the unassigned leads and the choices of the bulk form are independent queries
+        queryset = self.get_queryset()
+        functions = [partial(self.paginate_queryset, queryset, self.get_paginate_by(queryset))]
+        if request.user.is_organisor:
+            functions += [self.get_unassigned_page, self.get_bulk_form]
+        results = await self.run_queries(*functions)
+        paginator, page, leads, is_paginated = results[0]
+        self.object_list = leads
+        context = {
+            "paginator": paginator,
+            "page_obj": page,
+            "is_paginated": is_paginated,
+            "object_list": leads,
+            self.context_object_name: leads,
+            "q": request.GET.get("q", ""),
+        }
+        if request.user.is_organisor:
+            context.update({
+                "unassigned_leads": results[1].object_list,
+                "unassigned_page": results[1],
+                "bulk_form": results[2],
+            })
+        # ContextMixin adds the view and extra_context, ListView.get_context_data would paginate again
+        return await self.render(ContextMixin.get_context_data(self, **context))
+
+
+class AsyncLeadDetailView(AsyncViewMixin, LeadDetailView):
+    async def get(self, request, *args, **kwargs):
+        self.object, = await self.run_queries(self.get_object)
+        return await self.render(self.get_context_data(object=self.object))
+
+
+class AsyncCategoryListView(AsyncViewMixin, CategoryListView):
+    async def get(self, request, *args, **kwargs):
+        # no query here: the categories are read while rendering, only when the organisation_cache fragment misses
+        self.object_list = self.get_queryset()
+        return await self.render(self.get_context_data())
+
+
+class AsyncCategoryDetailView(AsyncViewMixin, CategoryDetailView):
+    async def get(self, request, *args, **kwargs):
+        # the leads are filtered on the category id of the URL and the user's organisation, so they're read at the same
+        # time as the category. A category of another organisation => get_object raises Http404, the leads are dropped.
+        self.object, leads = await self.run_queries(
+            self.get_object,
+            lambda: list(self.get_category_leads(request.tenant.organisation.pk, self.kwargs["pk"])),
+        )
+        context = self.get_context_data(object=self.object)
+        context.update({
+            "leads": leads,
+        })
+        return await self.render(context)
@@ -0,0 +1,174 @@
+import math
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from importlib import import_module
+
+from django.conf import settings
+from django.db import connections
+from django.test import Client
+from django.urls import reverse
+from django.utils.http import urlencode
+from .metrics import QueryCounter
+from .models import Agent, Category, Lead
+
+# every page of these url modules is benchmarked
+BENCHMARK_URLCONFS = ("leads.urls", "agents.urls", "leads.api_urls")
+
+# model of the <int:pk> in the URL, by URL name or by app namespace
+URL_OBJECTS = {
+    "leads:category_detail": Category,
+    "api:lead-detail": Lead,
+    "api:agent-detail": Agent,
+    "api:category-detail": Category,
+    "leads": Lead,
+    "agents": Agent,
+}
+
+# pages of the concurrency benchmark, the ones with an async variant (see async_views.py)
+CONCURRENCY_URLS = ("leads:lead-list", "leads:lead-detail", "leads:category_list", "leads:category_detail")
+
+# extra query strings benchmarked on top of the plain URL
+URL_VARIANTS = {
+    "leads:lead-list": [{"q": "smith"}],
+}
+
+
+def get_benchmark_urls(user):
+    """Return (name, path, query parameters) for every GET-able page of BENCHMARK_URLCONFS.
+
+    URLs with a <pk> get the first object the user can see, URLs whose object doesn't exist are skipped.
+    """
+    urls = []
+    for urlconf in BENCHMARK_URLCONFS:
+        module = import_module(urlconf)
+        for pattern in module.urlpatterns:
+            name = f"{module.app_name}:{pattern.name}"
+            kwargs = {}
+            if "pk" in pattern.pattern.converters:
+                model = URL_OBJECTS.get(name) or URL_OBJECTS[module.app_name]
+                obj = model.objects.for_user(user).order_by("id").only("id").first()
+                if obj is None:
+                    continue
+                kwargs["pk"] = obj.pk
+            path = reverse(name, kwargs=kwargs)
+            urls.append((name, path, {}))
+            for params in URL_VARIANTS.get(name, []):
+                urls.append((name + "?" + "&".join(f"{key}={value}" for key, value in params.items()), path, params))
+    return urls
+
+
+def percentile(values, percent):
+    # nearest-rank percentile, no interpolation => always one of the measured values
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def measure(client, path, params):
+    queries = QueryCounter()
+    start = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(queries))
+        response = client.get(path, params)
+        if response.streaming: # the export runs its queries while the content is read
+            for chunk in response.streaming_content:
+                pass
+    return response.status_code, (time.perf_counter() - start) * 1000, queries.count
+
+
+def run_benchmark(user, requests=20, warmup=2):
+    """Request every benchmark URL as user and return {name: stats}, latencies in milliseconds.
+
+    Runs in-process with the test client, so the query counts are exact and the numbers only depend on
+    the database and the Django code, not on the network or the web server.
+    """
+    client = Client()
+    client.force_login(user)
+    results = {}
+    for name, path, params in get_benchmark_urls(user):
+        for _ in range(warmup): # fill the caches (templates, connections) before measuring
+            measure(client, path, params)
+        timings = []
+        query_counts = []
+        for _ in range(requests):
+            status, duration, query_count = measure(client, path, params)
+            timings.append(duration)
+            query_counts.append(query_count)
+        results[name] = {
+            "status": status,
+            "p50": round(percentile(timings, 50), 2),
+            "p95": round(percentile(timings, 95), 2),
+            "p99": round(percentile(timings, 99), 2),
+            "queries": max(query_counts),
+        }
+    return results
+
+
+def compare_with_baseline(results, baseline, tolerance=0.2, min_delta=2.0):
+    """Return a message for every URL that got slower or runs more queries than in the baseline.
+
+    A p95 only counts as slower when it is more than tolerance (20%) AND min_delta milliseconds above the
+    baseline, so the noise of very fast pages doesn't fail the comparison.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None: # new URL, nothing to compare with
+            continue
+        if result["queries"] > expected["queries"]:
+            regressions.append(f"{name}: {result['queries']} queries, baseline {expected['queries']}")
+        limit = max(expected["p95"] * (1 + tolerance), expected["p95"] + min_delta)
+        if result["p95"] > limit:
+            regressions.append(f"{name}: p95 {result['p95']}ms, baseline {expected['p95']}ms")
+    return regressions
+
+
+def get_session_cookie(user):
+    # a session saved in the session store of the database, a server using the same database accepts it
+    client = Client()
+    client.force_login(user)
+    return f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+
+
+def get_concurrency_paths(user):
+    return [
+        path + ("?" + urlencode(params) if params else "")
+        for name, path, params in get_benchmark_urls(user) if name.split("?")[0] in CONCURRENCY_URLS
+    ]
+
+
+def fetch(url, cookie):
+    # (ok, milliseconds), a redirect (to the login page) counts as an error
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers={"Cookie": cookie}), timeout=60) as response:
+            response.read()
+            ok = response.status == 200 and response.url == url
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return ok, (time.perf_counter() - start) * 1000
+
+
+def run_load_test(base_url, paths, cookie, concurrency, requests):
+    """Request the paths of a running server in turn, concurrency requests at a time, and return {stat: value}.
+
+    Unlike run_benchmark it goes through the network and the web server, so it compares deployments: how many
+    requests per second the sync (WSGI) workers and the async (ASGI) workers answer, and how fast, under the same load.
+    """
+    urls = [base_url.rstrip("/") + paths[number % len(paths)] for number in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(lambda url: fetch(url, cookie), urls))
+    elapsed = time.perf_counter() - start
+    timings = [duration for ok, duration in results]
+    return {
+        "concurrency": concurrency,
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50": round(percentile(timings, 50), 2),
+        "p95": round(percentile(timings, 95), 2),
+        "p99": round(percentile(timings, 99), 2),
+        "errors": sum(1 for ok, duration in results if not ok),
+    }
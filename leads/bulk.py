@@ -0,0 +1,94 @@
+from collections import Counter
+
+from django.db import connection, transaction
+from django.utils import timezone
+from .cache import invalidate_organisation_cache
+from .models import Lead, LeadTombstone, change_agent_counter, change_category_counter
+
+# The bulk actions of the lead list change many leads with one UPDATE or DELETE per batch of ids instead of one
+# save()/delete() per lead. queryset.update() and raw deletes send no Lead signals and don't set updated_at, so updated_at,
+# the tombstones of the change feed, the agent and category counters and the organisation cache are all handled here,
+# in the same transaction as the leads.
+
+
+def get_batch_size():
+    # every lead of a batch adds one query parameter (id IN (%s, ...)) and the new value one more, SQLite allows 999 per query
+    max_params = connection.features.max_query_params
+    return max_params - 1 if max_params else 5000
+
+
+def lock_leads(organisation, queryset):
+    # select_for_update => the leads can't change between reading their agent/category here and updating them,
+    # so the counters are moved by the right amounts. Only the ids read here are updated afterwards: a lead that starts
+    # matching the queryset in the meantime is left alone instead of being changed without its counters.
+    return list(
+        queryset.filter(organisation=organisation).select_for_update().order_by().values_list("pk", "agent_id", "category_id")
+    )
+
+
+def raw_delete(queryset):
+    """Delete the rows of queryset with one DELETE ... WHERE, without loading them: no signal, no cascade.
+
+    QuerySet._raw_delete is private, it's what Django's own fast deletes run (Collector.delete, Django 3.2).
+    RawDeleteTest in test_bulk.py fails if an upgrade removes it or a model gets a foreign key to Lead.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
+def get_batches(lead_ids):
+    batch_size = get_batch_size()
+    for start in range(0, len(lead_ids), batch_size):
+        yield lead_ids[start:start + batch_size]
+
+
+@transaction.atomic
+def bulk_assign_agent(organisation, queryset, agent):
+    """Assign the organisation's leads of queryset to agent and return the number of leads that changed agent."""
+    rows = [row for row in lock_leads(organisation, queryset) if row[1] != agent.pk]
+    if not rows:
+        return 0
+    for batch in get_batches([lead_id for lead_id, agent_id, category_id in rows]):
+        Lead.objects.filter(pk__in=batch).update(agent=agent, updated_at=timezone.now())
+
+    for agent_id, count in Counter(agent_id for lead_id, agent_id, category_id in rows).items():
+        change_agent_counter(agent_id, -count)
+    change_agent_counter(agent.pk, len(rows))
+    invalidate_organisation_cache(organisation.pk)
+    return len(rows)
+
+
+@transaction.atomic
+def bulk_update_category(organisation, queryset, category):
+    """Move the organisation's leads of queryset to category (None => uncategorised) and return the number of leads moved."""
+    category_id = category.pk if category is not None else None
+    rows = [row for row in lock_leads(organisation, queryset) if row[2] != category_id]
+    if not rows:
+        return 0
+    for batch in get_batches([lead_id for lead_id, agent_id, old_category_id in rows]):
+        Lead.objects.filter(pk__in=batch).update(category=category, updated_at=timezone.now())
+
+    for old_category_id, count in Counter(old_category_id for lead_id, agent_id, old_category_id in rows).items():
+        change_category_counter(organisation.pk, old_category_id, -count)
+    change_category_counter(organisation.pk, category_id, len(rows))
+    invalidate_organisation_cache(organisation.pk)
+    return len(rows)
+
+
+@transaction.atomic
+def bulk_delete_leads(organisation, queryset):
+    """Delete the organisation's leads of queryset and return the number of leads deleted."""
+    rows = lock_leads(organisation, queryset)
+    if not rows:
+        return 0
+    for batch in get_batches([lead_id for lead_id, agent_id, category_id in rows]):
+        # queryset.delete() would load every lead to send post_delete (there are receivers for Lead).
+        # Nothing has a foreign key to Lead, so there is nothing to cascade.
+        raw_delete(Lead.objects.filter(pk__in=batch))
+        LeadTombstone.objects.bulk_create([LeadTombstone(lead_id=lead_id, organisation=organisation) for lead_id in batch])
+
+    for agent_id, count in Counter(agent_id for lead_id, agent_id, category_id in rows).items():
+        change_agent_counter(agent_id, -count)
+    for category_id, count in Counter(category_id for lead_id, agent_id, category_id in rows).items():
+        change_category_counter(organisation.pk, category_id, -count)
+    invalidate_organisation_cache(organisation.pk)
+    return len(rows)
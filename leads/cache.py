@@ -0,0 +1,105 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from .metrics import record_cache_lookup
+from .replicas import is_reading_from_replica
+
+# Everything cached for an organisation (template fragments, dropdown choices) has the organisation's version in its key:
+#     org:<organisation id>:<version>:<name>
+# Writing a category, agent or lead bumps the version (see the signals in models.py), so the old entries are never read
+# again and expire on their own. Nothing has to know which keys to delete.
+#
+# The cache backend is settings.CACHES["default"]. LocMemCache is per process, which is fine with one process (runserver,
+# tests) but not with several gunicorn workers: a version bumped in one worker would not be seen by the others.
+# Use the file based cache or Redis there (CACHE_URL, see settings.py), gunicorn.conf.py refuses to start without one.
+
+MISSING = object()
+
+
+def get_version_key(organisation_id):
+    return f"org:{organisation_id}:version"
+
+
+def get_cache_version(organisation_id):
+    key = get_version_key(organisation_id)
+    version = cache.get(key)
+    if version is None:
+        # Start from the current time instead of 1: if the version was evicted, counting again from 1 could reach
+        # a version whose entries are still in the cache.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(organisation_id):
+    key = get_version_key(organisation_id)
+    try:
+        cache.incr(key)
+    except ValueError: # not in the cache (never used or evicted), the next get_cache_version starts a new one
+        pass
+    cache.set(get_last_modified_key(organisation_id), time.time(), timeout=None)
+
+
+def get_last_modified_key(organisation_id):
+    return f"org:{organisation_id}:modified"
+
+
+def get_last_modified(organisation_id):
+    """Return when the organisation's data last changed, as a timestamp (the Last-Modified of the JSON API)."""
+    key = get_last_modified_key(organisation_id)
+    modified = cache.get(key)
+    if modified is None:
+        # unknown (never written or evicted) => assume now, clients fetch the data again rather than keep a stale copy
+        cache.add(key, time.time(), timeout=None)
+        modified = cache.get(key)
+    return modified
+
+
+def invalidate_organisation_cache(organisation_id):
+    if organisation_id is None:
+        return
+    bump_cache_version(organisation_id)
+    if connection.in_atomic_block:
+        # Until the transaction commits, another request still reads the old rows and could cache them
+        # under the new version, so the version is bumped once more after the commit.
+        transaction.on_commit(lambda: bump_cache_version(organisation_id))
+
+
+def get_organisation_cache_key(organisation_id, name):
+    return f"org:{organisation_id}:{get_cache_version(organisation_id)}:{name}"
+
+
+def cached_for_organisation(organisation_id, name, compute, timeout=None):
+    """Return the cached value of name for the organisation, or compute(), cache and return it.
+
+    Every lookup is counted as a hit or a miss in the djcrm_cache_requests_total metric (see metrics.py).
+    A value computed from a replica is not cached (see replicas.py).
+    """
+    key = get_organisation_cache_key(organisation_id, name)
+    value = cache.get(key, MISSING)
+    record_cache_lookup("organisation", value is not MISSING)
+    if value is MISSING:
+        value = compute()
+        if is_reading_from_replica():
+            # the replica may not have the rows that bumped the version yet, cached under the new version
+            # its old rows would be served until the timeout
+            return value
+        cache.set(key, value, settings.ORGANISATION_CACHE_TIMEOUT if timeout is None else timeout)
+    return value
+
+
+def get_fragment_name(fragment_name, vary_on):
+    # same idea as django.core.cache.utils.make_template_fragment_key, the vary_on values are hashed to keep the key short
+    digest = hashlib.md5(":".join(str(value) for value in vary_on).encode()).hexdigest()
+    return f"fragment:{fragment_name}:{digest}"
+
+
+def cached_fragment(request, fragment_name, vary_on, render):
+    # used by {% organisation_cache %} and its Jinja2 version (djcrm/jinja2.py)
+    organisation = request.tenant.organisation
+    if organisation is None: # anonymous user, nothing to cache for
+        return render()
+    return cached_for_organisation(organisation.pk, get_fragment_name(fragment_name, vary_on), render)
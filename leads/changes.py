@@ -0,0 +1,98 @@
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .models import Lead, LeadTombstone
+from .pagination import decode_cursor
+
+# The change feed: every lead of an organisation that was created, updated or deleted after a watermark,
+# oldest change first, so a downstream system can pull only what changed since its last sync instead of exporting
+# everything again.
+#
+# A watermark is the (timestamp, lead id) of the last change a client has seen, encoded like the cursors of the lead
+# list (see pagination.py). Updates come from Lead.updated_at, deletes from the LeadTombstone rows, both read in
+# (timestamp, id) order from their indexes and merged.
+#
+# updated_at is set when a lead is saved, not when its transaction commits. A change that commits a few seconds after
+# its timestamp could end up behind a watermark a client already has, so the feed stops LEAD_CHANGES_SETTLE_SECONDS
+# before now: by then the transactions that wrote the changes it returns are committed.
+
+
+class WatermarkExpired(Exception):
+    """The watermark is older than the tombstones kept (LEAD_TOMBSTONE_DAYS), deletes may have been missed."""
+
+
+def parse_aware_datetime(value):
+    # the watermarks of the feed have a time zone (USE_TZ), a naive timestamp can't be compared with now and updated_at
+    timestamp = parse_datetime(value)
+    if timestamp is not None and timezone.is_naive(timestamp):
+        raise ValueError(value)
+    return timestamp
+
+
+def decode_watermark(watermark):
+    """Return the (timestamp, lead id) of an encoded watermark, raise Http404 when it isn't one the feed returned."""
+    return decode_cursor(watermark, converters=(parse_aware_datetime, int))
+
+
+def get_update_filter(since):
+    timestamp, lead_id = since
+    return Q(updated_at__gt=timestamp) | Q(updated_at=timestamp, id__gt=lead_id)
+
+
+def get_delete_filter(since):
+    timestamp, lead_id = since
+    return Q(deleted_at__gt=timestamp) | Q(deleted_at=timestamp, lead_id__gt=lead_id)
+
+
+def get_lead_changes(organisation, since=None, limit=500, columns=None):
+    """Return (changes, watermark, has_more) for the organisation's leads changed after since, a (timestamp, id) watermark.
+
+    A change is {"type": "update" or "delete", "id", "timestamp", "lead"}, lead is the values() row of the lead with
+    columns (all of them by default), None for a delete. watermark is the one to pass next time, has_more tells
+    whether there are more changes after it right now.
+    """
+    now = timezone.now()
+    if since is not None and since[0] < now - timedelta(days=settings.LEAD_TOMBSTONE_DAYS):
+        raise WatermarkExpired(since)
+    until = now - timedelta(seconds=settings.LEAD_CHANGES_SETTLE_SECONDS)
+
+    columns = columns or [field.attname for field in Lead._meta.concrete_fields]
+    updates = Lead.objects.filter(organisation=organisation, updated_at__lte=until)
+    deletes = LeadTombstone.objects.filter(organisation=organisation, deleted_at__lte=until)
+    if since is not None:
+        updates = updates.filter(get_update_filter(since))
+        deletes = deletes.filter(get_delete_filter(since))
+    # limit + 1 from each => if more than limit rows come back in total, there are more changes after this page
+    updates = updates.order_by("updated_at", "id").values(*dict.fromkeys([*columns, "id", "updated_at"]))[:limit + 1]
+    deletes = deletes.order_by("deleted_at", "lead_id").values_list("deleted_at", "lead_id")[:limit + 1]
+
+    merged = heapq.merge(
+        ((row["updated_at"], row["id"], "update", row) for row in updates),
+        ((deleted_at, lead_id, "delete", None) for deleted_at, lead_id in deletes),
+        key=lambda change: change[:2],
+    )
+    changes = []
+    fetched = 0
+    for timestamp, lead_id, change_type, row in merged:
+        fetched += 1
+        if len(changes) < limit:
+            lead = None if row is None else {column: row[column] for column in columns}
+            changes.append({"type": change_type, "id": lead_id, "timestamp": timestamp, "lead": lead})
+    has_more = fetched > limit
+    watermark = (changes[-1]["timestamp"], changes[-1]["id"]) if changes else since
+    if not has_more:
+        # nothing else up to until => the next pull can start there, so the watermark of an organisation without changes
+        # doesn't get older than the tombstones
+        watermark = max(watermark or (until, 0), (until, 0))
+    return changes, watermark, has_more
+
+
+def prune_tombstones(days=None):
+    """Delete the tombstones older than LEAD_TOMBSTONE_DAYS and return how many were deleted."""
+    days = settings.LEAD_TOMBSTONE_DAYS if days is None else days
+    deleted, _ = LeadTombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(days=days)).delete()
+    return deleted
@@ -0,0 +1,45 @@
+import django
+from django.db import connections
+from django.db.backends.base.base import BaseDatabaseWrapper
+
+# CONN_HEALTH_CHECKS of Django 4.1, for Django 3.2. With CONN_MAX_AGE a connection is kept for the next requests of the
+# thread, but the database may have closed it in between (restart, failover, idle timeout): the first query of the next
+# request would fail. A kept connection is pinged (SELECT 1) before its first query of a request, and replaced if it
+# doesn't answer. Like in Django 4.1, a request that doesn't use a connection (or a database alias) doesn't ping it.
+# Django 3.2 ignores the CONN_HEALTH_CHECKS key, Django 4.1 and later read it themselves.
+
+
+def mark_for_health_check(**kwargs):
+    # request_started: the kept connections will be checked before their first query, not now
+    for connection in connections.all():
+        connection.health_check_done = False
+
+
+def mark_as_checked(connection, **kwargs):
+    # connection_created: a connection that was just opened works, no need to ping it
+    connection.health_check_done = True
+
+
+def close_if_health_check_failed(connection):
+    if (
+        connection.connection is None
+        or not connection.settings_dict.get("CONN_HEALTH_CHECKS")
+        or getattr(connection, "health_check_done", True) # not marked: outside a request (commands, tests...)
+    ):
+        return
+    connection.health_check_done = True
+    if not connection.in_atomic_block and not connection.is_usable():
+        connection.close() # _cursor() opens a new one
+
+
+def install_health_checks():
+    """Ping a kept connection when a request asks it for its first cursor (Django 4.1 does it in _cursor() too)."""
+    if django.VERSION >= (4, 1):
+        return
+    cursor = BaseDatabaseWrapper._cursor
+
+    def _cursor(self, name=None):
+        close_if_health_check_failed(self)
+        return cursor(self, name)
+
+    BaseDatabaseWrapper._cursor = _cursor
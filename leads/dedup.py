@@ -0,0 +1,124 @@
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+from django.db.models import Count, Q
+from .bulk import get_batch_size
+from .models import Lead
+from .normalize import normalize_email, normalize_phone, normalize_name
+
+# Two leads are duplicates when they share the normalized email or phone number (see normalize.py) AND their names are
+# similar. Comparing every lead with every other lead is quadratic, so the leads are first split into blocks of leads
+# with the same email or the same phone number (a GROUP BY served by the lead_org_email_idx/lead_org_phone_idx indexes),
+# and names are only compared inside a block. The blocks are small, so the whole run is close to linear.
+
+DEFAULT_THRESHOLD = 0.8 # name similarity from 0 (nothing in common) to 1 (same name)
+DEFAULT_MAX_BLOCK_SIZE = 100 # a bigger block is a shared placeholder ("000", "noemail@..."), not a person
+
+BLOCKING_COLUMNS = ("email_normalized", "phone_normalized")
+
+
+def get_name_similarity(name, other_name):
+    return SequenceMatcher(None, name, other_name).ratio()
+
+
+def find_duplicate_lead(organisation, email, phone_number, exclude_pk=None):
+    """Return (lead, field) for a lead of the organisation with the same email or phone number, or (None, None).
+
+    field is "email" or "phone_number", whichever matched. One indexed query, used to validate a single lead.
+    """
+    email, phone = normalize_email(email), normalize_phone(phone_number)
+    condition = Q()
+    if email:
+        condition |= Q(email_normalized=email)
+    if phone:
+        condition |= Q(phone_normalized=phone)
+    if not condition:
+        return None, None
+    queryset = Lead.objects.filter(condition, organisation=organisation).only(
+        "first_name", "last_name", "email_normalized", "phone_normalized"
+    )
+    if exclude_pk is not None:
+        queryset = queryset.exclude(pk=exclude_pk)
+    lead = queryset.order_by("id").first()
+    if lead is None:
+        return None, None
+    return lead, "email" if email and lead.email_normalized == email else "phone_number"
+
+
+def get_existing_contacts(organisation, emails, phones):
+    """Return the sets of the normalized emails and phones (among the ones given) the organisation's leads already have.
+
+    For a batch of imported leads: a few queries for the whole batch instead of one per lead.
+    """
+    existing = {}
+    batch_size = get_batch_size() - 1 # the organisation is a parameter too
+    for column, values in (("email_normalized", sorted(emails)), ("phone_normalized", sorted(phones))):
+        existing[column] = set()
+        for start in range(0, len(values), batch_size):
+            existing[column].update(Lead.objects.filter(
+                organisation=organisation, **{f"{column}__in": values[start:start + batch_size]}
+            ).values_list(column, flat=True))
+    return existing["email_normalized"], existing["phone_normalized"]
+
+
+def get_blocks(organisation, max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Yield (column, key, size, lead rows) for every email and phone number shared by several leads of the organisation.
+
+    The rows of a block of more than max_block_size leads are not loaded (None), the block is only reported.
+    """
+    leads = Lead.objects.filter(organisation=organisation)
+    for column in BLOCKING_COLUMNS:
+        sizes = dict(
+            leads.exclude(**{column: ""}).values_list(column).annotate(size=Count("id")).filter(size__gt=1).order_by()
+        )
+        keys = sorted(key for key, size in sizes.items() if size <= max_block_size)
+        for key in sorted(set(sizes) - set(keys)):
+            yield column, key, sizes[key], None
+
+        batch_size = get_batch_size() - 1
+        for start in range(0, len(keys), batch_size):
+            rows = defaultdict(list)
+            for row in leads.filter(**{f"{column}__in": keys[start:start + batch_size]}).order_by("id").values(
+                "id", "first_name", "last_name", "email", "phone_number", column
+            ):
+                rows[row[column]].append(row)
+            for key in keys[start:start + batch_size]:
+                yield column, key, sizes[key], rows[key]
+
+
+def find_duplicates(organisation, threshold=DEFAULT_THRESHOLD, max_block_size=DEFAULT_MAX_BLOCK_SIZE):
+    """Return (groups, skipped): the groups of leads that look like the same person, and the blocks that were too big.
+
+    A group is a list of lead rows (id, first_name, last_name, email, phone_number), oldest lead first. Leads are grouped
+    transitively: A and B share an email, B and C a phone number => A, B and C are one group.
+    skipped is a list of (column, key, number of leads) for the blocks bigger than max_block_size.
+    """
+    parent = {} # union-find over the lead ids
+    leads = {}
+    skipped = []
+
+    def find(lead_id):
+        while parent[lead_id] != lead_id:
+            parent[lead_id] = parent[parent[lead_id]]
+            lead_id = parent[lead_id]
+        return lead_id
+
+    for column, key, size, rows in get_blocks(organisation, max_block_size):
+        if rows is None:
+            skipped.append((column, key, size))
+            continue
+        names = [normalize_name(row["first_name"], row["last_name"]) for row in rows]
+        for row in rows:
+            leads.setdefault(row["id"], row)
+            parent.setdefault(row["id"], row["id"])
+        for index, row in enumerate(rows):
+            for other_index in range(index + 1, len(rows)):
+                other = rows[other_index]
+                root, other_root = find(row["id"]), find(other["id"])
+                if root != other_root and get_name_similarity(names[index], names[other_index]) >= threshold:
+                    parent[max(root, other_root)] = min(root, other_root)
+
+    groups = defaultdict(list)
+    for lead_id in sorted(leads):
+        groups[find(lead_id)].append(leads[lead_id])
+    return [group for root, group in sorted(groups.items()) if len(group) > 1], skipped
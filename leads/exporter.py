@@ -0,0 +1,140 @@
+import csv
+import json
+from datetime import datetime, time, timedelta
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from .models import Lead
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError: # Parquet export is optional, 'pip install pyarrow' to enable it
+    pyarrow = None
+
+CHUNK_SIZE = 2000
+
+# (column in the export, field passed to values_list)
+# agent is exported as the agent's email, which is also what the importer accepts
+EXPORT_COLUMNS = (
+    ("id", "id"),
+    ("first_name", "first_name"),
+    ("last_name", "last_name"),
+    ("age", "age"),
+    ("agent", "agent__user__email"),
+    ("category", "category__name"),
+    ("description", "description"),
+    ("phone_number", "phone_number"),
+    ("email", "email"),
+    ("date_added", "date_added"),
+)
+HEADER = [column for column, field in EXPORT_COLUMNS]
+
+
+def start_of_day(date):
+    return timezone.make_aware(datetime.combine(date, time.min))
+
+
+def get_export_rows(organisation, category=None, agent=None, date_from=None, date_to=None, chunk_size=CHUNK_SIZE, using=None):
+    # using=None => the database the router picks when the rows are read
+    queryset = Lead.objects.using(using).for_organisation(organisation)
+    if category is not None:
+        queryset = queryset.filter(category=category)
+    if agent is not None:
+        queryset = queryset.filter(agent=agent)
+    # compare date_added with datetimes instead of date_added__date, so the database can use an index on date_added
+    if date_from is not None:
+        queryset = queryset.filter(date_added__gte=start_of_day(date_from))
+    if date_to is not None:
+        queryset = queryset.filter(date_added__lt=start_of_day(date_to + timedelta(days=1)))
+    # values_list => plain tuples instead of Lead instances.
+    # iterator() => rows are fetched chunk_size at a time (a server-side cursor on PostgreSQL) instead of
+    # loading the whole result into memory, so memory use stays flat however many leads are exported.
+    return queryset.order_by("id").values_list(*[field for column, field in EXPORT_COLUMNS]).iterator(chunk_size=chunk_size)
+
+
+class Echo:
+    # csv.writer needs a file to write to, this one just returns the line so it can be yielded
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(rows):
+    # DjangoJSONEncoder turns date_added into an ISO 8601 string
+    for row in rows:
+        yield json.dumps(dict(zip(HEADER, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+class StreamingSink:
+    # File-like object for ParquetWriter that hands the written bytes back instead of keeping them.
+    # tell() must keep counting from the start of the file because Parquet stores offsets in its footer.
+    closed = False
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def iter_parquet(rows, chunk_size=CHUNK_SIZE):
+    schema = pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("first_name", pyarrow.string()),
+        ("last_name", pyarrow.string()),
+        ("age", pyarrow.int64()),
+        ("agent", pyarrow.string()),
+        ("category", pyarrow.string()),
+        ("description", pyarrow.string()),
+        ("phone_number", pyarrow.string()),
+        ("email", pyarrow.string()),
+        ("date_added", pyarrow.timestamp("us", tz="UTC")),
+    ])
+    sink = StreamingSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    while True:
+        # every chunk of rows becomes one Parquet row group, written out as soon as it's full
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        columns = list(zip(*chunk))
+        writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)], schema=schema
+        ))
+        yield sink.pop()
+    writer.close()
+    yield sink.pop()
+
+
+# format => (function that turns rows into chunks of text/bytes, content type, file extension)
+EXPORT_FORMATS = {
+    "csv": (iter_csv, "text/csv", "csv"),
+    "ndjson": (iter_ndjson, "application/x-ndjson", "ndjson"),
+}
+if pyarrow is not None:
+    EXPORT_FORMATS["parquet"] = (iter_parquet, "application/vnd.apache.parquet", "parquet")
@@ -1,7 +1,9 @@
 from django import forms
 from django.contrib.auth import get_user_model
 from django.http import request
-from .models import Lead, Agent
+from .models import Lead, Agent, Category
+from .cache import cached_for_organisation
+from .dedup import find_duplicate_lead
 from django.contrib.auth.forms import UserCreationForm, UsernameField
 
 # Since AUTH_USER_MODEL has been changed because we create a customized user model instead, you can't reference User directly anymore
@@ -9,6 +11,25 @@ from django.contrib.auth.forms import UserCreationForm, UsernameField
 User = get_user_model()
 
 
+# The dropdowns of the forms below are rendered from choices cached per organisation (see leads/cache.py),
+# the field's queryset is only used to validate the submitted value. str(agent) is the agent's email.
+def get_agent_choices(organisation_id):
+    return cached_for_organisation(organisation_id, "agent_choices", lambda: list(
+        Agent.objects.filter(organisation_id=organisation_id).order_by("id").values_list("id", "user__email")
+    ))
+
+
+def get_category_choices(organisation_id):
+    return cached_for_organisation(organisation_id, "category_choices", lambda: list(
+        Category.objects.filter(organisation_id=organisation_id).order_by("id").values_list("id", "name")
+    ))
+
+
+def set_cached_choices(field, choices):
+    # same choices as the ModelChoiceField would build from its queryset, including the "---------" option
+    field.choices = ([("", field.empty_label)] if field.empty_label is not None else []) + choices
+
+
 class LeadModelForm(forms.ModelForm):
     class Meta: #provide metadata to your model, this is optional
         model = Lead
@@ -22,6 +43,33 @@ class LeadModelForm(forms.ModelForm):
             'email',
         )
 
+    def __init__(self, *args, **kwargs):
+        # request is optional here (the function based views and the importer don't pass it)
+        request = kwargs.pop("request", None)
+        super(LeadModelForm, self).__init__(*args, **kwargs)
+        # the organisation the duplicate check looks in (see clean), unknown for a new lead without the request
+        self.organisation_id = request.tenant.organisation.pk if request is not None else self.instance.organisation_id
+        # LeadImportForm replaces the agent field with a CharField, it has no queryset or choices
+        if isinstance(self.fields.get("agent"), forms.ModelChoiceField):
+            if request is None:
+                # the dropdown shows str(agent) = agent.user.email, join the user instead of one query per agent
+                self.fields["agent"].queryset = Agent.objects.with_user()
+            else:
+                self.fields["agent"].queryset = Agent.objects.for_user(request.user) # only the agents of the organisation can be picked
+                set_cached_choices(self.fields["agent"], get_agent_choices(request.tenant.organisation.pk))
+
+    def clean(self):
+        cleaned_data = super(LeadModelForm, self).clean()
+        # one indexed query, and only when the email or the phone number is new or changed
+        if self.organisation_id is not None and {"email", "phone_number"} & set(self.changed_data):
+            lead, field = find_duplicate_lead(
+                self.organisation_id, cleaned_data.get("email"), cleaned_data.get("phone_number"), exclude_pk=self.instance.pk
+            )
+            if lead is not None:
+                label = "email" if field == "email" else "phone number"
+                self.add_error(field, f"A lead with this {label} already exists: {lead} (#{lead.pk}).")
+        return cleaned_data
+
 class LeadForm(forms.Form):
     first_name = forms.CharField()
     last_name = forms.CharField()
@@ -41,9 +89,10 @@ class AssignAgentForm(forms.Form):
         # A dictionary that includes "request" will be populated into the kwargs as one of its elements.
         # Remove "request" from kwargs and store it in "request" object/instance
         request = kwargs.pop("request") # Form's __init__  method doesn't take user argument (request), so we remove "request" from __init__ and store it in "request" variable instead
-        agents = Agent.objects.filter(organisation=request.user.userprofile) # request is now available for use
+        agents = Agent.objects.for_user(request.user) # request is now available for use
         super(AssignAgentForm, self).__init__(*args, **kwargs) # Call __init__ from Form class
         self.fields["agent"].queryset = agents # assign agent list of the specified organisation to the Agent dropdown
+        set_cached_choices(self.fields["agent"], get_agent_choices(request.tenant.organisation.pk)) # render it without a query
 
 
 class LeadCategoryUpdateForm(forms.ModelForm):
@@ -51,4 +100,146 @@ class LeadCategoryUpdateForm(forms.ModelForm):
         model = Lead
         fields = (
             'category',
-        )
\ No newline at end of file
+        )
+
+    def __init__(self, *args, **kwargs):
+        request = kwargs.pop("request", None)
+        super(LeadCategoryUpdateForm, self).__init__(*args, **kwargs)
+        if request is not None:
+            self.fields["category"].queryset = Category.objects.for_user(request.user) # only the categories of the organisation
+            set_cached_choices(self.fields["category"], get_category_choices(request.tenant.organisation.pk))
+
+class LeadImportForm(LeadModelForm):
+    # Validates one imported row with the same rules as LeadModelForm.
+    # The agent is not a model field here, so validating a row doesn't run a query to check that the agent exists:
+    # it's looked up in the organisation's agents that are loaded once for the whole import.
+    agent = forms.CharField(required=False)
+
+    class Meta(LeadModelForm.Meta):
+        fields = tuple(field for field in LeadModelForm.Meta.fields if field != 'agent')
+
+    def __init__(self, *args, **kwargs):
+        self.agents = kwargs.pop("agents") # {"<agent id>" or "<agent email>": agent}
+        super(LeadImportForm, self).__init__(*args, **kwargs)
+
+    def clean_agent(self):
+        agent = self.cleaned_data["agent"].strip().lower()
+        if not agent:
+            return None
+        if agent not in self.agents:
+            raise forms.ValidationError("No agent with this id or email in your organisation.")
+        return self.agents[agent]
+
+
+class LeadImportUploadForm(forms.Form):
+    FORMAT_CHOICES = (
+        ("csv", "CSV"),
+        ("ndjson", "NDJSON (one JSON object per line)"),
+    )
+    file = forms.FileField(help_text="Columns: first_name, last_name, age, agent (id or email), description, phone_number, email")
+    format = forms.ChoiceField(choices=FORMAT_CHOICES)
+
+
+class LeadExportForm(forms.Form):
+    format = forms.ChoiceField(choices=())
+    category = forms.ModelChoiceField(queryset=Category.objects.none(), required=False)
+    agent = forms.ModelChoiceField(queryset=Agent.objects.none(), required=False)
+    date_from = forms.DateField(required=False, help_text="YYYY-MM-DD")
+    date_to = forms.DateField(required=False, help_text="YYYY-MM-DD")
+
+    def __init__(self, *args, **kwargs):
+        organisation = kwargs.pop("organisation")
+        formats = kwargs.pop("formats") # parquet is only available when pyarrow is installed
+        super(LeadExportForm, self).__init__(*args, **kwargs)
+        self.fields["format"].choices = [(format, format.upper()) for format in formats]
+        # only the categories and agents of the user's organisation can be picked
+        self.fields["category"].queryset = Category.objects.for_organisation(organisation)
+        self.fields["agent"].queryset = Agent.objects.for_organisation(organisation)
+        set_cached_choices(self.fields["category"], get_category_choices(organisation.pk))
+        set_cached_choices(self.fields["agent"], get_agent_choices(organisation.pk))
+
+
+class LeadAutoAssignForm(forms.Form):
+    # keys of ASSIGNMENT_STRATEGIES in assignment.py
+    STRATEGY_CHOICES = (
+        ("round-robin", "Round robin: every agent gets a lead in turn"),
+        ("least-loaded", "Least loaded: agents with the fewest leads get them first"),
+        ("weighted", "Weighted: in proportion to the capacity of every agent"),
+    )
+    strategy = forms.ChoiceField(choices=STRATEGY_CHOICES)
+    limit = forms.IntegerField(min_value=1, required=False, help_text="Oldest leads first, leave empty to assign all of them")
+
+
+class LeadIdsField(forms.Field):
+    # the lead checkboxes of the lead list, as a list of ids
+    widget = forms.MultipleHiddenInput
+    max_ids = 1000 # more than that => "All leads" (select_all) instead of sending every id
+
+    def to_python(self, value):
+        if not value:
+            return []
+        try:
+            lead_ids = [int(lead_id) for lead_id in value]
+        except (TypeError, ValueError):
+            raise forms.ValidationError("Invalid lead id.")
+        if len(lead_ids) > self.max_ids:
+            raise forms.ValidationError(f"Select at most {self.max_ids} leads, or all of them.")
+        return lead_ids
+
+
+class LeadBulkActionForm(forms.Form):
+    ACTION_CHOICES = (
+        ("assign", "Assign to agent"),
+        ("categorize", "Change category"),
+        ("delete", "Delete"),
+    )
+    action = forms.ChoiceField(choices=ACTION_CHOICES)
+    leads = LeadIdsField(required=False)
+    select_all = forms.BooleanField(required=False) # every lead matching q instead of the checked ones
+    q = forms.CharField(required=False, widget=forms.HiddenInput) # the search of the lead list
+    agent = forms.ModelChoiceField(queryset=Agent.objects.none(), required=False)
+    category = forms.ModelChoiceField(queryset=Category.objects.none(), required=False, empty_label="No category")
+    # a deletion can't be undone (with select_all it's every lead of the organisation), it must be confirmed
+    confirm_delete = forms.BooleanField(required=False)
+
+    def __init__(self, *args, **kwargs):
+        request = kwargs.pop("request")
+        super(LeadBulkActionForm, self).__init__(*args, **kwargs)
+        # only the agents and categories of the organisation can be picked, the dropdowns are rendered without a query
+        self.fields["agent"].queryset = Agent.objects.for_user(request.user)
+        self.fields["category"].queryset = Category.objects.for_user(request.user)
+        set_cached_choices(self.fields["agent"], get_agent_choices(request.tenant.organisation.pk))
+        set_cached_choices(self.fields["category"], get_category_choices(request.tenant.organisation.pk))
+
+    def clean(self):
+        cleaned_data = super(LeadBulkActionForm, self).clean()
+        if not cleaned_data.get("leads") and not cleaned_data.get("select_all"):
+            raise forms.ValidationError("Select at least one lead.")
+        if cleaned_data.get("action") == "assign" and cleaned_data.get("agent") is None:
+            self.add_error("agent", "Pick the agent to assign the leads to.")
+        if cleaned_data.get("action") == "delete" and not cleaned_data.get("confirm_delete"):
+            self.add_error("confirm_delete", "Tick Confirm the deletion to delete the leads.")
+        return cleaned_data
+
+
+class LeadApiForm(LeadModelForm):
+    # the JSON API (api.py) writes the category together with the other fields
+    class Meta(LeadModelForm.Meta):
+        fields = LeadModelForm.Meta.fields + ('category',)
+
+    def __init__(self, *args, **kwargs):
+        request = kwargs["request"]
+        super(LeadApiForm, self).__init__(*args, **kwargs)
+        self.fields["category"].queryset = Category.objects.for_user(request.user) # only the categories of the organisation
+
+
+class CategoryModelForm(forms.ModelForm):
+    class Meta:
+        model = Category
+        fields = (
+            'name',
+        )
+
+    def __init__(self, *args, **kwargs):
+        kwargs.pop("request", None) # same signature as LeadApiForm, a category has no choices to limit
+        super(CategoryModelForm, self).__init__(*args, **kwargs)
@@ -0,0 +1,134 @@
+import csv
+import io
+import json
+from collections import Counter
+
+from django.db import transaction
+from .cache import invalidate_organisation_cache
+from .dedup import get_existing_contacts
+from .forms import LeadImportForm
+from .models import Agent, Lead, change_agent_counter, change_category_counter
+from .normalize import normalize_email, normalize_phone
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def iter_csv_rows(stream):
+    # DictReader reads one line at a time, the file is never loaded into memory as a whole
+    for row in csv.DictReader(stream):
+        yield row
+
+
+def iter_ndjson_rows(stream):
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as error:
+            row = error # reported as an error for this row, the import carries on with the next line
+        yield row
+
+
+ROW_READERS = {
+    "csv": iter_csv_rows,
+    "ndjson": iter_ndjson_rows,
+}
+
+
+def open_text(binary_file):
+    # uploaded files and files opened in "rb" mode give bytes, csv and json need text.
+    # utf-8-sig also strips the byte order mark Excel puts at the start of CSV files.
+    return io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline="")
+
+
+def get_agent_lookup(organisation):
+    # Every agent of the organisation, by id and by email, loaded with one query for the whole import
+    agents = {}
+    for agent in Agent.objects.for_organisation(organisation).with_user():
+        agents[str(agent.pk)] = agent
+        if agent.user.email:
+            agents[agent.user.email.lower()] = agent
+    return agents
+
+
+class ImportResult:
+    def __init__(self):
+        self.created = 0
+        self.errors = [] # [{"row": 3, "errors": {"email": ["Enter a valid email address."]}}]
+
+    def add_error(self, row_number, errors):
+        self.errors.append({"row": row_number, "errors": errors})
+
+
+def import_leads(stream, format, organisation, batch_size=DEFAULT_BATCH_SIZE):
+    """Validate and create the leads of a CSV/NDJSON text stream for an organisation.
+
+    Valid rows are written with bulk_create, batch_size rows at a time, each batch in its own transaction.
+    Invalid rows are skipped and reported in the returned ImportResult, and so are the duplicates: rows with the email
+    or the phone number of a lead of the organisation, or of an earlier row of the file.
+    """
+    result = ImportResult()
+    agents = get_agent_lookup(organisation)
+    seen = (set(), set()) # the normalized emails and phone numbers of the rows imported so far
+    batch = [] # [(row number, lead)]
+    # row 1 of a CSV file is the header, so the first lead is on line 2
+    first_row_number = 2 if format == "csv" else 1
+    for row_number, row in enumerate(ROW_READERS[format](stream), start=first_row_number):
+        if not isinstance(row, dict):
+            result.add_error(row_number, {"__all__": [f"Invalid row: {row}"]})
+            continue
+        form = LeadImportForm(data=row, agents=agents)
+        if not form.is_valid():
+            result.add_error(row_number, {field: list(errors) for field, errors in form.errors.items()})
+            continue
+        lead = form.save(commit=False) # build the Lead instance without saving it
+        lead.agent = form.cleaned_data["agent"]
+        lead.organisation = organisation
+        batch.append((row_number, lead))
+        if len(batch) >= batch_size:
+            result.created += save_batch(remove_duplicates(batch, organisation, seen, result), organisation)
+            batch = []
+    if batch:
+        result.created += save_batch(remove_duplicates(batch, organisation, seen, result), organisation)
+    result.errors.sort(key=lambda error: error["row"]) # the duplicates of a batch are found after its invalid rows
+    return result
+
+
+def remove_duplicates(batch, organisation, seen, result):
+    # The existing leads are looked up for the whole batch at once (see dedup.get_existing_contacts), not per row.
+    # The duplicates are reported as errors of their row, the other leads are returned and added to seen.
+    seen_emails, seen_phones = seen
+    contacts = [(normalize_email(lead.email), normalize_phone(lead.phone_number)) for _, lead in batch]
+    existing_emails, existing_phones = get_existing_contacts(
+        organisation, {email for email, _ in contacts if email}, {phone for _, phone in contacts if phone}
+    )
+    leads = []
+    for (row_number, lead), (email, phone) in zip(batch, contacts):
+        errors = {}
+        if email and (email in existing_emails or email in seen_emails):
+            errors["email"] = ["A lead with this email already exists."]
+        if phone and (phone in existing_phones or phone in seen_phones):
+            errors["phone_number"] = ["A lead with this phone number already exists."]
+        if errors:
+            result.add_error(row_number, errors)
+            continue
+        seen_emails.add(email)
+        seen_phones.add(phone)
+        leads.append(lead)
+    return leads
+
+
+@transaction.atomic
+def save_batch(leads, organisation):
+    if not leads:
+        return 0
+    # bulk_create inserts the whole batch with one INSERT, but it doesn't send post_save signals,
+    # so the lead counters (see models.py) are updated here: one UPDATE per agent instead of one per lead
+    Lead.objects.bulk_create(leads, batch_size=len(leads))
+    change_category_counter(organisation.pk, None, len(leads)) # imported leads have no category yet
+    for agent_id, count in Counter(lead.agent_id for lead in leads if lead.agent_id).items():
+        change_agent_counter(agent_id, count)
+    invalidate_organisation_cache(organisation.pk) # no post_save either, so the cache version is bumped here too
+    return len(leads)
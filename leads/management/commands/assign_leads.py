@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from leads.assignment import ASSIGNMENT_STRATEGIES, assign_leads
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Assign the unassigned leads of an organisation to its agents, in one transaction"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--organisation", required=True, help="Username of the organisor the leads belong to")
+        parser.add_argument("--strategy", choices=sorted(ASSIGNMENT_STRATEGIES), default="round-robin")
+        parser.add_argument("--limit", type=int, help="Only assign this many leads, oldest first")
+
+    def handle(self, *args, **options):
+        try:
+            organisation = UserProfile.objects.get(user__username=options["organisation"])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"Organisation '{options['organisation']}' does not exist")
+
+        counts = assign_leads(organisation, options["strategy"], limit=options["limit"])
+        for agent, count in sorted(counts.items(), key=lambda item: item[0].pk):
+            self.stdout.write(f"Agent {agent.pk}: {count} leads")
+        self.stdout.write(self.style.SUCCESS(f"Assigned {sum(counts.values())} leads to {len(counts)} agents"))
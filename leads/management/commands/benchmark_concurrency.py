@@ -0,0 +1,50 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from leads.benchmark import get_concurrency_paths, get_session_cookie, run_load_test
+from leads.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test the lead and category pages of running servers at several concurrency levels, e.g. the WSGI "
+        "profile (gunicorn) against the ASGI one (gunicorn -c gunicorn_asgi.conf.py djcrm.asgi:application). "
+        "The servers must use the same database as this command, run 'py manage.py seed_crm' first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", help="Base URL of every server to compare, e.g. http://127.0.0.1:8000")
+        parser.add_argument("--user", default="seed-org1", help="Username the pages are requested as")
+        parser.add_argument("--concurrency", default="1,10,50", help="Comma separated numbers of requests in flight")
+        parser.add_argument("--requests", type=int, default=200, help="Requests per server and concurrency level")
+        parser.add_argument("--output", help="Save the results to this JSON file")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options["concurrency"].split(",")]
+        except ValueError:
+            raise CommandError("--concurrency must be comma separated numbers")
+        if min(levels) < 1 or options["requests"] < 1:
+            raise CommandError("--concurrency and --requests must be at least 1")
+        try:
+            user = User.objects.select_related("userprofile", "agent__organisation").get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist, run seed_crm first or pass --user")
+
+        paths = get_concurrency_paths(user)
+        cookie = get_session_cookie(user)
+        results = {}
+        self.stdout.write(f"{'server':30} {'concurrency':>11} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>6}")
+        for url in options["urls"]:
+            results[url] = []
+            for level in levels:
+                result = run_load_test(url, paths, cookie, level, options["requests"])
+                results[url].append(result)
+                self.stdout.write(
+                    f"{url:30} {level:>11} {result['requests_per_second']:>8.1f} {result['p50']:>9.2f} "
+                    f"{result['p95']:>9.2f} {result['p99']:>9.2f} {result['errors']:>6}"
+                )
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2, sort_keys=True)
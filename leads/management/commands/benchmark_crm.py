@@ -0,0 +1,56 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from leads.benchmark import compare_with_baseline, run_benchmark
+from leads.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Request every page of the leads and agents apps, report p50/p95/p99 latency and query counts "
+        "and compare them with a saved baseline. Run 'py manage.py seed_crm' first."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", default="seed-org1", help="Username the pages are requested as")
+        parser.add_argument("--requests", type=int, default=20, help="Measured requests per page")
+        parser.add_argument("--warmup", type=int, default=2, help="Requests per page before measuring")
+        parser.add_argument("--output", help="Save the results to this JSON file, e.g. to use it as the next baseline")
+        parser.add_argument("--baseline", help="JSON file of an earlier run, exit with an error if a page got slower")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p95 increase, 0.2 = 20%%")
+        parser.add_argument("--min-delta", type=float, default=2.0, help="Allowed p95 increase in milliseconds")
+
+    def handle(self, *args, **options):
+        if options["requests"] < 1:
+            raise CommandError("--requests must be at least 1")
+        try:
+            user = User.objects.select_related("userprofile", "agent__organisation").get(username=options["user"])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['user']}' does not exist, run seed_crm first or pass --user")
+
+        # the test client sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            results = run_benchmark(user, options["requests"], options["warmup"])
+
+        self.stdout.write(f"{'page':45} {'status':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8}")
+        for name, result in results.items():
+            self.stdout.write(
+                f"{name:45} {result['status']:>6} {result['p50']:>9.2f} {result['p95']:>9.2f} "
+                f"{result['p99']:>9.2f} {result['queries']:>8}"
+            )
+
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+
+        if options["baseline"]:
+            with open(options["baseline"]) as file:
+                baseline = json.load(file)
+            regressions = compare_with_baseline(results, baseline, options["tolerance"], options["min_delta"])
+            if regressions:
+                for regression in regressions:
+                    self.stderr.write(regression)
+                raise CommandError(f"{len(regressions)} pages are slower than the baseline")
+            self.stdout.write(self.style.SUCCESS("No page is slower than the baseline"))
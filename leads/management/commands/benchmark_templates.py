@@ -0,0 +1,71 @@
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template import engines
+from django.template.backends.jinja2 import Jinja2
+from django.test import RequestFactory
+from leads.models import User, UserProfile, Agent, Category, Lead
+
+
+def build_rows(count):
+    # unsaved objects with their pk set, the benchmark only measures rendering, not the database
+    organisation = UserProfile(pk=1)
+    categories = [Category(pk=number, name=f"Category {number}", organisation=organisation) for number in range(1, 6)]
+    agents = [
+        Agent(pk=number, organisation=organisation, lead_count=number, user=User(
+            pk=number, username=f"agent{number}", first_name="Agent", last_name=str(number), email=f"agent{number}@test.com",
+        ))
+        for number in range(1, count + 1)
+    ]
+    leads = [
+        Lead(
+            pk=number, first_name="First", last_name=f"Last {number}", age=30, email=f"lead{number}@test.com",
+            phone_number="555 1234", organisation=organisation,
+            agent=agents[number % len(agents)], category=categories[number % 7] if number % 7 < 5 else None,
+        )
+        for number in range(1, count + 1)
+    ]
+    return categories, agents, leads
+
+
+class Command(BaseCommand):
+    help = "Compare how long the Django and the Jinja2 versions of the list templates take to render N rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000])
+        parser.add_argument("--repeat", type=int, default=5, help="Renders per template, the median is reported")
+
+    def handle(self, *args, **options):
+        params = dict(settings.JINJA2_BACKEND, NAME="jinja2")
+        params.pop("BACKEND")
+        backends = {"django": engines["django"], "jinja2": Jinja2(params)}
+
+        request = RequestFactory().get("/")
+        request.user = User(username="organisor", is_organisor=True)
+        request.tenant = SimpleNamespace(organisation=None) # no {% organisation_cache %}, every render does the work
+
+        self.stdout.write(f"{'template':28} {'rows':>7} {'django ms':>10} {'jinja2 ms':>10} {'speedup':>8}")
+        for count in options["rows"]:
+            categories, agents, leads = build_rows(count)
+            pages = {
+                "leads/lead_list.html": {"leads": leads, "q": "", "is_paginated": False, "unassigned_leads": []},
+                "leads/category_detail.html": {"category": categories[0], "leads": leads},
+                "agents/agent_list.html": {"agents": agents},
+            }
+            for name, context in pages.items():
+                timings = {}
+                for backend_name, backend in backends.items():
+                    template = backend.get_template(name) # compiled once, only rendering is measured
+                    durations = []
+                    for _ in range(options["repeat"]):
+                        start = time.perf_counter()
+                        template.render(dict(context), request)
+                        durations.append((time.perf_counter() - start) * 1000)
+                    timings[backend_name] = statistics.median(durations)
+                self.stdout.write(
+                    f"{name:28} {count:>7} {timings['django']:>10.1f} {timings['jinja2']:>10.1f} "
+                    f"{timings['django'] / timings['jinja2']:>7.1f}x"
+                )
@@ -0,0 +1,48 @@
+import sys
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from leads.exporter import EXPORT_FORMATS, get_export_rows
+from leads.models import Agent, Category, UserProfile
+from leads.replicas import read_from_replica
+
+
+class Command(BaseCommand):
+    help = "Export the leads of an organisation as CSV, NDJSON or Parquet, streamed with a server-side cursor"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--organisation", required=True, help="Username of the organisor the leads belong to")
+        parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+        parser.add_argument("--output", default="-", help="File to write to, - for stdout")
+        parser.add_argument("--category", type=int, help="Only export the leads of this category id")
+        parser.add_argument("--agent", type=int, help="Only export the leads of this agent id")
+        parser.add_argument("--date-from", type=date.fromisoformat, help="YYYY-MM-DD, first day included")
+        parser.add_argument("--date-to", type=date.fromisoformat, help="YYYY-MM-DD, last day included")
+
+    def handle(self, *args, **options):
+        # a long read that doesn't need the last second's writes: from a replica when there is one
+        with read_from_replica():
+            self.export(options)
+
+    def export(self, options):
+        try:
+            organisation = UserProfile.objects.get(user__username=options["organisation"])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"Organisation '{options['organisation']}' does not exist")
+        try:
+            category = Category.objects.get(pk=options["category"], organisation=organisation) if options["category"] else None
+            agent = Agent.objects.get(pk=options["agent"], organisation=organisation) if options["agent"] else None
+        except (Category.DoesNotExist, Agent.DoesNotExist):
+            raise CommandError("The category or agent does not exist in this organisation")
+
+        rows = get_export_rows(
+            organisation, category=category, agent=agent, date_from=options["date_from"], date_to=options["date_to"],
+        )
+        write, content_type, extension = EXPORT_FORMATS[options["format"]]
+        output = sys.stdout.buffer if options["output"] == "-" else open(options["output"], "wb")
+        try:
+            for chunk in write(rows):
+                output.write(chunk.encode() if isinstance(chunk, str) else chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
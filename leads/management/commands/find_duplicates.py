@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from leads.dedup import DEFAULT_MAX_BLOCK_SIZE, DEFAULT_THRESHOLD, find_duplicates
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "List the leads of an organisation that look like the same person (same email or phone number, similar name)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--organisation", required=True, help="Username of the organisor the leads belong to")
+        parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Name similarity from 0 to 1")
+        parser.add_argument(
+            "--max-block-size", type=int, default=DEFAULT_MAX_BLOCK_SIZE,
+            help="Emails and phone numbers shared by more leads than this are reported, not compared",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            organisation = UserProfile.objects.get(user__username=options["organisation"])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"Organisation '{options['organisation']}' does not exist")
+        if not 0 <= options["threshold"] <= 1:
+            raise CommandError("--threshold must be between 0 and 1")
+
+        groups, skipped = find_duplicates(organisation, options["threshold"], options["max_block_size"])
+        for group in groups:
+            self.stdout.write(", ".join(
+                f"#{lead['id']} {lead['first_name']} {lead['last_name']} <{lead['email']}> {lead['phone_number']}" for lead in group
+            ))
+        for column, key, size in skipped:
+            self.stderr.write(self.style.WARNING(f"Skipped {column}={key}: shared by {size} leads"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Found {len(groups)} groups of duplicates ({sum(len(group) for group in groups)} leads)"
+        ))
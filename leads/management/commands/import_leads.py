@@ -0,0 +1,42 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from leads.importer import DEFAULT_BATCH_SIZE, ROW_READERS, import_leads, open_text
+from leads.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = "Import leads for an organisation from a CSV or NDJSON file, streamed and saved in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import, or - to read from stdin")
+        parser.add_argument("--organisation", required=True, help="Username of the organisor the leads belong to")
+        parser.add_argument("--format", choices=sorted(ROW_READERS), help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Leads per INSERT and per transaction")
+        parser.add_argument("--errors", help="Write the per-row error report to this NDJSON file instead of stderr")
+
+    def handle(self, *args, **options):
+        try:
+            organisation = UserProfile.objects.get(user__username=options["organisation"])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"Organisation '{options['organisation']}' does not exist")
+
+        format = options["format"] or options["path"].rsplit(".", 1)[-1].lower()
+        if format not in ROW_READERS:
+            raise CommandError("Can't tell the format from the file name, use --format")
+
+        if options["path"] == "-":
+            result = import_leads(open_text(sys.stdin.buffer), format, organisation, options["batch_size"])
+        else:
+            with open(options["path"], "rb") as file:
+                result = import_leads(open_text(file), format, organisation, options["batch_size"])
+
+        if options["errors"]:
+            with open(options["errors"], "w") as file:
+                for error in result.errors:
+                    file.write(json.dumps(error) + "\n")
+        else:
+            for error in result.errors:
+                self.stderr.write(json.dumps(error))
+        self.stdout.write(self.style.SUCCESS(f"Imported {result.created} leads, {len(result.errors)} rows had errors"))
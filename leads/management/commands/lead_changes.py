@@ -0,0 +1,54 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404
+from leads.changes import WatermarkExpired, decode_watermark, get_lead_changes, prune_tombstones
+from leads.models import UserProfile
+from leads.pagination import encode_cursor
+
+
+class Command(BaseCommand):
+    help = "Write the lead changes of an organisation since a watermark as NDJSON, and/or delete the old tombstones"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--organisation", help="Username of the organisor the leads belong to")
+        parser.add_argument("--since", help="Watermark printed by the previous run, leave empty for every lead")
+        parser.add_argument("--output", help="File to write the changes to, stdout by default")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--prune", action="store_true", help="Delete the tombstones older than LEAD_TOMBSTONE_DAYS")
+
+    def handle(self, *args, **options):
+        if not options["organisation"] and not options["prune"]:
+            raise CommandError("Pass --organisation, --prune or both")
+        if options["prune"]:
+            self.stderr.write(f"Deleted {prune_tombstones()} tombstones")
+        if not options["organisation"]:
+            return
+
+        try:
+            organisation = UserProfile.objects.get(user__username=options["organisation"])
+        except UserProfile.DoesNotExist:
+            raise CommandError(f"Organisation '{options['organisation']}' does not exist")
+        try:
+            watermark = decode_watermark(options["since"]) if options["since"] else None
+        except Http404:
+            raise CommandError(f"Invalid watermark '{options['since']}'")
+
+        output = open(options["output"], "w", encoding="utf-8") if options["output"] else self.stdout
+        count = 0
+        try:
+            # one page after the other until the feed is drained, every page starts at the watermark of the previous one
+            has_more = True
+            while has_more:
+                changes, watermark, has_more = get_lead_changes(organisation, since=watermark, limit=options["batch_size"])
+                for change in changes:
+                    output.write(json.dumps(change, cls=DjangoJSONEncoder) + "\n")
+                count += len(changes)
+        except WatermarkExpired:
+            raise CommandError("The watermark is older than the tombstones, run it again without --since to sync everything")
+        finally:
+            if options["output"]:
+                output.close()
+        # on stderr, so stdout only has the changes
+        self.stderr.write(f"{count} changes, next watermark: {encode_cursor(watermark) if watermark else ''}")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from leads.cache import invalidate_organisation_cache
+from leads.models import Lead, Agent, Category, UserProfile
+
+
+# (model, counter field, Lead field the counter groups by, filter of the leads that are counted, organisation field)
+COUNTERS = (
+    (Category, "lead_count", "category", {"category__isnull": False}, "organisation_id"),
+    (Agent, "lead_count", "agent", {"agent__isnull": False}, "organisation_id"),
+    (UserProfile, "uncategorised_lead_count", "organisation", {"category__isnull": True}, "id"),
+)
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized lead counters of categories, agents and organisations from the leads table"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify", action="store_true",
+            help="Only report counters that don't match the leads table, exit with an error if there are any",
+        )
+
+    def handle(self, *args, **options):
+        mismatches = 0
+        # one transaction, so the rebuilt counters are consistent with each other
+        with transaction.atomic():
+            for model, field, lead_field, filters, organisation_field in COUNTERS:
+                # SELECT <lead_field>, COUNT(id) FROM leads_lead GROUP BY <lead_field>
+                counts = dict(
+                    Lead.objects.filter(**filters).values_list(lead_field).annotate(Count("id")).order_by()
+                )
+                wrong = []
+                for obj in model.objects.only("id", field, organisation_field).iterator():
+                    expected = counts.get(obj.pk, 0)
+                    if getattr(obj, field) != expected:
+                        self.stdout.write(f"{model.__name__} {obj.pk}: {field} is {getattr(obj, field)}, expected {expected}")
+                        setattr(obj, field, expected)
+                        wrong.append(obj)
+                mismatches += len(wrong)
+                if not options["verify"]:
+                    model.objects.bulk_update(wrong, [field], batch_size=500)
+                    # bulk_update sends no signals, the cached pages showing the counters are made stale here
+                    for organisation_id in {getattr(obj, organisation_field) for obj in wrong}:
+                        invalidate_organisation_cache(organisation_id)
+
+        if options["verify"]:
+            if mismatches:
+                raise CommandError(f"{mismatches} lead counters are out of date, run rebuild_lead_counters to fix them")
+            self.stdout.write(self.style.SUCCESS("All lead counters are up to date"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt lead counters, {mismatches} were fixed"))
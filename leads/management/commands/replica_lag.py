@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from leads.replicas import get_replica_lag
+
+
+class Command(BaseCommand):
+    help = "Print how many seconds each read replica is behind the default database"
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            self.stderr.write("No replica configured, see DATABASE_REPLICA_URLS")
+            return
+        for alias in settings.DATABASE_REPLICAS:
+            lag = get_replica_lag(alias, max_age=0) # measured now
+            if lag is None:
+                status = "unknown (the database can't tell)"
+            elif lag == float("inf"):
+                status = "unreachable"
+            else:
+                status = f"{lag:.1f}s" + (" (skipped, above REPLICA_MAX_LAG)" if lag > settings.REPLICA_MAX_LAG else "")
+            self.stdout.write(f"{alias}: {status}")
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from leads.outbox import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = "Send the emails queued in the outbox, in batches over one SMTP connection per batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Emails per batch (default: OUTBOX_BATCH_SIZE)")
+        parser.add_argument("--interval", type=float, default=5, help="Seconds to sleep when the outbox is empty")
+        parser.add_argument("--once", action="store_true", help="Exit once there are no more due emails instead of polling")
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            processed = send_queued_emails(batch_size=options["batch_size"])
+            total += processed
+            if processed:
+                self.stdout.write(f"Processed {processed} emails")
+                continue # keep draining while there is a backlog
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
+        self.stdout.write(self.style.SUCCESS(f"Outbox drained, {total} emails processed"))
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from leads.models import User
+from leads.seed import DEFAULT_BATCH_SIZE, Seeder
+
+
+class Command(BaseCommand):
+    help = "Fill the database with generated organisations, agents, categories and leads for load tests and benchmarks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--organisations", type=int, default=10)
+        parser.add_argument("--agents", type=int, default=20, help="Agents per organisation")
+        parser.add_argument("--categories", type=int, default=6, help="Categories per organisation")
+        parser.add_argument(
+            "--leads", type=int, default=100000,
+            help="Leads in total, split between the organisations so that the first one is the biggest",
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Same seed => same data")
+        parser.add_argument("--prefix", default="seed", help="Usernames are <prefix>-org1, <prefix>-org1-agent1, ...")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Leads per INSERT and per transaction")
+
+    def handle(self, *args, **options):
+        if options["organisations"] < 1:
+            raise CommandError("--organisations must be at least 1")
+        if User.objects.filter(username__startswith=f"{options['prefix']}-").exists():
+            raise CommandError(f"Users starting with '{options['prefix']}-' already exist, pick another --prefix")
+
+        start = time.perf_counter()
+        seeder = Seeder(
+            organisations=options["organisations"],
+            agents=options["agents"],
+            categories=options["categories"],
+            leads=options["leads"],
+            seed=options["seed"],
+            prefix=options["prefix"],
+            batch_size=options["batch_size"],
+            stdout=self.stdout,
+        )
+        organisations = seeder.run()
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(organisations)} organisations and {options['leads']} leads in {time.perf_counter() - start:.1f}s, "
+            f"log in as {organisations[0].user.username} / password"
+        ))
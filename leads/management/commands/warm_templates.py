@@ -0,0 +1,87 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.template import TemplateSyntaxError, engines
+from django.template.backends.jinja2 import Jinja2
+from django.template.loaders.cached import Loader as CachedLoader
+from django.template.utils import get_app_template_dirs
+
+
+def get_template_dirs(backend):
+    # The DIRS of the backend (templates/, jinja2/) and the folders of the project's own apps
+    # (leads/templates, agents/templates, leads/jinja2, agents/jinja2), not the ones of Django and third party apps.
+    base_dir = Path(settings.BASE_DIR).resolve()
+    directories = [Path(directory) for directory in backend.dirs]
+    for directory in get_app_template_dirs(backend.app_dirname):
+        if base_dir in Path(directory).resolve().parents:
+            directories.append(Path(directory))
+    return directories
+
+
+def get_template_names(backend):
+    names = []
+    for directory in get_template_dirs(backend):
+        for path in sorted(Path(directory).rglob("*")):
+            if path.is_file():
+                names.append(path.relative_to(directory).as_posix())
+    return names
+
+
+def get_crispy_template_names():
+    pack = getattr(settings, "CRISPY_TEMPLATE_PACK", None)
+    if not pack:
+        return []
+    names = []
+    for directory in get_app_template_dirs('templates'):
+        pack_directory = Path(directory) / pack
+        if pack_directory.is_dir():
+            names.extend(path.relative_to(directory).as_posix() for path in sorted(pack_directory.rglob("*.html")))
+    return names
+
+
+class Command(BaseCommand):
+    help = (
+        "Compile every template of the project so the cached template loader (and Jinja2, when JINJA2_TEMPLATES is on) "
+        "doesn't have to on the first request. "
+        "Run by every gunicorn worker when it starts (see gunicorn.conf.py)."
+    )
+
+    def handle(self, *args, **options):
+        engine = engines["django"].engine
+        if not any(isinstance(loader, CachedLoader) for loader in engine.template_loaders):
+            self.stdout.write(self.style.WARNING(
+                "The cached template loader is not enabled (see djcrm/settings_production.py), "
+                "the compiled templates are not kept"
+            ))
+
+        # the Jinja2 environment keeps the templates it compiled too (see JINJA2_TEMPLATES in settings.py)
+        backends = [engines["django"]] + [backend for backend in engines.all() if isinstance(backend, Jinja2)]
+        names = []
+        errors = []
+        for backend in backends:
+            for name in get_template_names(backend):
+                names.append(name)
+                try:
+                    backend.get_template(name)
+                except TemplateSyntaxError as error:
+                    errors.append(f"{name}: {error}")
+        compiled = len(names) - len(errors)
+
+        # A few crispy templates can't be compiled on their own (they use tags loaded by the template that includes them),
+        # those are compiled the first time they're used, like before
+        for name in get_crispy_template_names():
+            if name in names:
+                continue
+            try:
+                engine.get_template(name)
+                compiled += 1
+            except TemplateSyntaxError:
+                if options["verbosity"] > 1:
+                    self.stdout.write(f"Skipped {name}")
+
+        for error in errors:
+            self.stderr.write(error)
+        if errors:
+            raise CommandError(f"{len(errors)} templates have errors")
+        self.stdout.write(self.style.SUCCESS(f"Compiled {compiled} templates"))
@@ -0,0 +1,165 @@
+import hmac
+import os
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseForbidden
+from .middleware import SyncAndAsyncMiddleware
+
+try:
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    )
+    from prometheus_client.core import GaugeMetricFamily
+except ImportError: # metrics are optional, 'pip install prometheus-client' to enable them
+    Counter = None
+
+# With gunicorn, every worker is a separate process with its own counters. When PROMETHEUS_MULTIPROC_DIR is set
+# (see gunicorn.conf.py) prometheus_client writes them to files in that directory and /metrics adds them up,
+# so any worker can answer the scrape with the numbers of all of them.
+
+if Counter is not None:
+    REQUEST_LATENCY = Histogram(
+        "djcrm_request_duration_seconds", "Time spent answering a request", ["url_name", "method"],
+    )
+    REQUEST_DB_QUERIES = Histogram(
+        "djcrm_request_db_queries", "SQL queries run by a request", ["url_name"],
+        buckets=(1, 2, 3, 5, 10, 20, 50, 100, 200),
+    )
+    REQUEST_DB_TIME = Histogram(
+        "djcrm_request_db_duration_seconds", "Time a request spent waiting for the database", ["url_name"],
+    )
+    REQUESTS_IN_PROGRESS = Gauge(
+        "djcrm_requests_in_progress", "Requests being answered", multiprocess_mode="livesum",
+    )
+    WORKER_REQUESTS = Gauge(
+        "djcrm_worker_requests", "Requests answered by a worker since it started", multiprocess_mode="liveall",
+    )
+    CACHE_REQUESTS = Counter(
+        "djcrm_cache_requests_total", "Cache lookups", ["cache", "result"], # result = hit or miss
+    )
+    EMAIL_SEND_LATENCY = Histogram(
+        "djcrm_email_send_duration_seconds", "Time spent sending one outbox email", ["status"], # status = sent or failed
+    )
+    REPLICA_LAG = Gauge(
+        "djcrm_replica_lag_seconds", "Seconds a read replica is behind the default database", ["database"],
+        multiprocess_mode="livemax", # every worker measures it, the worst of the running ones
+    )
+
+
+def record_cache_lookup(cache, hit):
+    if Counter is not None:
+        CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_email_sent(duration, sent):
+    if Counter is not None:
+        EMAIL_SEND_LATENCY.labels("sent" if sent else "failed").observe(duration)
+
+
+def record_replica_lag(database, lag):
+    # None = the database can't tell (SQLite), +Inf = the replica can't be reached
+    if Counter is not None and lag is not None:
+        REPLICA_LAG.labels(database).set(lag)
+
+
+class QueryCounter:
+    # execute wrapper that only counts and times the queries, cheap enough for every request
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class PrometheusMetricsMiddleware(SyncAndAsyncMiddleware):
+    def __init__(self, get_response):
+        if Counter is None:
+            raise MiddlewareNotUsed()
+        super(PrometheusMetricsMiddleware, self).__init__(get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        queries = QueryCounter()
+        start = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(queries))
+                response = self.get_response(request)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+        # label by URL name (leads:lead-list) rather than path, so /leads/1/ and /leads/2/ are the same series
+        match = request.resolver_match
+        url_name = match.view_name if match else "<unresolved>"
+        REQUEST_LATENCY.labels(url_name, request.method).observe(time.perf_counter() - start)
+        REQUEST_DB_QUERIES.labels(url_name).observe(queries.count)
+        REQUEST_DB_TIME.labels(url_name).observe(queries.duration)
+        WORKER_REQUESTS.inc()
+        return response
+
+    async def __acall__(self, request):
+        # In the async chain the queries run in the threads of sync_to_async, each with its own connections, so the
+        # execute wrappers of this thread would not see them: only the latency is recorded, not the query histograms.
+        start = time.perf_counter()
+        REQUESTS_IN_PROGRESS.inc()
+        try:
+            response = await self.get_response(request)
+        finally:
+            REQUESTS_IN_PROGRESS.dec()
+        match = request.resolver_match
+        REQUEST_LATENCY.labels(match.view_name if match else "<unresolved>", request.method).observe(time.perf_counter() - start)
+        WORKER_REQUESTS.inc()
+        return response
+
+
+class OutboxCollector:
+    # Read from the database at scrape time instead of being counted, so it's right whichever process sent the emails
+    def collect(self):
+        from .models import OutboxEmail
+        depth = GaugeMetricFamily("djcrm_outbox_emails", "Emails in the outbox", labels=["status"])
+        counts = dict(OutboxEmail.objects.exclude(status=OutboxEmail.SENT).values_list("status").annotate(Count("id")).order_by())
+        for status in (OutboxEmail.PENDING, OutboxEmail.DEAD):
+            depth.add_metric([status], counts.get(status, 0))
+        yield depth
+
+
+if Counter is not None:
+    # separate registry, the outbox gauge must not be written to the multiprocess files
+    OUTBOX_REGISTRY = CollectorRegistry()
+    OUTBOX_REGISTRY.register(OutboxCollector())
+
+
+def can_read_metrics(request):
+    # METRICS_TOKEN => the scraper has to send "Authorization: Bearer <token>". Without one, only staff users and the
+    # addresses of METRICS_ALLOWED_IPS can read them: they show the traffic and the outbox backlog.
+    if settings.METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get("Authorization", ""), f"Bearer {settings.METRICS_TOKEN}")
+    return request.META.get("REMOTE_ADDR") in settings.METRICS_ALLOWED_IPS or request.user.is_staff
+
+
+def metrics_view(request):
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    if Counter is None:
+        return HttpResponse("prometheus-client is not installed", status=501)
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    output = generate_latest(registry) + generate_latest(OUTBOX_REGISTRY)
+    return HttpResponse(output, content_type=CONTENT_TYPE_LATEST)
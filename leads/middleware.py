@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, ObjectDoesNotExist
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+logger = logging.getLogger("leads.instrumentation")
+
+
+class Tenant:
+    """The organisation the current user works in, resolved once per request.
+
+    organisation is the organisor's own UserProfile, or the organisation of the agent.
+    Every attribute is None for anonymous users.
+    """
+    def __init__(self, user):
+        self.user = user
+        self.profile = None
+        self.agent = None
+        self.organisation = None
+        if not user.is_authenticated:
+            return
+        # both are already loaded by TenantModelBackend, these don't run any query
+        try:
+            self.profile = user.userprofile
+        except ObjectDoesNotExist:
+            pass
+        try:
+            self.agent = user.agent
+        except ObjectDoesNotExist:
+            pass
+        if user.is_organisor:
+            self.organisation = self.profile
+        elif user.is_agent and self.agent is not None:
+            self.organisation = self.agent.organisation
+
+
+class SyncAndAsyncMiddleware:
+    """Base of the middleware that works in the sync (WSGI) and in the async (ASGI) middleware chain.
+
+    Django runs a sync-only middleware of an async chain in a thread, and everything below it too, which would pin
+    every request to a thread again. Like Django's MiddlewareMixin, __call__ hands the request over to __acall__
+    when the next handler is async, so the async views (see async_views.py) never wait in a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = asyncio.iscoroutinefunction(get_response)
+        if self.is_async:
+            # tells Django to await this middleware, asyncio.iscoroutinefunction(self) is True
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+
+class TenantMiddleware(SyncAndAsyncMiddleware):
+    # Must come after AuthenticationMiddleware, which sets request.user
+    def __call__(self, request):
+        # lazy => requests that never use request.tenant (static files, the landing page) don't load the user for it
+        request.tenant = SimpleLazyObject(lambda: Tenant(request.user))
+        # in the async chain this returns the coroutine of the next handler, which Django awaits
+        return self.get_response(request)
+
+
+class StaticFilesMiddleware(SyncAndAsyncMiddleware, WhiteNoiseMiddleware):
+    """WhiteNoiseMiddleware for both chains: whitenoise 5 is sync only and comes first, it would make the whole chain sync.
+
+    Looking a static file up is a dict lookup (autorefresh is off outside DEBUG), so it's done in the event loop.
+    """
+    def __init__(self, get_response):
+        WhiteNoiseMiddleware.__init__(self, get_response)
+        SyncAndAsyncMiddleware.__init__(self, get_response)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        return WhiteNoiseMiddleware.__call__(self, request)
+
+    async def __acall__(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+class RequestMetrics:
+    """Timings of one request, filled in by QueryInstrumentationMiddleware."""
+    def __init__(self, slow_query_count):
+        self.slow_query_count = slow_query_count
+        self.query_count = 0
+        self.db_time = 0.0
+        self.slowest = [] # [(seconds, sql)], the slow_query_count slowest statements
+        self.template_start = None
+        self.template_time = 0.0
+
+    # connection.execute_wrapper calls this around every query, it works without DEBUG = True
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.query_count += 1
+            self.db_time += duration
+            if len(self.slowest) < self.slow_query_count or duration > self.slowest[-1][0]:
+                self.slowest.append((duration, sql))
+                self.slowest.sort(key=lambda item: item[0], reverse=True)
+                del self.slowest[self.slow_query_count:]
+
+    def template_rendered(self, response):
+        self.template_time = time.perf_counter() - self.template_start
+
+
+class QueryInstrumentationMiddleware:
+    """Record query count, DB time, template render time and the slowest queries of sampled requests.
+
+    Enabled with QUERY_INSTRUMENTATION_SAMPLE_RATE (0 = off, 1 = every request). The metrics are sent back in a
+    Server-Timing header (shown in the browser dev tools) and logged as JSON to the 'leads.instrumentation' logger,
+    keyed by URL name such as leads:lead-list.
+    """
+    def __init__(self, get_response):
+        self.sample_rate = settings.QUERY_INSTRUMENTATION_SAMPLE_RATE
+        if not self.sample_rate:
+            raise MiddlewareNotUsed() # Django drops the middleware, so it costs nothing when it's off
+        self.slow_query_count = settings.QUERY_INSTRUMENTATION_SLOW_QUERIES
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        metrics = request.query_metrics = RequestMetrics(self.slow_query_count)
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            # install the metrics as execute wrapper on every database connection for the duration of the request
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(metrics))
+            response = self.get_response(request)
+        total_time = time.perf_counter() - start
+
+        response["Server-Timing"] = ", ".join([
+            f'db;dur={metrics.db_time * 1000:.1f};desc="{metrics.query_count} queries"',
+            f"tpl;dur={metrics.template_time * 1000:.1f}",
+            f"total;dur={total_time * 1000:.1f}",
+        ])
+        match = request.resolver_match
+        logger.info(json.dumps({
+            "url_name": match.view_name if match else None,
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "queries": metrics.query_count,
+            "db_ms": round(metrics.db_time * 1000, 1),
+            "template_ms": round(metrics.template_time * 1000, 1),
+            "total_ms": round(total_time * 1000, 1),
+            "slowest": [{"ms": round(duration * 1000, 1), "sql": sql} for duration, sql in metrics.slowest],
+        }))
+        return response
+
+    # Class based views return a TemplateResponse that is rendered after this hook, so the render time is
+    # measured from here until the post render callback (it includes the queries of lazy querysets in the template)
+    def process_template_response(self, request, response):
+        metrics = getattr(request, "query_metrics", None)
+        if metrics is not None:
+            metrics.template_start = time.perf_counter()
+            response.add_post_render_callback(metrics.template_rendered)
+        return response
+
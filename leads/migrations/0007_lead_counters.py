@@ -0,0 +1,42 @@
+# Generated by Django 3.2.7 on 2026-10-18 02:18
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_lead_counters(apps, schema_editor):
+    Lead = apps.get_model('leads', 'Lead')
+    for model, field, lead_field, filters in (
+        (apps.get_model('leads', 'Category'), 'lead_count', 'category', {'category__isnull': False}),
+        (apps.get_model('leads', 'Agent'), 'lead_count', 'agent', {'agent__isnull': False}),
+        (apps.get_model('leads', 'UserProfile'), 'uncategorised_lead_count', 'organisation', {'category__isnull': True}),
+    ):
+        counts = Lead.objects.filter(**filters).values_list(lead_field).annotate(Count('id')).order_by()
+        for pk, count in counts:
+            model.objects.filter(pk=pk).update(**{field: count})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0006_auto_20210930_2053'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='lead_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='lead_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='uncategorised_lead_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_lead_counters, migrations.RunPython.noop),
+    ]
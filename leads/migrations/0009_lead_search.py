@@ -0,0 +1,15 @@
+from django.db import migrations
+from leads.search import create_search_index, drop_search_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0008_outboxemail'),
+    ]
+
+    operations = [
+        # PostgreSQL: generated tsvector column + GIN index, pg_trgm indexes on name and phone number
+        # SQLite: FTS5 virtual table kept up to date by triggers on leads_lead
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
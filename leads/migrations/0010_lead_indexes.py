@@ -0,0 +1,40 @@
+# Generated by Django 3.2.7 on 2026-10-18 02:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+from leads.search import create_search_index
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0009_lead_search'),
+    ]
+
+    # On SQLite, AlterField rebuilds the leads_lead table, which drops the search index triggers (see leads/search.py).
+    # They are created again after the AlterField, and after it is reversed when the migration is unapplied.
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_index),
+        migrations.AlterField(
+            model_name='lead',
+            name='organisation',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile'),
+        ),
+        migrations.RunPython(create_search_index, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'agent'], name='lead_org_agent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'category'], name='lead_org_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', '-date_added', '-id'], name='lead_org_date_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(condition=models.Q(('agent__isnull', True)), fields=['organisation', '-date_added'], name='lead_unassigned_idx'),
+        ),
+    ]
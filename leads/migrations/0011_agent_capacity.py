@@ -0,0 +1,18 @@
+# Generated by Django 3.2.7 on 2026-10-18 02:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0010_lead_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='capacity',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
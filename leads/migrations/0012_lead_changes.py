@@ -0,0 +1,50 @@
+# Generated by Django 3.2.7 on 2026-10-18 02:52
+
+from django.db import migrations, models
+from django.db.models import F
+import django.db.models.deletion
+import django.utils.timezone
+from leads.search import create_search_index
+
+
+def set_updated_at(apps, schema_editor):
+    # the existing leads haven't changed since they were added, as far as anyone can tell
+    Lead = apps.get_model("leads", "Lead")
+    Lead.objects.update(updated_at=F("date_added"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0011_agent_capacity'),
+    ]
+
+    # On SQLite, AddField rebuilds the leads_lead table, which drops the search index triggers (see leads/search.py).
+    # They are created again after the AddField, and after it is reversed when the migration is unapplied.
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_index),
+        migrations.AddField(
+            model_name='lead',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(set_updated_at, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'updated_at', 'id'], name='lead_org_updated_idx'),
+        ),
+        migrations.CreateModel(
+            name='LeadTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lead_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('organisation', models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.CASCADE, to='leads.userprofile')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='leadtombstone',
+            index=models.Index(fields=['organisation', 'deleted_at', 'lead_id'], name='tombstone_org_deleted_idx'),
+        ),
+    ]
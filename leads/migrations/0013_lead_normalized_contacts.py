@@ -0,0 +1,53 @@
+# Generated by Django 3.2.7 on 2026-10-18 02:55
+
+from django.db import migrations, models
+import leads.normalize
+from leads.search import create_search_index
+
+
+def set_normalized_contacts(apps, schema_editor):
+    # pre_save only fills the normalized columns of the leads saved from now on, the existing ones are filled here
+    Lead = apps.get_model("leads", "Lead")
+    batch = []
+    for lead in Lead.objects.only("id", "email", "phone_number").iterator(chunk_size=2000):
+        lead.email_normalized = leads.normalize.normalize_email(lead.email)
+        lead.phone_normalized = leads.normalize.normalize_phone(lead.phone_number)
+        batch.append(lead)
+        if len(batch) >= 2000:
+            Lead.objects.bulk_update(batch, ["email_normalized", "phone_normalized"])
+            batch = []
+    if batch:
+        Lead.objects.bulk_update(batch, ["email_normalized", "phone_normalized"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0012_lead_changes'),
+    ]
+
+    # On SQLite, AddField rebuilds the leads_lead table, which drops the search index triggers (see leads/search.py).
+    # They are created again after the AddField, and after it is reversed when the migration is unapplied.
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, create_search_index),
+        migrations.AddField(
+            model_name='lead',
+            name='email_normalized',
+            field=leads.normalize.NormalizedCharField(blank=True, editable=False, max_length=254, normalize=leads.normalize.normalize_email, source='email'),
+        ),
+        migrations.AddField(
+            model_name='lead',
+            name='phone_normalized',
+            field=leads.normalize.NormalizedCharField(blank=True, editable=False, max_length=20, normalize=leads.normalize.normalize_phone, source='phone_number'),
+        ),
+        migrations.RunPython(set_normalized_contacts, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'email_normalized'], name='lead_org_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(fields=['organisation', 'phone_normalized'], name='lead_org_phone_idx'),
+        ),
+    ]
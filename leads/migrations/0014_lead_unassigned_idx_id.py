@@ -0,0 +1,21 @@
+# Generated by Django 3.2.7 on 2026-10-18 03:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leads', '0013_lead_normalized_contacts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='lead',
+            name='lead_unassigned_idx',
+        ),
+        migrations.AddIndex(
+            model_name='lead',
+            index=models.Index(condition=models.Q(('agent__isnull', True)), fields=['organisation', '-date_added', '-id'], name='lead_unassigned_idx'),
+        ),
+    ]
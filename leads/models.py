@@ -1,6 +1,10 @@
 from django.db import models
-from django.db.models.signals import post_save # Send signal after save method is committed to the db
+from django.db.models import F
+from django.utils import timezone
+from django.db.models.signals import post_save, pre_delete, post_delete # Send signal after save method is committed to the db
 from django.contrib.auth.models import AbstractUser
+from .cache import invalidate_organisation_cache
+from .normalize import PHONE_NORMALIZED_MAX_LENGTH, NormalizedCharField, normalize_email, normalize_phone
 
 # Create your models here.
 class User(AbstractUser):
@@ -11,16 +15,61 @@ class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE) #CASCADE = if User is delete, the UserProfile is also delete
     # OneToOne => an account can only have 1 profile.
     # OneToOne also allows us to call user.userprofile
+    # Counter of the organisation's leads without a category, kept up to date by the Lead signals below
+    uncategorised_lead_count = models.PositiveIntegerField(default=0)
 
     # Return a string instead of an object address
     def __str__(self):
         return self.user.username
 
+class OrganisationScopedQuerySet(models.QuerySet):
+    """Encodes which rows of a model a user is allowed to see, in one place instead of in every view.
+
+    An organisor sees every row of their organisation, an agent sees the rows of the organisation they work for.
+    user.userprofile and user.agent are loaded together with the user by TenantModelBackend, so this costs no query.
+    """
+    def for_organisation(self, organisation):
+        return self.filter(organisation=organisation)
+
+    def for_user(self, user):
+        if user.is_organisor:
+            return self.for_organisation(user.userprofile)
+        if user.is_agent:
+            return self.for_agent(user.agent)
+        return self.none()
+
+    def for_agent(self, agent):
+        # organisation_id instead of organisation => no need to load the organisation row
+        return self.filter(organisation_id=agent.organisation_id)
+
+
+class LeadQuerySet(OrganisationScopedQuerySet):
+    def for_agent(self, agent):
+        # an agent only sees the leads assigned to them (served by the (organisation, agent) index)
+        return self.filter(organisation_id=agent.organisation_id, agent=agent)
+
+    def for_lead_list(self):
+        # select_related joins agent, agent.user and category into the same query, so the template doesn't run one query per row
+        # only() limits the SELECT to the columns shown in the table (the foreign keys are needed for the joins)
+        return self.select_related("agent__user", "category").only(
+            "first_name", "last_name", "age", "email", "phone_number", "date_added",
+            "agent", "agent__user", "agent__user__first_name", "agent__user__last_name",
+            "category", "category__name",
+        )
+
+
+class AgentQuerySet(OrganisationScopedQuerySet):
+    def with_user(self):
+        # the agent templates show agent.user.first_name/last_name/email, join the user instead of one query per agent
+        return self.select_related("user")
+
+
 class Lead(models.Model):
     first_name = models.CharField(max_length=20)
     last_name = models.CharField(max_length=20)
     age = models.IntegerField(default=0)
-    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE) # add this to allow filtering leads by organisation
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_index=False) # add this to allow filtering leads by organisation
+    # db_index=False => the composite indexes in Meta all start with organisation, a separate index would be redundant
     # UserProfile is created before Lead, therefore you can refer to UserProfile in class/object format.
     agent = models.ForeignKey("Agent", null=True, blank=True, on_delete=models.SET_NULL)  # Agent is created after Lead, therefore you must refer to it in string format.
     category = models.ForeignKey("Category", related_name="leads", null=True, blank=True, on_delete=models.SET_NULL)
@@ -29,12 +78,53 @@ class Lead(models.Model):
     # SET_NULL => leads won't be deleted when agents are deleted
     description = models.TextField()
     date_added = models.DateTimeField(auto_now_add=True)
+    # Set by every save(). queryset.update() doesn't set it, so the bulk updates (bulk.py, assignment.py) set it themselves.
+    # The change feed (see leads/changes.py) returns the leads changed since a (updated_at, id) watermark.
+    updated_at = models.DateTimeField(auto_now=True)
     phone_number = models.CharField(max_length=20)
     email = models.EmailField()
+    # Normalized copies of email and phone_number, set on every save()/bulk_create() (see leads/normalize.py).
+    # The duplicate checks (leads/dedup.py) compare these instead of the text as it was typed.
+    email_normalized = NormalizedCharField(max_length=254, source="email", normalize=normalize_email)
+    phone_normalized = NormalizedCharField(max_length=PHONE_NORMALIZED_MAX_LENGTH, source="phone_number", normalize=normalize_phone)
+
+    objects = LeadQuerySet.as_manager() # Lead.objects.for_user(user), see OrganisationScopedQuerySet
+
+    class Meta:
+        # Composite indexes matching the organisation scoped queries of the lead views
+        indexes = [
+            # leads of an organisation assigned to agents / of one agent (LeadListView, AssignAgentView)
+            models.Index(fields=["organisation", "agent"], name="lead_org_agent_idx"),
+            # leads of an organisation per category (CategoryDetailView, the export category filter)
+            models.Index(fields=["organisation", "category"], name="lead_org_category_idx"),
+            # newest leads first, matches the keyset pagination ordering of LeadListView and the export date range
+            models.Index(fields=["organisation", "-date_added", "-id"], name="lead_org_date_added_idx"),
+            # partial index => only contains the unassigned leads, which organisors see on top of the lead list
+            models.Index(
+                fields=["organisation", "-date_added", "-id"], name="lead_unassigned_idx", condition=models.Q(agent__isnull=True)
+            ),
+            # the change feed reads the leads of an organisation in (updated_at, id) order, from a watermark
+            models.Index(fields=["organisation", "updated_at", "id"], name="lead_org_updated_idx"),
+            # duplicate checks: the leads of an organisation with the same email or the same phone number
+            models.Index(fields=["organisation", "email_normalized"], name="lead_org_email_idx"),
+            models.Index(fields=["organisation", "phone_normalized"], name="lead_org_phone_idx"),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
 
+    # from_db is called every time a lead is loaded from the database.
+    # Remember the category and agent stored in the database so that post_save knows which counters to move.
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_counted_values()
+        return instance
+
+    def remember_counted_values(self):
+        # use __dict__ so a deferred field (.only()) is not loaded with an extra query
+        self._counted_values = (self.__dict__.get("category_id"), self.__dict__.get("agent_id"))
+
 
 class Agent(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -43,6 +133,14 @@ class Agent(models.Model):
     organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
     # Foreign key => an organization can have multiple agents
     # CASCADE => if UserProfile is deleted, Agent is deleted as well
+    # Denormalized number of leads assigned to this agent, kept up to date by the Lead signals below
+    lead_count = models.PositiveIntegerField(default=0)
+    # Relative share of the leads this agent gets from the "weighted" auto-assignment (see leads/assignment.py),
+    # an agent with capacity 2 gets twice as many as an agent with capacity 1, 0 => gets none
+    capacity = models.PositiveSmallIntegerField(default=1)
+
+    objects = AgentQuerySet.as_manager()
+
     def __str__(self):
         return self.user.email
 
@@ -50,11 +148,65 @@ class Agent(models.Model):
 class Category(models.Model):
     name = models.CharField(max_length=30)
     organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE)
+    # Denormalized number of leads in this category, kept up to date by the Lead signals below
+    lead_count = models.PositiveIntegerField(default=0)
+
+    objects = OrganisationScopedQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
 
+class LeadTombstone(models.Model):
+    # What's left of a deleted lead: the change feed reports the delete from it (see leads/changes.py).
+    # Tombstones older than LEAD_TOMBSTONE_DAYS are deleted by 'py manage.py lead_changes --prune'.
+    lead_id = models.BigIntegerField()
+    # db_constraint=False => deleting an organisation deletes its leads, and the tombstones they leave behind
+    # must not block the delete of the organisation row
+    organisation = models.ForeignKey(UserProfile, on_delete=models.CASCADE, db_constraint=False, db_index=False)
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # same (timestamp, id) order as lead_org_updated_idx
+            models.Index(fields=["organisation", "deleted_at", "lead_id"], name="tombstone_org_deleted_idx"),
+        ]
+
+    def __str__(self):
+        return f"Lead {self.lead_id} deleted at {self.deleted_at}"
+
+
+class OutboxEmail(models.Model):
+    # Emails are not sent inside the request anymore. The views write a row here in the same transaction as the lead/agent,
+    # and the 'py manage.py run_outbox' worker sends them in the background (see leads/outbox.py).
+    PENDING = "pending"
+    SENT = "sent"
+    DEAD = "dead" # gave up after OUTBOX_MAX_ATTEMPTS failed attempts, kept for inspection in the admin
+    STATUS_CHOICES = (
+        (PENDING, "Pending"),
+        (SENT, "Sent"),
+        (DEAD, "Dead"),
+    )
+
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    from_email = models.CharField(max_length=254)
+    recipient_list = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now) # pushed back after every failed attempt
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        # the worker polls with status = 'pending' AND next_attempt_at <= now ORDER BY next_attempt_at
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    def __str__(self):
+        return f"{self.subject} ({self.status})"
+
+
 # call this function when post_save signal is sent
 def post_user_created_signal(sender, instance, created, **kwargs):
     # sender = the model that send save method (User)
@@ -65,4 +217,96 @@ def post_user_created_signal(sender, instance, created, **kwargs):
         UserProfile.objects.create(user=instance)
 
 post_save.connect(post_user_created_signal, sender=User)
-# 1st argument post_user_created_signal is the function that is called when a save signal is sent.
\ No newline at end of file
+# 1st argument post_user_created_signal is the function that is called when a save signal is sent.
+
+
+# The lead counters are only updated with UPDATE ... SET lead_count = lead_count + 1 (F expressions),
+# so two requests changing leads at the same time can't overwrite each other's counts.
+# The views that change leads wrap the save in transaction.atomic, so the lead and its counters are committed together.
+# Run 'py manage.py rebuild_lead_counters' to recompute them from the leads table.
+def change_category_counter(organisation_id, category_id, delta):
+    if category_id is None:
+        UserProfile.objects.filter(pk=organisation_id).update(uncategorised_lead_count=F("uncategorised_lead_count") + delta)
+    else:
+        Category.objects.filter(pk=category_id).update(lead_count=F("lead_count") + delta)
+
+
+def change_agent_counter(agent_id, delta):
+    if agent_id is not None:
+        Agent.objects.filter(pk=agent_id).update(lead_count=F("lead_count") + delta)
+
+
+def post_lead_saved_signal(sender, instance, created, raw=False, **kwargs):
+    if raw: # loaddata saves rows as they are, the counters are rebuilt afterwards
+        return
+    if created or not hasattr(instance, "_counted_values"):
+        change_category_counter(instance.organisation_id, instance.category_id, 1)
+        change_agent_counter(instance.agent_id, 1)
+    else:
+        old_category_id, old_agent_id = instance._counted_values
+        if old_category_id != instance.category_id:
+            change_category_counter(instance.organisation_id, old_category_id, -1)
+            change_category_counter(instance.organisation_id, instance.category_id, 1)
+        if old_agent_id != instance.agent_id:
+            change_agent_counter(old_agent_id, -1)
+            change_agent_counter(instance.agent_id, 1)
+    instance.remember_counted_values() # saving the same instance twice must not count it twice
+
+
+def post_lead_deleted_signal(sender, instance, **kwargs):
+    category_id, agent_id = getattr(instance, "_counted_values", (instance.category_id, instance.agent_id))
+    change_category_counter(instance.organisation_id, category_id, -1)
+    change_agent_counter(agent_id, -1)
+
+
+def post_lead_tombstone_signal(sender, instance, **kwargs):
+    # the deleted lead is reported by the change feed (bulk_delete_leads in bulk.py creates the tombstones itself)
+    LeadTombstone.objects.create(lead_id=instance.pk, organisation_id=instance.organisation_id)
+
+
+def pre_lead_owner_deleted_signal(sender, instance, **kwargs):
+    # on_delete=SET_NULL empties the agent/category of the leads with a queryset update, which doesn't touch updated_at.
+    # pre_delete runs before that update, so the leads still point to the agent/category being deleted here.
+    field = "agent" if sender is Agent else "category"
+    Lead.objects.filter(**{field: instance}).update(updated_at=timezone.now())
+
+
+def post_category_deleted_signal(sender, instance, **kwargs):
+    # on_delete=SET_NULL moved the leads of this category to "uncategorised" with a queryset update, which sends no Lead signals
+    change_category_counter(instance.organisation_id, None, instance.lead_count)
+
+
+post_save.connect(post_lead_saved_signal, sender=Lead)
+post_delete.connect(post_lead_deleted_signal, sender=Lead)
+post_delete.connect(post_category_deleted_signal, sender=Category)
+post_delete.connect(post_lead_tombstone_signal, sender=Lead)
+pre_delete.connect(pre_lead_owner_deleted_signal, sender=Agent)
+pre_delete.connect(pre_lead_owner_deleted_signal, sender=Category)
+
+
+# The category list, the agent list and the agent/category dropdowns are cached per organisation (see leads/cache.py).
+# Any write to the organisation's categories, agents or leads bumps its cache version, which makes all of them stale at once.
+def post_organisation_data_changed_signal(sender, instance, **kwargs):
+    invalidate_organisation_cache(instance.organisation_id)
+
+
+def post_organisation_created_signal(sender, instance, created, **kwargs):
+    # a new organisation can get the id of a deleted one, its cache must not start with the old entries
+    if created:
+        invalidate_organisation_cache(instance.pk)
+
+
+def post_agent_user_saved_signal(sender, instance, created, update_fields=None, **kwargs):
+    # the agent list and the agent dropdowns show the agent's name and email, which are stored on the user
+    # (logging in only saves last_login, that doesn't change anything cached)
+    if created or not instance.is_agent or update_fields == frozenset(["last_login"]):
+        return
+    for organisation_id in Agent.objects.filter(user=instance).values_list("organisation_id", flat=True):
+        invalidate_organisation_cache(organisation_id)
+
+
+for model in (Lead, Agent, Category):
+    post_save.connect(post_organisation_data_changed_signal, sender=model)
+    post_delete.connect(post_organisation_data_changed_signal, sender=model)
+post_save.connect(post_organisation_created_signal, sender=UserProfile)
+post_save.connect(post_agent_user_saved_signal, sender=User)
@@ -0,0 +1,73 @@
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import models
+
+# Email addresses and phone numbers are typed in every way imaginable ("John@Example.com ", "+1 (555) 123-4567",
+# "555.123.4567"), so they are compared through a normalized copy stored next to them (see Lead.email_normalized and
+# Lead.phone_normalized), which the deduplication (leads/dedup.py) looks up with an index.
+
+
+E164_MAX_DIGITS = 15 # country code included
+PHONE_NORMALIZED_MAX_LENGTH = 20 # Lead.phone_normalized
+
+
+def normalize_email(email):
+    # the domain is case insensitive and nobody relies on the local part being case sensitive
+    return (email or "").strip().lower()
+
+
+def normalize_phone(phone_number):
+    """Return the phone number as +<country code><digits> (E.164) when it's written with its country code, digits otherwise.
+
+    "+1 (555) 123-4567" => "+15551234567", "0044 20 7946 0958" => "+442079460958". A national number ("020 7946 0958")
+    gets LEAD_PHONE_COUNTRY_CODE in front (without its trunk 0) when the setting is set, otherwise it stays "02079460958".
+    A number with more than 15 digits can't be E.164, it's kept as digits only.
+    """
+    phone_number = (phone_number or "").strip()
+    digits = re.sub(r"\D", "", phone_number)
+    if not digits:
+        return ""
+    if phone_number.startswith("+"):
+        e164 = digits
+    elif digits.startswith("00"): # international prefix
+        e164 = digits[2:]
+    elif settings.LEAD_PHONE_COUNTRY_CODE:
+        e164 = f"{settings.LEAD_PHONE_COUNTRY_CODE}{digits[1:] if digits.startswith('0') else digits}"
+    else:
+        e164 = None
+    if e164 and len(e164) <= E164_MAX_DIGITS:
+        return f"+{e164}"
+    # not a plausible phone number (too long for E.164): compared as it was typed, cut to the column's length
+    return digits[:PHONE_NORMALIZED_MAX_LENGTH]
+
+
+def normalize_name(first_name, last_name):
+    # "José  O'Neil" and "o'neil jose" => "jose oneil": no accents, no punctuation, words sorted
+    name = unicodedata.normalize("NFKD", f"{first_name} {last_name}").encode("ascii", "ignore").decode().lower()
+    return " ".join(sorted(re.sub(r"[^\w\s]", "", name).split()))
+
+
+class NormalizedCharField(models.CharField):
+    """A normalized copy of another field of the model, computed by normalize(value of source).
+
+    It's set in pre_save, which Django calls for save() and for bulk_create(), so the importer and the seeder keep it up
+    to date too. queryset.update() and bulk_update() don't call it: update the source field through save().
+    """
+    def __init__(self, *args, source=None, normalize=None, **kwargs):
+        self.source = source
+        self.normalize = normalize
+        kwargs.setdefault("editable", False)
+        kwargs.setdefault("blank", True)
+        super(NormalizedCharField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(NormalizedCharField, self).deconstruct()
+        kwargs.update({"source": self.source, "normalize": self.normalize})
+        return name, path, args, kwargs
+
+    def pre_save(self, model_instance, add):
+        value = self.normalize(getattr(model_instance, self.source))
+        setattr(model_instance, self.attname, value)
+        return value
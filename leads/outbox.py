@@ -0,0 +1,88 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from .metrics import record_email_sent
+from .models import OutboxEmail
+
+
+def queue_email(subject, message, from_email, recipient_list):
+    # Call this instead of send_mail inside a view. The row is written in the view's transaction,
+    # so the email is only sent if the lead/agent it is about is actually committed.
+    return OutboxEmail.objects.create(
+        subject=subject,
+        message=message,
+        from_email=from_email,
+        recipient_list=list(recipient_list),
+    )
+
+
+def get_retry_delay(attempts):
+    # exponential backoff => 1 min, 2 min, 4 min, ... capped at OUTBOX_MAX_RETRY_DELAY
+    delay = settings.OUTBOX_RETRY_DELAY * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, settings.OUTBOX_MAX_RETRY_DELAY))
+
+
+def send_queued_emails(batch_size=None):
+    """Send one batch of due emails over a single SMTP connection and return how many were processed."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    with transaction.atomic():
+        # skip_locked => several workers can drain the outbox at the same time without sending an email twice
+        # (ignored on databases without SELECT ... FOR UPDATE such as SQLite)
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxEmail.PENDING, next_attempt_at__lte=now)
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        if not emails:
+            return 0
+
+        # one connection for the whole batch instead of a TCP + TLS + AUTH handshake per email
+        connection = get_connection(fail_silently=False)
+        try:
+            connection.open()
+        except Exception as error:
+            for email in emails:
+                mark_failed(email, error, now)
+            OutboxEmail.objects.bulk_update(emails, ["status", "attempts", "next_attempt_at", "last_error"])
+            return len(emails)
+
+        try:
+            for email in emails:
+                message = EmailMessage(
+                    subject=email.subject,
+                    body=email.message,
+                    from_email=email.from_email,
+                    to=email.recipient_list,
+                    connection=connection,
+                )
+                start = time.perf_counter()
+                try:
+                    message.send()
+                except Exception as error:
+                    record_email_sent(time.perf_counter() - start, sent=False)
+                    mark_failed(email, error, now)
+                else:
+                    record_email_sent(time.perf_counter() - start, sent=True)
+                    email.status = OutboxEmail.SENT
+                    email.attempts += 1
+                    email.sent_at = timezone.now()
+                    email.last_error = ""
+        finally:
+            connection.close()
+
+        OutboxEmail.objects.bulk_update(emails, ["status", "attempts", "next_attempt_at", "last_error", "sent_at"])
+    return len(emails)
+
+
+def mark_failed(email, error, now):
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"
+    if email.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboxEmail.DEAD # stop retrying, the row stays in the admin for inspection
+    else:
+        email.next_attempt_at = now + get_retry_delay(email.attempts)
@@ -0,0 +1,100 @@
+import base64
+from functools import reduce
+
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+
+
+class KeysetPage:
+    """A single page of a keyset paginated list.
+
+    Unlike django.core.paginator.Page it knows nothing about the total number of
+    rows, only whether there is a next page and which cursor points to it.
+    """
+    def __init__(self, object_list, next_cursor, cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.cursor = cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def encode_cursor(values):
+    # values = (date_added, id) of the last row on the page => "2021-09-30T13:53:00+00:00|42"
+    raw = "|".join(value.isoformat() if hasattr(value, "isoformat") else str(value) for value in values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, converters=(parse_datetime, int)):
+    # converters parse the values of the cursor back, one per field of the keyset ordering
+    padded = cursor + "=" * (-len(cursor) % 4) # base64 needs the padding we stripped in encode_cursor
+    try:
+        raw_values = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+        if len(raw_values) != len(converters):
+            raise ValueError(cursor)
+        values = tuple(convert(value) for convert, value in zip(converters, raw_values))
+    except (ValueError, UnicodeDecodeError):
+        raise Http404("Invalid cursor")
+    if None in values: # parse_datetime returns None for a string that isn't a date
+        raise Http404("Invalid cursor")
+    return values
+
+
+class KeysetPaginationMixin:
+    """Replace ListView's OFFSET pagination with keyset (cursor) pagination.
+
+    OFFSET pagination makes the database walk over every skipped row and Paginator
+    runs an extra COUNT(*), so deep pages get slower as the table grows. Keyset
+    pagination filters on the (date_added, id) of the last row that was shown, so
+    every page is a single indexed range scan no matter how deep the user scrolls.
+    """
+    paginate_by = 25
+    cursor_kwarg = "cursor"
+    # the last field must be unique (id) so that rows with the same date_added are never skipped
+    keyset_ordering = ("-date_added", "-id")
+    keyset_converters = (parse_datetime, int) # turn the values of a cursor back into a date_added and an id
+
+    def get_keyset_filter(self, values):
+        # Build (a < x) OR (a = x AND b < y) for a descending ordering, or > for an ascending one
+        conditions = []
+        for index, field in enumerate(self.keyset_ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            equal = {f.lstrip("-"): value for f, value in zip(self.keyset_ordering[:index], values)}
+            conditions.append(Q(**equal, **{f"{name}__{lookup}": values[index]}))
+        return reduce(lambda a, b: a | b, conditions)
+
+    # paginate_queryset is called by ListView.get_context_data when paginate_by is set.
+    # cursor_kwarg => a second list of the page, paginated with its own cursor in the query string
+    def paginate_queryset(self, queryset, page_size, cursor_kwarg=None):
+        cursor = self.request.GET.get(cursor_kwarg or self.cursor_kwarg) or None
+        queryset = queryset.order_by(*self.keyset_ordering)
+        if cursor is not None:
+            queryset = queryset.filter(self.get_keyset_filter(decode_cursor(cursor, self.keyset_converters)))
+        # fetch one extra row to find out if there is a next page without running COUNT(*)
+        object_list = list(queryset[:page_size + 1])
+        next_cursor = None
+        if len(object_list) > page_size:
+            object_list = object_list[:page_size]
+            last = object_list[-1]
+            next_cursor = encode_cursor(self.get_keyset_values(last))
+        page = KeysetPage(object_list, next_cursor, cursor)
+        return (None, page, object_list, page.has_other_pages())
+
+    def get_keyset_values(self, obj):
+        # the values of the keyset ordering fields of a row, for its cursor
+        return [getattr(obj, field.lstrip("-")) for field in self.keyset_ordering]
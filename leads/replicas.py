@@ -0,0 +1,214 @@
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from .metrics import record_replica_lag
+from .middleware import SyncAndAsyncMiddleware
+
+logger = logging.getLogger("leads.replicas")
+
+# Read replicas: copies of the default database kept up to date by the database server (PostgreSQL streaming
+# replication...), listed in DATABASE_REPLICAS (see DATABASE_REPLICA_URLS in settings.py).
+#
+# - Only what runs inside read_from_replica() reads from a replica: the pages of ReplicaReadMixin (the lead list and
+#   detail, the categories) and the export. Everything else, and every write, goes to the default database.
+# - A replica is a few seconds behind. A client whose request wrote something reads from the default database for the
+#   next REPLICA_STICKY_SECONDS (ReplicaPinMiddleware), so the page it's redirected to shows what it just saved.
+# - A replica more than REPLICA_MAX_LAG seconds behind is skipped, when no replica is left the default database is read.
+# - Reads inside a transaction of the default database stay on it: the replica wouldn't see what the transaction wrote.
+# - What's computed from a replica isn't put in the organisation cache (see cached_for_organisation in cache.py).
+
+# the ReplicaReads of the current read_from_replica() block, None outside such a block
+replica_reads = ContextVar("replica_reads", default=None)
+# the RequestWrites of the current request, set by ReplicaPinMiddleware
+request_writes = ContextVar("request_writes", default=None)
+
+PIN_COOKIE = "db_primary_until"
+
+
+class ReplicaReads:
+    """The replica one read_from_replica() block reads from, picked with its first query.
+
+    Shared by the threads the async views query in (they get a copy of the context, with the same object),
+    so all the queries of a page see the same replica.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.alias = None
+
+    def get_alias(self):
+        with self.lock:
+            if self.alias is None:
+                self.alias = pick_replica()
+            return self.alias
+
+
+class RequestWrites:
+    wrote = False
+
+
+@contextmanager
+def read_from_replica(enabled=True):
+    """Run the queries of the block on a replica, when one is configured and up to date. Nests, enabled=False turns it off."""
+    token = replica_reads.set(ReplicaReads() if enabled else None)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+def is_reading_from_replica():
+    """True when the current read_from_replica() block reads from a replica (its first query picked one)."""
+    reads = replica_reads.get()
+    return reads is not None and reads.alias not in (None, DEFAULT_DB_ALIAS)
+
+
+# Replica lag
+
+# alias => (time of the measure, lag in seconds or None), measured again after REPLICA_LAG_CHECK_INTERVAL
+lags = {}
+lags_lock = threading.Lock()
+
+
+def measure_replica_lag(alias):
+    """Seconds the replica is behind the default database, None when the database can't tell (SQLite...)."""
+    connection = connections[alias]
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        # a replica that replayed everything it received isn't behind, even if the last transaction is old (idle primary)
+        cursor.execute("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+            END
+        """)
+        lag, = cursor.fetchone()
+    return float(lag) if lag is not None else None
+
+
+def get_replica_lag(alias, max_age=None):
+    """The lag of the replica, measured at most once per max_age seconds (REPLICA_LAG_CHECK_INTERVAL) in this process.
+
+    A replica that can't be reached counts as infinitely behind.
+    """
+    max_age = settings.REPLICA_LAG_CHECK_INTERVAL if max_age is None else max_age
+    with lags_lock:
+        measured_at, lag = lags.get(alias, (None, None))
+    if measured_at is not None and time.monotonic() - measured_at < max_age:
+        return lag
+    try:
+        lag = measure_replica_lag(alias)
+    except connections[alias].Database.Error:
+        logger.warning("Replica %s can't be reached", alias, exc_info=True)
+        lag = float("inf")
+    with lags_lock:
+        lags[alias] = (time.monotonic(), lag)
+    record_replica_lag(alias, lag)
+    return lag
+
+
+def pick_replica():
+    """A random replica among the ones that are up to date, DEFAULT_DB_ALIAS when there's none."""
+    replicas = [
+        alias for alias in settings.DATABASE_REPLICAS
+        if (get_replica_lag(alias) or 0) <= settings.REPLICA_MAX_LAG # None = unknown, the replica is used
+    ]
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+# Router
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        reads = replica_reads.get()
+        if reads is None or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        writes = request_writes.get()
+        if (writes is not None and writes.wrote) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS # read your own writes
+        return reads.get_alias()
+
+    def db_for_write(self, model, **hints):
+        writes = request_writes.get()
+        if writes is not None:
+            writes.wrote = True
+        # explicitly: Django would save an instance read from a replica back to the replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True # the replicas hold the same rows as the default database
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # a replica gets the tables of the default database through replication
+        return db not in settings.DATABASE_REPLICAS
+
+
+# Views
+
+
+def is_pinned(request):
+    """True when a request of this client wrote in the last REPLICA_STICKY_SECONDS."""
+    try:
+        return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+class ReplicaReadMixin:
+    """Read the data of the page from a replica (see read_from_replica), unless the client is pinned to the default database."""
+    def dispatch(self, request, *args, **kwargs):
+        # the user and the session are read from the default database first: a session that was just created (login)
+        # or deleted (logout) may not have reached the replica yet
+        request.tenant.organisation
+        with self.read_from_replica():
+            response = super(ReplicaReadMixin, self).dispatch(request, *args, **kwargs)
+            # a TemplateResponse is rendered after the view returns, its template may still run queries (lazy querysets)
+            if hasattr(response, "render"):
+                response.render()
+        return response
+
+    def read_from_replica(self):
+        return read_from_replica(not is_pinned(self.request))
+
+
+class ReplicaPinMiddleware(SyncAndAsyncMiddleware):
+    """Pin a client to the default database for REPLICA_STICKY_SECONDS after one of its requests wrote.
+
+    Every write goes through ReplicaRouter.db_for_write, which marks the request. The pin is a cookie, so it holds
+    whichever worker answers the next request.
+    """
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        writes = RequestWrites()
+        token = request_writes.set(writes)
+        try:
+            response = self.get_response(request)
+        finally:
+            request_writes.reset(token)
+        return self.pin(writes, response)
+
+    async def __acall__(self, request):
+        # the pool threads the async views query in get a copy of this context, with the same RequestWrites
+        writes = RequestWrites()
+        token = request_writes.set(writes)
+        try:
+            response = await self.get_response(request)
+        finally:
+            request_writes.reset(token)
+        return self.pin(writes, response)
+
+    def pin(self, writes, response):
+        if writes.wrote and settings.DATABASE_REPLICAS:
+            sticky_seconds = settings.REPLICA_STICKY_SECONDS
+            response.set_cookie(
+                PIN_COOKIE, str(int(time.time()) + sticky_seconds), max_age=sticky_seconds, httponly=True, samesite="Lax",
+            )
+        return response
@@ -0,0 +1,129 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, Q
+from django.db.models.expressions import RawSQL
+
+# The search index is maintained by the database itself (a generated column on PostgreSQL, triggers on SQLite),
+# so every write path - the lead views, the admin, bulk_create and queryset.update() - keeps it up to date.
+
+POSTGRESQL_CREATE = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    # 'simple' config => no stemming or stop words, names and phone numbers are indexed as they are written
+    """
+    ALTER TABLE leads_lead ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(first_name, '') || ' ' || coalesce(last_name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(email, '') || ' ' || coalesce(phone_number, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS leads_lead_search_vector_idx ON leads_lead USING gin (search_vector)",
+    # trigram indexes for fuzzy (typo tolerant) name and phone number matching with the % operator
+    "CREATE INDEX IF NOT EXISTS leads_lead_name_trgm_idx ON leads_lead USING gin ((first_name || ' ' || last_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS leads_lead_phone_trgm_idx ON leads_lead USING gin (phone_number gin_trgm_ops)",
+)
+
+POSTGRESQL_DROP = (
+    "DROP INDEX IF EXISTS leads_lead_phone_trgm_idx",
+    "DROP INDEX IF EXISTS leads_lead_name_trgm_idx",
+    "DROP INDEX IF EXISTS leads_lead_search_vector_idx",
+    "ALTER TABLE leads_lead DROP COLUMN IF EXISTS search_vector",
+)
+
+SQLITE_COLUMNS = "first_name, last_name, email, phone_number, description"
+SQLITE_NEW_VALUES = "new.id, new.first_name, new.last_name, new.email, new.phone_number, new.description"
+SQLITE_OLD_VALUES = "'delete', old.id, old.first_name, old.last_name, old.email, old.phone_number, old.description"
+
+SQLITE_CREATE = (
+    # external content table => the FTS5 index stores only the tokens, the text stays in leads_lead
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS leads_lead_fts USING fts5(
+        {SQLITE_COLUMNS}, content='leads_lead', content_rowid='id'
+    )
+    """,
+    "DROP TRIGGER IF EXISTS leads_lead_fts_insert",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_delete",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_update",
+    f"""
+    CREATE TRIGGER leads_lead_fts_insert AFTER INSERT ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(rowid, {SQLITE_COLUMNS}) VALUES ({SQLITE_NEW_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER leads_lead_fts_delete AFTER DELETE ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, {SQLITE_COLUMNS}) VALUES ({SQLITE_OLD_VALUES});
+    END
+    """,
+    f"""
+    CREATE TRIGGER leads_lead_fts_update AFTER UPDATE ON leads_lead BEGIN
+        INSERT INTO leads_lead_fts(leads_lead_fts, rowid, {SQLITE_COLUMNS}) VALUES ({SQLITE_OLD_VALUES});
+        INSERT INTO leads_lead_fts(rowid, {SQLITE_COLUMNS}) VALUES ({SQLITE_NEW_VALUES});
+    END
+    """,
+    # index the leads that already exist
+    "INSERT INTO leads_lead_fts(leads_lead_fts) VALUES ('rebuild')",
+)
+
+SQLITE_DROP = (
+    "DROP TRIGGER IF EXISTS leads_lead_fts_insert",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_delete",
+    "DROP TRIGGER IF EXISTS leads_lead_fts_update",
+    "DROP TABLE IF EXISTS leads_lead_fts",
+)
+
+
+# Used by the migrations. On SQLite, a migration that rebuilds the leads_lead table (most AddField/AlterField operations)
+# drops its triggers, so such a migration has to call create_search_index again afterwards. It is safe to run twice.
+def create_search_index(apps, schema_editor):
+    statements = {"postgresql": POSTGRESQL_CREATE, "sqlite": SQLITE_CREATE}.get(schema_editor.connection.vendor, ())
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = {"postgresql": POSTGRESQL_DROP, "sqlite": SQLITE_DROP}.get(schema_editor.connection.vendor, ())
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def get_search_terms(query):
+    # "John  O'Neil 555" => ["John", "O", "Neil", "555"]
+    return re.findall(r"\w+", query)
+
+
+def search_leads(queryset, query):
+    """Filter a Lead queryset down to the leads matching the search query.
+
+    Every word of the query has to match the start of a word in the name, email, phone number or description.
+    On PostgreSQL a name or phone number that is merely similar (trigram similarity) matches as well.
+    """
+    terms = get_search_terms(query)
+    if not terms:
+        return queryset
+
+    if connection.vendor == "postgresql":
+        # 'john:* & smi:*' => every term as a prefix, served by the GIN index on search_vector
+        tsquery = " & ".join(f"{term}:*" for term in terms)
+        # % is the pg_trgm similarity operator, it has to be escaped as %% because of the query parameters
+        return queryset.filter(RawSQL(
+            "leads_lead.search_vector @@ to_tsquery('simple', %s)"
+            " OR (leads_lead.first_name || ' ' || leads_lead.last_name) %% %s"
+            " OR leads_lead.phone_number %% %s",
+            [tsquery, query, query],
+            output_field=BooleanField(),
+        ))
+
+    if connection.vendor == "sqlite":
+        # '"john"* "smi"*' => every term as a quoted prefix, so user input can't inject FTS5 syntax
+        match = " ".join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+        return queryset.filter(id__in=RawSQL(
+            "SELECT rowid FROM leads_lead_fts WHERE leads_lead_fts MATCH %s", [match]
+        ))
+
+    # other databases have no search index, fall back to a (slow) LIKE scan
+    for term in terms:
+        queryset = queryset.filter(
+            Q(first_name__icontains=term) | Q(last_name__icontains=term) | Q(email__icontains=term)
+            | Q(phone_number__icontains=term) | Q(description__icontains=term)
+        )
+    return queryset
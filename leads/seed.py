@@ -0,0 +1,171 @@
+import random
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from .cache import invalidate_organisation_cache
+from .models import User, UserProfile, Agent, Category, Lead, change_agent_counter, change_category_counter
+
+FIRST_NAMES = (
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+    "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Minh", "Linh", "Anh", "Huong", "Duc", "Mai", "Wei", "Yan", "Hiroshi", "Yuki", "Carlos", "Lucia",
+)
+LAST_NAMES = (
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Nguyen", "Tran", "Le", "Pham", "Wang", "Li", "Zhang", "Tanaka", "Suzuki", "Silva", "Muller", "Rossi",
+)
+CATEGORY_NAMES = ("New", "Contacted", "Qualified", "Proposal", "Negotiation", "Converted", "Unconverted", "On hold")
+DESCRIPTION_WORDS = (
+    "called", "emailed", "interested", "pricing", "demo", "follow", "up", "next", "week", "budget", "approved",
+    "renewal", "contract", "meeting", "referral", "website", "trial", "upgrade", "support", "question",
+)
+
+DEFAULT_BATCH_SIZE = 5000
+
+
+@contextmanager
+def keep_date_added():
+    # auto_now_add overwrites date_added with now() on insert, turn it off so the leads can be spread over the past
+    field = Lead._meta.get_field("date_added")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+def split_skewed(total, parts, rng, skew=1.2):
+    # Split total into parts with a Zipf like distribution: a few big organisations/agents and a long tail of small ones.
+    # The largest part is always the first one, so benchmarks can pick it with prefix-1.
+    weights = [1 / (rank ** skew) for rank in range(1, parts + 1)]
+    shares = [int(total * weight / sum(weights)) for weight in weights]
+    shares[0] += total - sum(shares)
+    return shares
+
+
+class Seeder:
+    """Create organisations, agents, categories and leads with bulk_create, for load tests and benchmarks.
+
+    Every random choice comes from random.Random(seed), so the same arguments always give the same data.
+    """
+    def __init__(self, organisations, agents, categories, leads, seed=0, prefix="seed", batch_size=DEFAULT_BATCH_SIZE,
+                 unassigned_ratio=0.2, uncategorised_ratio=0.3, days=365, stdout=None):
+        self.organisations = organisations
+        self.agents = agents # per organisation
+        self.categories = categories # per organisation
+        self.leads = leads # in total, split between the organisations
+        self.rng = random.Random(seed)
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.unassigned_ratio = unassigned_ratio
+        self.uncategorised_ratio = uncategorised_ratio
+        self.days = days
+        self.stdout = stdout
+        # every seeded user gets the same password ("password"), hashed once instead of once per user
+        self.password = make_password("password")
+
+    def log(self, message):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def run(self):
+        organisations = self.create_organisations()
+        lead_counts = split_skewed(self.leads, len(organisations), self.rng)
+        for organisation, lead_count in zip(organisations, lead_counts):
+            with transaction.atomic():
+                agents = self.create_agents(organisation)
+                categories = self.create_categories(organisation)
+                invalidate_organisation_cache(organisation.pk)
+            self.create_leads(organisation, agents, categories, lead_count)
+            self.log(f"{organisation}: {len(agents)} agents, {len(categories)} categories, {lead_count} leads")
+        return organisations
+
+    @transaction.atomic
+    def create_organisations(self):
+        # bulk_create doesn't send post_save, so the UserProfile that post_user_created_signal would create is created here
+        usernames = [f"{self.prefix}-org{number}" for number in range(1, self.organisations + 1)]
+        User.objects.bulk_create([
+            User(username=username, email=f"{username}@example.com", password=self.password, is_organisor=True)
+            for username in usernames
+        ])
+        # SQLite doesn't return the primary keys of bulk_create, load the users again
+        users = User.objects.filter(username__in=usernames).order_by("id")
+        UserProfile.objects.bulk_create([UserProfile(user=user) for user in users])
+        organisations = list(UserProfile.objects.filter(user__username__in=usernames).select_related("user").order_by("id"))
+        for organisation in organisations: # an organisation id can be reused, see post_organisation_created_signal
+            invalidate_organisation_cache(organisation.pk)
+        return organisations
+
+    def create_agents(self, organisation):
+        usernames = [f"{organisation.user.username}-agent{number}" for number in range(1, self.agents + 1)]
+        User.objects.bulk_create([
+            User(
+                username=username, email=f"{username}@example.com", password=self.password,
+                first_name=self.rng.choice(FIRST_NAMES), last_name=self.rng.choice(LAST_NAMES),
+                is_organisor=False, is_agent=True,
+            )
+            for username in usernames
+        ])
+        users = list(User.objects.filter(username__in=usernames).order_by("id"))
+        # every user has a UserProfile (post_user_created_signal), agents too. An agent's profile isn't an organisation
+        # anything is cached for, there is no cache version to bump like in create_organisations.
+        UserProfile.objects.bulk_create([UserProfile(user=user) for user in users])
+        Agent.objects.bulk_create([Agent(user=user, organisation=organisation) for user in users])
+        return list(Agent.objects.filter(organisation=organisation).order_by("id"))
+
+    def create_categories(self, organisation):
+        names = [
+            CATEGORY_NAMES[number] if number < len(CATEGORY_NAMES) else f"Category {number + 1}"
+            for number in range(self.categories)
+        ]
+        Category.objects.bulk_create([Category(name=name, organisation=organisation) for name in names])
+        return list(Category.objects.filter(organisation=organisation).order_by("id"))
+
+    def create_leads(self, organisation, agents, categories, count):
+        # a few agents/categories get most of the leads, like in a real sales team
+        agent_weights = [1 / rank for rank in range(1, len(agents) + 1)]
+        category_weights = [1 / rank for rank in range(1, len(categories) + 1)]
+        now = timezone.now()
+        with keep_date_added():
+            batch = []
+            for number in range(count):
+                agent = None
+                if agents and self.rng.random() >= self.unassigned_ratio:
+                    agent = self.rng.choices(agents, agent_weights)[0]
+                category = None
+                if categories and self.rng.random() >= self.uncategorised_ratio:
+                    category = self.rng.choices(categories, category_weights)[0]
+                first_name = self.rng.choice(FIRST_NAMES)
+                last_name = self.rng.choice(LAST_NAMES)
+                batch.append(Lead(
+                    first_name=first_name,
+                    last_name=last_name,
+                    age=self.rng.randint(18, 80),
+                    organisation=organisation,
+                    agent=agent,
+                    category=category,
+                    description=" ".join(self.rng.choices(DESCRIPTION_WORDS, k=self.rng.randint(3, 12))),
+                    phone_number=f"555 {self.rng.randint(0, 9999999):07d}",
+                    email=f"{first_name}.{last_name}.{number}@example.com".lower(),
+                    # more recent leads than old ones
+                    date_added=now - timedelta(seconds=int(self.days * 86400 * self.rng.random() ** 2)),
+                ))
+                if len(batch) >= self.batch_size:
+                    self.save_leads(organisation, batch)
+                    batch = []
+            if batch:
+                self.save_leads(organisation, batch)
+
+    @transaction.atomic
+    def save_leads(self, organisation, leads):
+        # same as the importer: bulk_create sends no signals, move the counters once per category and agent
+        Lead.objects.bulk_create(leads, batch_size=len(leads))
+        for category_id, count in Counter(lead.category_id for lead in leads).items():
+            change_category_counter(organisation.pk, category_id, count)
+        for agent_id, count in Counter(lead.agent_id for lead in leads if lead.agent_id).items():
+            change_agent_counter(agent_id, count)
+        invalidate_organisation_cache(organisation.pk)
@@ -0,0 +1,33 @@
+from django import template
+from leads.cache import cached_fragment
+
+register = template.Library()
+
+
+class OrganisationCacheNode(template.Node):
+    def __init__(self, nodelist, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        vary_on = [value.resolve(context) for value in self.vary_on]
+        return cached_fragment(context["request"], self.fragment_name, vary_on, lambda: self.nodelist.render(context))
+
+
+@register.tag("organisation_cache")
+def do_organisation_cache(parser, token):
+    """Cache a template fragment until the next write to the organisation's categories, agents or leads.
+
+        {% load organisation_cache %}
+        {% organisation_cache "category_list" request.user.is_organisor %} ... {% endorganisation_cache %}
+
+    Unlike {% cache %} there is no timeout to pick: the fragment is keyed by the organisation's cache version
+    (see leads/cache.py). Extra arguments are added to the key, like the vary_on arguments of {% cache %}.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' tag requires at least one argument.")
+    nodelist = parser.parse(("endorganisation_cache",))
+    parser.delete_first_token()
+    return OrganisationCacheNode(nodelist, bits[1].strip("'\""), [parser.compile_filter(bit) for bit in bits[2:]])
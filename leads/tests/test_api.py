@@ -0,0 +1,123 @@
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.shortcuts import reverse
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from leads.models import Lead, Agent, Category
+from leads.seed import Seeder
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisation = Seeder(organisations=1, agents=3, categories=3, leads=30, prefix="api").run()[0]
+        cls.organisor = cls.organisation.user
+        cls.agent = Agent.objects.filter(organisation=cls.organisation).order_by("id").first()
+        cls.category = Category.objects.filter(organisation=cls.organisation).order_by("id").first()
+        cls.other = Seeder(organisations=1, agents=1, categories=1, leads=5, prefix="other").run()[0]
+
+    def setUp(self):
+        self.client.force_login(self.organisor)
+
+    def send(self, method, url, data):
+        return getattr(self.client, method)(url, json.dumps(data), content_type="application/json")
+
+    def test_login_required(self):
+        self.client.logout()
+        response = self.client.get(reverse("api:lead-list"))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json(), {"error": "Authentication required"})
+
+    def test_cursor_pagination(self):
+        url = reverse("api:lead-list")
+        names = []
+        response = self.client.get(url, {"limit": 7, "fields": "first_name"})
+        while True:
+            data = response.json()
+            self.assertLessEqual(len(data["results"]), 7)
+            self.assertEqual({key for row in data["results"] for key in row}, {"first_name"})
+            names.extend(row["first_name"] for row in data["results"])
+            if data["next"] is None:
+                break
+            response = self.client.get(data["next"])
+        self.assertEqual(len(names), 30)
+
+    def test_scoping(self):
+        # newest first, only the leads of the organisation
+        results = self.client.get(reverse("api:lead-list"), {"fields": "id,date_added"}).json()["results"]
+        expected = list(Lead.objects.filter(organisation=self.organisation).order_by("-date_added", "-id").values_list("id", flat=True))
+        self.assertEqual([row["id"] for row in results], expected)
+        other_lead = Lead.objects.filter(organisation=self.other).first()
+        self.assertEqual(self.client.get(reverse("api:lead-detail", args=[other_lead.pk])).status_code, 404)
+
+        # an agent only sees their own leads
+        self.client.force_login(self.agent.user)
+        results = self.client.get(reverse("api:lead-list"), {"fields": "agent"}).json()["results"]
+        self.assertEqual({row["agent"] for row in results}, {self.agent.pk})
+        self.assertEqual(len(results), Lead.objects.filter(agent=self.agent).count())
+
+    def test_filters_and_fields(self):
+        url = reverse("api:lead-list")
+        results = self.client.get(url, {"category": "none", "fields": "category"}).json()["results"]
+        self.assertEqual(len(results), Lead.objects.filter(organisation=self.organisation, category__isnull=True).count())
+        self.assertEqual(self.client.get(url, {"fields": "id,password"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"agent": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"limit": "1000"}).status_code, 400)
+        self.assertEqual(self.client.get(url, {"cursor": "nonsense"}).status_code, 404)
+        agent = self.client.get(reverse("api:agent-detail", args=[self.agent.pk])).json()
+        self.assertEqual(agent["email"], self.agent.user.email)
+
+    def test_etag(self):
+        url = reverse("api:lead-list")
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertTrue(response.has_header("Last-Modified"))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(any("leads_lead" in query["sql"] for query in queries))
+
+        # any write to the organisation changes the ETag
+        self.send("patch", reverse("api:category-detail", args=[self.category.pk]), {"name": "Renamed"})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_create_update_delete(self):
+        response = self.send("post", reverse("api:lead-list"), {
+            "first_name": "Api", "last_name": "Lead", "age": 30, "description": "From the API",
+            "phone_number": "555", "email": "api@test.com", "agent": self.agent.pk, "category": self.category.pk,
+        })
+        self.assertEqual(response.status_code, 201, response.content)
+        lead = Lead.objects.get(pk=response.json()["id"])
+        self.assertEqual(response["Location"], reverse("api:lead-detail", args=[lead.pk]))
+        self.assertEqual((lead.organisation, lead.agent, lead.category), (self.organisation, self.agent, self.category))
+
+        url = reverse("api:lead-detail", args=[lead.pk])
+        response = self.send("patch", url, {"agent": None, "category": None})
+        self.assertEqual(response.json()["agent"], None)
+        self.assertEqual(Lead.objects.get(pk=lead.pk).first_name, "Api") # the other fields are kept
+
+        other_category = Category.objects.filter(organisation=self.other).first()
+        response = self.send("patch", url, {"category": other_category.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("category", response.json()["errors"])
+
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(Lead.objects.filter(pk=lead.pk).exists())
+        call_command("rebuild_lead_counters", "--verify", stdout=StringIO())
+
+    def test_if_match(self):
+        url = reverse("api:category-detail", args=[self.category.pk])
+        etag = self.client.get(url)["ETag"]
+        self.send("patch", reverse("api:lead-detail", args=[Lead.objects.filter(organisation=self.organisation).first().pk]), {"age": 99})
+        # someone else changed the organisation's data since the GET
+        response = self.client.patch(url, json.dumps({"name": "Stale"}), content_type="application/json", HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+
+    def test_writes_are_for_organisors(self):
+        self.client.force_login(self.agent.user)
+        response = self.send("post", reverse("api:category-list"), {"name": "Agent category"})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(self.client.delete(reverse("api:agent-detail", args=[self.agent.pk])).status_code, 405)
@@ -0,0 +1,101 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.shortcuts import reverse
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from leads.assignment import assign_leads, get_batch_size
+from leads.models import User, Lead, Agent
+from leads.seed import Seeder
+
+
+class AssignmentTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        cls.organisation = cls.organisor.userprofile
+        cls.agents = [
+            Agent.objects.create(
+                user=User.objects.create_user(username=f"agent{number}", password="password", is_agent=True, is_organisor=False),
+                organisation=cls.organisation,
+            )
+            for number in range(3)
+        ]
+        for number in range(9):
+            cls.create_lead(f"Lead {number}")
+        # a lead of another organisation is never assigned
+        cls.other = User.objects.create_user(username="other", password="password")
+        cls.other_lead = Lead.objects.create(
+            first_name="Other", last_name="Test", organisation=cls.other.userprofile,
+            description="", phone_number="555", email="other@test.com",
+        )
+
+    @classmethod
+    def create_lead(cls, first_name, agent=None):
+        return Lead.objects.create(
+            first_name=first_name, last_name="Test", organisation=cls.organisation, agent=agent,
+            description="", phone_number="555", email="lead@test.com",
+        )
+
+    def lead_counts(self):
+        return [Lead.objects.filter(agent=agent).count() for agent in self.agents]
+
+    def assertCountersAreRight(self):
+        call_command("rebuild_lead_counters", "--verify", stdout=StringIO())
+
+    def test_round_robin(self):
+        counts = assign_leads(self.organisation, "round-robin")
+        self.assertEqual(sum(counts.values()), 9)
+        self.assertEqual(self.lead_counts(), [3, 3, 3])
+        self.assertFalse(Lead.objects.filter(organisation=self.organisation, agent__isnull=True).exists())
+        self.assertIsNone(Lead.objects.get(pk=self.other_lead.pk).agent)
+        self.assertCountersAreRight()
+
+    def test_least_loaded(self):
+        for number in range(4):
+            self.create_lead(f"Assigned {number}", agent=self.agents[0])
+        assign_leads(self.organisation, "least-loaded")
+        # 13 leads in total, agent 0 already had 4
+        self.assertEqual(sorted(self.lead_counts()), [4, 4, 5])
+        self.assertCountersAreRight()
+
+    def test_weighted(self):
+        Agent.objects.filter(pk=self.agents[0].pk).update(capacity=2)
+        Agent.objects.filter(pk=self.agents[2].pk).update(capacity=0)
+        assign_leads(self.organisation, "weighted")
+        self.assertEqual(self.lead_counts(), [6, 3, 0])
+        self.assertCountersAreRight()
+
+    def test_limit_takes_the_oldest_leads(self):
+        assign_leads(self.organisation, "round-robin", limit=2)
+        assigned = Lead.objects.filter(agent__isnull=False).order_by("id").values_list("first_name", flat=True)
+        self.assertEqual(list(assigned), ["Lead 0", "Lead 1"])
+
+    def test_view(self):
+        self.client.force_login(self.organisor)
+        response = self.client.post(reverse("leads:lead-auto-assign"), {"strategy": "round-robin"}, follow=True)
+        self.assertRedirects(response, reverse("leads:lead-list"))
+        self.assertEqual(self.lead_counts(), [3, 3, 3])
+        self.assertContains(response, "9 leads were assigned to 3 agents")
+
+    def test_assign_agent_view_checks_the_organisation(self):
+        lead = Lead.objects.filter(organisation=self.organisation).first()
+        self.client.force_login(self.other)
+        url = reverse("leads:assign-agent", args=[lead.pk])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.organisor)
+        response = self.client.post(url, {"agent": self.agents[1].pk})
+        self.assertRedirects(response, reverse("leads:lead-list"))
+        self.assertEqual(Lead.objects.get(pk=lead.pk).agent, self.agents[1])
+
+
+class BulkAssignmentTest(TestCase):
+    def test_one_update_per_agent_and_batch(self):
+        organisation = Seeder(organisations=1, agents=5, categories=2, leads=2000, unassigned_ratio=1.0, prefix="bulk").run()[0]
+        with CaptureQueriesContext(connection) as queries:
+            counts = assign_leads(organisation, "least-loaded")
+        self.assertEqual(sum(counts.values()), 2000)
+        updates = [query for query in queries if query["sql"].startswith('UPDATE "leads_lead"')]
+        self.assertEqual(len(updates), sum(-(-count // get_batch_size()) for count in counts.values()))
+        call_command("rebuild_lead_counters", "--verify", stdout=StringIO())
@@ -0,0 +1,120 @@
+import asyncio
+import threading
+
+from asgiref.sync import async_to_sync
+from django.shortcuts import reverse
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.urls import include, path
+from djcrm import urls as project_urls
+from leads import urls as lead_urls
+from leads.async_views import (
+    AsyncViewMixin, AsyncLeadListView, AsyncLeadDetailView, AsyncCategoryListView, AsyncCategoryDetailView,
+)
+from leads.middleware import StaticFilesMiddleware, TenantMiddleware
+from leads.models import User, Lead, Agent, Category
+from leads.seed import Seeder
+from leads.tests.test_templates import strip_csrf_tokens
+
+# the project's URLs with the async views, what leads/urls.py serves when ASYNC_VIEWS is on
+ASYNC_VIEWS = {
+    "lead-list": AsyncLeadListView,
+    "lead-detail": AsyncLeadDetailView,
+    "category_list": AsyncCategoryListView,
+    "category_detail": AsyncCategoryDetailView,
+}
+urlpatterns = [
+    path("leads/", include(([
+        path(str(pattern.pattern), ASYNC_VIEWS[pattern.name].as_view(), name=pattern.name)
+        if pattern.name in ASYNC_VIEWS else pattern
+        for pattern in lead_urls.urlpatterns
+    ], "leads"), namespace="leads")),
+    *[pattern for pattern in project_urls.urlpatterns if getattr(pattern, "namespace", None) != "leads"],
+]
+
+
+class AsyncViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        organisation = cls.organisor.userprofile
+        agent_user = User.objects.create_user(username="agent", password="password", is_agent=True, is_organisor=False)
+        cls.agent = Agent.objects.create(user=agent_user, organisation=organisation)
+        cls.category = Category.objects.create(name="Contacted", organisation=organisation)
+        cls.lead = Lead.objects.create(
+            first_name="John", last_name="Smith", age=30, organisation=organisation, agent=cls.agent, category=cls.category,
+        )
+        Lead.objects.create(first_name="Jane", last_name="Doe", age=25, organisation=organisation)
+        other = User.objects.create_user(username="other", password="password")
+        cls.other_category = Category.objects.create(name="Other", organisation=other.userprofile)
+
+    def get_urls(self):
+        return [
+            reverse("leads:lead-list"),
+            reverse("leads:lead-list") + "?q=john",
+            reverse("leads:lead-detail", args=[self.lead.pk]),
+            reverse("leads:category_list"),
+            reverse("leads:category_detail", args=[self.category.pk]),
+        ]
+
+    def test_same_pages_as_the_sync_views(self):
+        for user in (self.organisor, self.agent.user):
+            self.client.force_login(user)
+            for url in self.get_urls():
+                with self.subTest(user=user.username, url=url):
+                    expected = self.client.get(url)
+                    with override_settings(ROOT_URLCONF=__name__):
+                        response = self.client.get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(strip_csrf_tokens(response.content), strip_csrf_tokens(expected.content))
+
+    @override_settings(ROOT_URLCONF=__name__)
+    def test_login_and_organisation_are_checked(self):
+        response = self.client.get(reverse("leads:lead-list"))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response["Location"].startswith("/login"))
+        self.client.force_login(self.organisor)
+        self.assertEqual(self.client.get(reverse("leads:category_detail", args=[self.other_category.pk])).status_code, 404)
+        self.assertEqual(self.client.get(reverse("leads:lead-list"), {"cursor": "broken"}).status_code, 404)
+        self.assertEqual(self.client.post(reverse("leads:lead-list")).status_code, 405)
+
+    @override_settings(ROOT_URLCONF=__name__)
+    def test_async_request_handler(self):
+        # the whole chain is async: AsyncClient runs the ASGI handler
+        client = AsyncClient()
+        client.force_login(self.organisor)
+
+        async def get():
+            return await client.get(reverse("leads:lead-list"))
+        response = async_to_sync(get)()
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Jane")
+
+    def test_middleware_follows_the_chain(self):
+        async def get_response(request):
+            pass
+
+        def get_sync_response(request):
+            pass
+
+        for middleware_class in (TenantMiddleware, StaticFilesMiddleware):
+            self.assertTrue(asyncio.iscoroutinefunction(middleware_class(get_response)))
+            self.assertFalse(asyncio.iscoroutinefunction(middleware_class(get_sync_response)))
+
+
+class ConcurrentQueriesTest(TransactionTestCase):
+    # outside a transaction, so the queries run in threads with their own connections
+
+    def test_queries_run_at_the_same_time(self):
+        barrier = threading.Barrier(2, timeout=5) # both functions must be running to get through it
+        view = AsyncViewMixin()
+        view.in_transaction = False
+        results = async_to_sync(view.run_queries)(lambda: (barrier.wait(), "a")[1], lambda: (barrier.wait(), "b")[1])
+        self.assertEqual(results, ["a", "b"])
+
+    @override_settings(ROOT_URLCONF=__name__)
+    def test_lead_list(self):
+        organisation = Seeder(organisations=1, agents=2, categories=2, leads=30, prefix="async").run()[0]
+        self.client.force_login(organisation.user)
+        response = self.client.get(reverse("leads:lead-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["leads"]), Lead.objects.filter(agent__isnull=False).count())
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command, CommandError
+from django.test import LiveServerTestCase, TestCase
+from leads.benchmark import compare_with_baseline, percentile
+from leads.models import User, Lead, Agent, Category, UserProfile
+
+
+class SeedCrmTest(TestCase):
+    def test_seed(self):
+        call_command(
+            "seed_crm", "--organisations", "3", "--agents", "4", "--categories", "3", "--leads", "300",
+            "--batch-size", "50", stdout=StringIO(),
+        )
+        self.assertEqual(UserProfile.objects.filter(user__username__startswith="seed-org", user__is_organisor=True).count(), 3)
+        self.assertEqual(Agent.objects.count(), 12)
+        # like a user created with save() (post_user_created_signal), every seeded user has a profile
+        self.assertFalse(User.objects.filter(userprofile__isnull=True).exists())
+        self.assertEqual(Category.objects.count(), 9)
+        self.assertEqual(Lead.objects.count(), 300)
+        # the first organisation is the biggest one
+        counts = [Lead.objects.filter(organisation__user__username=f"seed-org{number}").count() for number in (1, 2, 3)]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        # bulk_create sends no signals, the seeder must have moved the counters itself
+        call_command("rebuild_lead_counters", "--verify", stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command("seed_crm", "--organisations", "1", "--leads", "1", stdout=StringIO())
+
+    def test_same_seed_same_data(self):
+        call_command("seed_crm", "--organisations", "1", "--leads", "20", "--prefix", "a", stdout=StringIO())
+        call_command("seed_crm", "--organisations", "1", "--leads", "20", "--prefix", "b", stdout=StringIO())
+        leads = [
+            list(Lead.objects.filter(organisation__user__username=f"{prefix}-org1").order_by("id").values_list("first_name", "age"))
+            for prefix in ("a", "b")
+        ]
+        self.assertEqual(leads[0], leads[1])
+
+
+class BenchmarkCrmTest(TestCase):
+    def test_benchmark_and_baseline(self):
+        call_command("seed_crm", "--organisations", "1", "--agents", "2", "--leads", "30", stdout=StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "baseline.json")
+            call_command("benchmark_crm", "--requests", "2", "--warmup", "0", "--output", path, stdout=StringIO())
+            with open(path) as file:
+                results = json.load(file)
+            self.assertEqual(results["leads:lead-list"]["status"], 200)
+            self.assertIn("leads:lead-list?q=smith", results)
+            self.assertIn("agents:agent-detail", results)
+            self.assertGreater(results["leads:lead-detail"]["queries"], 0)
+
+            # pretend the baseline needed fewer queries
+            results["leads:lead-list"]["queries"] = 0
+            with open(path, "w") as file:
+                json.dump(results, file)
+            with self.assertRaises(CommandError):
+                call_command("benchmark_crm", "--requests", "1", "--warmup", "0", "--baseline", path, stdout=StringIO(), stderr=StringIO())
+
+    def test_compare_with_baseline(self):
+        baseline = {"page": {"p95": 10.0, "queries": 3}}
+        self.assertEqual(compare_with_baseline({"page": {"p95": 11.5, "queries": 3}}, baseline), [])
+        self.assertEqual(len(compare_with_baseline({"page": {"p95": 13.0, "queries": 4}}, baseline)), 2)
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 50), 3)
+        self.assertEqual(percentile([5, 1, 4, 2, 3], 99), 5)
+
+
+class BenchmarkConcurrencyTest(LiveServerTestCase):
+    def test_load_test_of_a_running_server(self):
+        call_command("seed_crm", "--organisations", "1", "--agents", "2", "--leads", "30", stdout=StringIO())
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.json")
+            call_command(
+                "benchmark_concurrency", self.live_server_url, "--concurrency", "1,2", "--requests", "8", "--output", path,
+                stdout=StringIO(),
+            )
+            with open(path) as file:
+                results = json.load(file)[self.live_server_url]
+        self.assertEqual([result["concurrency"] for result in results], [1, 2])
+        self.assertEqual([result["errors"] for result in results], [0, 0]) # logged in, no redirect to the login page
@@ -0,0 +1,133 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete, pre_delete
+from django.shortcuts import reverse
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from leads.bulk import bulk_assign_agent, bulk_update_category, bulk_delete_leads, raw_delete
+from leads.models import Lead, Agent, Category
+from leads.seed import Seeder
+
+
+class BulkActionTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisation = Seeder(organisations=1, agents=3, categories=3, leads=60, prefix="bulk").run()[0]
+        cls.organisor = cls.organisation.user
+        cls.agents = list(Agent.objects.filter(organisation=cls.organisation).order_by("id"))
+        cls.categories = list(Category.objects.filter(organisation=cls.organisation).order_by("id"))
+        # the leads of another organisation are never touched
+        cls.other = Seeder(organisations=1, agents=1, categories=1, leads=5, prefix="other").run()[0]
+
+    def leads(self):
+        return Lead.objects.filter(organisation=self.organisation)
+
+    def assertCountersAreRight(self):
+        call_command("rebuild_lead_counters", "--verify", stdout=StringIO())
+
+    def test_assign(self):
+        lead_ids = list(self.leads().order_by("id").values_list("id", flat=True)[:20])
+        already_assigned = self.leads().filter(pk__in=lead_ids, agent=self.agents[2]).count()
+        count = bulk_assign_agent(self.organisation, Lead.objects.filter(pk__in=lead_ids), self.agents[2])
+        self.assertEqual(count, 20 - already_assigned)
+        self.assertEqual(self.leads().filter(pk__in=lead_ids, agent=self.agents[2]).count(), 20)
+        self.assertCountersAreRight()
+
+    def test_update_category(self):
+        queryset = self.leads().filter(category=self.categories[0])
+        moved = queryset.count()
+        self.assertEqual(bulk_update_category(self.organisation, queryset, self.categories[1]), moved)
+        self.assertFalse(self.leads().filter(category=self.categories[0]).exists())
+        # only the leads that change category are counted
+        categorised = self.leads().filter(category__isnull=False).count()
+        self.assertEqual(bulk_update_category(self.organisation, self.leads(), None), categorised)
+        self.assertFalse(self.leads().filter(category__isnull=False).exists())
+        self.assertCountersAreRight()
+
+    def test_delete(self):
+        self.assertEqual(bulk_delete_leads(self.organisation, Lead.objects.all()), 60)
+        self.assertFalse(self.leads().exists())
+        self.assertEqual(Lead.objects.filter(organisation=self.other).count(), 5)
+        self.assertCountersAreRight()
+
+    def test_one_statement_for_all_the_leads(self):
+        with CaptureQueriesContext(connection) as queries:
+            bulk_delete_leads(self.organisation, self.leads())
+        deletes = [query for query in queries if query["sql"].startswith('DELETE FROM "leads_lead"')]
+        self.assertEqual(len(deletes), 1)
+
+    def test_view(self):
+        url = reverse("leads:lead-bulk-action")
+        lead_ids = list(self.leads().order_by("id").values_list("id", flat=True)[:5])
+        other_lead = Lead.objects.filter(organisation=self.other).first()
+        self.client.force_login(self.organisor)
+        response = self.client.post(url, {"action": "categorize", "leads": lead_ids + [other_lead.pk], "category": self.categories[2].pk})
+        self.assertRedirects(response, reverse("leads:lead-list"))
+        self.assertEqual(self.leads().filter(pk__in=lead_ids, category=self.categories[2]).count(), 5)
+        self.assertEqual(Lead.objects.get(pk=other_lead.pk).category, other_lead.category)
+
+        # all the leads matching the search
+        response = self.client.post(url, {"action": "delete", "select_all": "on", "q": "smith", "confirm_delete": "on"})
+        self.assertRedirects(response, reverse("leads:lead-list") + "?q=smith", fetch_redirect_response=False)
+        self.assertFalse(self.leads().filter(last_name="Smith").exists())
+        self.assertCountersAreRight()
+
+    def test_view_validation(self):
+        url = reverse("leads:lead-bulk-action")
+        lead_id = self.leads().first().pk
+        self.client.force_login(self.organisor)
+        self.client.post(url, {"action": "assign", "leads": [lead_id]}) # no agent
+        self.client.post(url, {"action": "assign", "leads": [lead_id], "agent": Agent.objects.filter(organisation=self.other).first().pk})
+        self.client.post(url, {"action": "delete", "confirm_delete": "on"}) # no lead
+        self.client.post(url, {"action": "delete", "select_all": "on"}) # not confirmed
+        self.assertEqual(self.leads().count(), 60)
+        self.assertFalse(Lead.objects.filter(pk=lead_id, agent__organisation=self.other).exists())
+
+    def test_view_reports_the_result(self):
+        url = reverse("leads:lead-bulk-action")
+        self.client.force_login(self.organisor)
+        smiths = self.leads().filter(last_name="Smith").count()
+        response = self.client.post(url, {"action": "delete", "select_all": "on", "q": "smith", "confirm_delete": "on"}, follow=True)
+        self.assertContains(response, f"{smiths} leads were deleted")
+        # an invalid submission goes back to the lead list with the reason
+        response = self.client.post(url, {"action": "assign", "leads": [self.leads().first().pk]}, follow=True)
+        self.assertContains(response, "Pick the agent to assign the leads to.")
+        response = self.client.post(url, {"action": "delete", "select_all": "on"}, follow=True)
+        self.assertContains(response, "Tick Confirm the deletion to delete the leads.")
+
+    def test_view_is_for_organisors(self):
+        url = reverse("leads:lead-bulk-action")
+        self.client.force_login(self.agents[0].user)
+        self.client.post(url, {"action": "delete", "select_all": "on", "confirm_delete": "on"})
+        self.assertEqual(self.leads().count(), 60)
+        self.client.force_login(self.organisor)
+        self.assertEqual(self.client.get(url).status_code, 405)
+
+    def test_lead_list_has_the_checkboxes(self):
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse("leads:lead-list"))
+        self.assertContains(response, 'id="lead-bulk-form"')
+        self.assertContains(response, 'form="lead-bulk-form"')
+        self.client.force_login(self.agents[0].user)
+        self.assertNotContains(self.client.get(reverse("leads:lead-list")), 'id="lead-bulk-form"')
+
+
+class RawDeleteTest(TestCase):
+    # bulk_delete_leads relies on QuerySet._raw_delete, a private method of Django
+    def test_one_delete_without_signals(self):
+        organisation = Seeder(organisations=1, agents=1, categories=1, leads=5, prefix="raw").run()[0]
+        deleted = []
+        for signal in (pre_delete, post_delete):
+            signal.connect(lambda **kwargs: deleted.append(kwargs), sender=Lead, weak=False, dispatch_uid="RawDeleteTest")
+            self.addCleanup(signal.disconnect, sender=Lead, dispatch_uid="RawDeleteTest")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(raw_delete(Lead.objects.filter(organisation=organisation)), 5)
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(deleted)
+        self.assertFalse(Lead.objects.filter(organisation=organisation).exists())
+
+    def test_nothing_to_cascade(self):
+        # a foreign key to Lead would be left pointing to deleted leads (or make the DELETE fail)
+        self.assertEqual(Lead._meta.related_objects, ())
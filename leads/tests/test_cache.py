@@ -0,0 +1,109 @@
+import tempfile
+from unittest import skipUnless
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from leads.cache import cached_for_organisation, get_cache_version, invalidate_organisation_cache
+from leads import metrics, replicas
+from leads.models import User, Lead, Agent, Category
+
+
+class OrganisationCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        cls.organisation = cls.organisor.userprofile
+        agent_user = User.objects.create_user(
+            username="agent", email="agent@test.com", password="password", is_agent=True, is_organisor=False
+        )
+        cls.agent = Agent.objects.create(user=agent_user, organisation=cls.organisation)
+        Category.objects.create(name="Contacted", organisation=cls.organisation)
+        cls.lead = Lead.objects.create(
+            first_name="John", last_name="Smith", organisation=cls.organisation,
+            description="", phone_number="555", email="john@test.com",
+        )
+
+    def setUp(self):
+        self.client.force_login(self.organisor)
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, len(queries)
+
+    def test_category_list_fragment(self):
+        url = reverse("leads:category_list")
+        response, first = self.get(url)
+        self.assertContains(response, "Contacted")
+        response, second = self.get(url)
+        self.assertContains(response, "Contacted")
+        self.assertLess(second, first) # the categories are not queried on a cache hit
+
+        # a new category bumps the version, the fragment is rendered again
+        Category.objects.create(name="Converted", organisation=self.organisation)
+        response, third = self.get(url)
+        self.assertContains(response, "Converted")
+        self.assertEqual(third, first)
+
+    def test_agent_dropdown_follows_agent_changes(self):
+        url = reverse("leads:assign-agent", args=[self.lead.pk])
+        self.assertContains(self.client.get(url), "agent@test.com")
+        self.agent.user.email = "renamed@test.com"
+        self.agent.user.save()
+        response = self.client.get(url)
+        self.assertContains(response, "renamed@test.com")
+        self.assertNotContains(response, "agent@test.com")
+
+        # the cached choices are only used for rendering, the posted agent is still validated against the organisation
+        other = User.objects.create_user(username="other", password="password")
+        other_agent = Agent.objects.create(
+            user=User.objects.create_user(username="other-agent", password="password", is_agent=True, is_organisor=False),
+            organisation=other.userprofile,
+        )
+        response = self.client.post(url, {"agent": other_agent.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors)
+
+    @skipUnless(metrics.Counter, "prometheus-client is not installed")
+    def test_hit_rate_metric(self):
+        def sample(result):
+            return metrics.REGISTRY.get_sample_value("djcrm_cache_requests_total", {"cache": "organisation", "result": result}) or 0
+
+        hits, misses = sample("hit"), sample("miss")
+        cached_for_organisation(self.organisation.pk, "answer", lambda: 42)
+        self.assertEqual(cached_for_organisation(self.organisation.pk, "answer", lambda: 0), 42)
+        self.assertEqual((sample("hit") - hits, sample("miss") - misses), (1, 1))
+
+    def test_not_cached_from_a_replica(self):
+        with replicas.read_from_replica():
+            replicas.replica_reads.get().alias = "replica1" # as if a query of the block had picked it
+            cached_for_organisation(self.organisation.pk, "replica-answer", lambda: 1)
+            self.assertEqual(cached_for_organisation(self.organisation.pk, "replica-answer", lambda: 2), 2)
+        with replicas.read_from_replica():
+            replicas.replica_reads.get().alias = "default" # no replica was up to date
+            cached_for_organisation(self.organisation.pk, "replica-answer", lambda: 3)
+        self.assertEqual(cached_for_organisation(self.organisation.pk, "replica-answer", lambda: 4), 3)
+
+    def test_version_is_bumped_again_after_commit(self):
+        version = get_cache_version(self.organisation.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                invalidate_organisation_cache(self.organisation.pk)
+                self.assertEqual(get_cache_version(self.organisation.pk), version + 1)
+        self.assertEqual(get_cache_version(self.organisation.pk), version + 2)
+
+    def test_file_based_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            backend = {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory}
+            with override_settings(CACHES={"default": backend}):
+                self.assertEqual(cached_for_organisation(self.organisation.pk, "answer", lambda: 42), 42)
+                self.assertEqual(cached_for_organisation(self.organisation.pk, "answer", lambda: 0), 42)
+                Lead.objects.create(
+                    first_name="Jane", last_name="Doe", organisation=self.organisation,
+                    description="", phone_number="555", email="jane@test.com",
+                )
+                self.assertEqual(cached_for_organisation(self.organisation.pk, "answer", lambda: 0), 0)
+                cache.clear()
@@ -0,0 +1,116 @@
+import json
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from leads.bulk import bulk_assign_agent, bulk_delete_leads
+from leads.changes import WatermarkExpired, get_lead_changes, prune_tombstones
+from leads.models import Lead, LeadTombstone, Agent, Category
+from leads.pagination import encode_cursor
+from leads.seed import Seeder
+
+
+@override_settings(LEAD_CHANGES_SETTLE_SECONDS=0)
+class ChangeFeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisation = Seeder(organisations=1, agents=2, categories=2, leads=20, prefix="feed").run()[0]
+        cls.other = Seeder(organisations=1, agents=1, categories=1, leads=5, prefix="other").run()[0]
+
+    def leads(self):
+        return Lead.objects.filter(organisation=self.organisation)
+
+    def pull(self, since):
+        changes, watermark, has_more = get_lead_changes(self.organisation, since=since, limit=1000)
+        self.assertFalse(has_more)
+        return changes, watermark
+
+    def test_everything_then_only_the_changes(self):
+        changes, watermark = self.pull(None)
+        self.assertEqual(len(changes), 20)
+        self.assertEqual([change["timestamp"] for change in changes], sorted(change["timestamp"] for change in changes))
+        self.assertEqual(self.pull(watermark)[0], [])
+
+        lead = self.leads().order_by("id").first()
+        lead.age = 99
+        lead.save()
+        deleted = self.leads().order_by("id").last()
+        deleted_id = deleted.pk
+        deleted.delete()
+        changes, watermark = self.pull(watermark)
+        self.assertEqual([(change["type"], change["id"]) for change in changes], [("update", lead.pk), ("delete", deleted_id)])
+        self.assertEqual(changes[0]["lead"]["age"], 99)
+        self.assertIsNone(changes[1]["lead"])
+
+    def test_bulk_changes_are_in_the_feed(self):
+        changes, watermark = self.pull(None)
+        agent = Agent.objects.filter(organisation=self.organisation).order_by("id").last()
+        assigned = bulk_assign_agent(self.organisation, self.leads(), agent)
+        changes, watermark = self.pull(watermark)
+        self.assertEqual(len(changes), assigned)
+
+        # deleting a category empties the category of its leads (SET_NULL)
+        category = Category.objects.filter(organisation=self.organisation, leads__isnull=False).first()
+        lead_ids = set(category.leads.values_list("id", flat=True))
+        category.delete()
+        changes, watermark = self.pull(watermark)
+        self.assertEqual({change["id"] for change in changes}, lead_ids)
+
+        self.assertEqual(bulk_delete_leads(self.organisation, self.leads()), 20)
+        changes, watermark = self.pull(watermark)
+        self.assertEqual([change["type"] for change in changes], ["delete"] * 20)
+
+    def test_pages(self):
+        changes, watermark, has_more = get_lead_changes(self.organisation, limit=15)
+        self.assertEqual((len(changes), has_more), (15, True))
+        rest, watermark, has_more = get_lead_changes(self.organisation, since=watermark, limit=15)
+        self.assertEqual((len(rest), has_more), (5, False))
+        self.assertFalse({change["id"] for change in changes} & {change["id"] for change in rest})
+
+    @override_settings(LEAD_CHANGES_SETTLE_SECONDS=60)
+    def test_recent_changes_wait(self):
+        # the seeded leads were just saved, their transactions could still be open
+        self.assertEqual(self.pull(None)[0], [])
+
+    def test_tombstones_expire(self):
+        LeadTombstone.objects.create(lead_id=1, organisation=self.organisation, deleted_at=timezone.now() - timedelta(days=100))
+        self.assertEqual(prune_tombstones(), 1)
+        with self.assertRaises(WatermarkExpired):
+            get_lead_changes(self.organisation, since=(timezone.now() - timedelta(days=100), 0))
+
+    def test_api(self):
+        url = reverse("api:lead-changes")
+        self.client.force_login(self.organisation.user)
+        data = self.client.get(url, {"fields": "id,updated_at"}).json()
+        self.assertEqual(len(data["results"]), 20)
+        self.assertEqual(set(data["results"][0]["lead"]), {"id", "updated_at"})
+        self.leads().first().delete()
+        data = self.client.get(url, {"since": data["watermark"]}).json()
+        self.assertEqual([change["type"] for change in data["results"]], ["delete"])
+        self.client.force_login(Agent.objects.filter(organisation=self.organisation).first().user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_invalid_watermark(self):
+        url = reverse("api:lead-changes")
+        self.client.force_login(self.organisation.user)
+        naive = encode_cursor((timezone.now().replace(tzinfo=None), 0)) # a datetime without time zone
+        for since in (naive, "not-a-watermark"):
+            with self.subTest(since=since):
+                response = self.client.get(url, {"since": since})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn("Invalid watermark", response.json()["error"])
+
+    def test_command(self):
+        stdout, stderr = StringIO(), StringIO()
+        call_command("lead_changes", "--organisation", self.organisation.user.username, stdout=stdout, stderr=stderr)
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 20)
+        self.assertEqual(json.loads(lines[0])["type"], "update")
+        watermark = stderr.getvalue().split("next watermark: ")[1].strip()
+
+        stdout = StringIO()
+        call_command("lead_changes", "--organisation", self.organisation.user.username, "--since", watermark, stdout=stdout, stderr=StringIO())
+        self.assertEqual(stdout.getvalue(), "")
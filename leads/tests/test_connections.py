@@ -0,0 +1,112 @@
+import threading
+from unittest import mock, skipUnless
+
+from django.core.signals import request_started
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase
+from leads import connections as lead_connections
+
+
+class HealthCheckTest(SimpleTestCase):
+    databases = {"default"}
+
+    def get_wrapper(self, health_checks=True, connect=True):
+        # a connection of its own, outside the test transaction
+        wrapper = connections.create_connection("default")
+        wrapper.settings_dict["CONN_HEALTH_CHECKS"] = health_checks
+        if connect:
+            wrapper.ensure_connection()
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def check(self, wrapper, usable, queries=1):
+        # (pings, closed) after a request starts and runs queries. An in-memory SQLite database is never really closed,
+        # close() is only recorded.
+        with mock.patch.object(lead_connections, "connections", mock.Mock(all=lambda: [wrapper])), \
+                mock.patch.object(wrapper, "is_usable", return_value=usable) as is_usable, \
+                mock.patch.object(wrapper, "close") as close:
+            request_started.send(sender=self.__class__)
+            for _ in range(queries):
+                with wrapper.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+        return is_usable.call_count, close.called
+
+    def test_dropped_connection_is_replaced(self):
+        self.assertEqual(self.check(self.get_wrapper(), usable=False), (1, True)) # the query connects again
+
+    def test_working_connection_is_kept(self):
+        self.assertEqual(self.check(self.get_wrapper(), usable=True), (1, False))
+
+    def test_once_per_request(self):
+        self.assertEqual(self.check(self.get_wrapper(), usable=True, queries=3), (1, False))
+
+    def test_only_the_connections_the_request_uses(self):
+        self.assertEqual(self.check(self.get_wrapper(), usable=False, queries=0), (0, False))
+
+    def test_new_connection_is_not_pinged(self):
+        self.assertEqual(self.check(self.get_wrapper(connect=False), usable=False), (0, False))
+
+    def test_off(self):
+        self.assertEqual(self.check(self.get_wrapper(health_checks=False), usable=False), (0, False))
+
+
+class PingTest(SimpleTestCase):
+    def test_ping_leaves_no_transaction_open(self):
+        try:
+            from djcrm.postgresql_pool.base import is_usable
+        except ImportError:
+            self.skipTest("psycopg2 is not installed")
+        for autocommit in (False, True):
+            with self.subTest(autocommit=autocommit):
+                pooled = mock.MagicMock(autocommit=autocommit)
+                self.assertTrue(is_usable(pooled))
+                self.assertEqual(pooled.rollback.called, not autocommit)
+
+
+@skipUnless(connection.vendor == "postgresql", "the pool is for PostgreSQL")
+class ConnectionPoolTest(TestCase):
+    def get_pool(self, **options):
+        from djcrm.postgresql_pool.base import ConnectionPool
+        pool = ConnectionPool(connection.get_connection_params(), check=True, **options)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_connection_is_reused(self):
+        pool = self.get_pool(min_size=1, max_size=1)
+        first = pool.getconn()
+        pool.putconn(first)
+        self.assertIs(pool.getconn(), first)
+
+    def test_waits_for_a_free_connection(self):
+        pool = self.get_pool(min_size=0, max_size=1, timeout=5)
+        taken = pool.getconn()
+        threading.Timer(0.1, pool.putconn, [taken]).start()
+        self.assertIs(pool.getconn(), taken)
+
+        pool.timeout = 0.1
+        with self.assertRaises(connection.Database.OperationalError):
+            pool.getconn()
+
+    def test_closed_connection_is_replaced(self):
+        pool = self.get_pool(min_size=1, max_size=1)
+        broken = pool.getconn()
+        pool.putconn(broken)
+        broken.close()
+        self.assertIsNot(pool.getconn(), broken)
+
+    def test_connect_through_the_pool(self):
+        # what a request does: Django's connect() sets the session up on a connection the pool just pinged
+        from djcrm.postgresql_pool.base import DatabaseWrapper, close_pools
+        settings_dict = {
+            **connection.settings_dict,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {**connection.settings_dict["OPTIONS"], "pool": {"min_size": 1, "max_size": 1}},
+        }
+        self.addCleanup(close_pools)
+        for _ in range(2): # a new connection, then the same one back from the pool
+            wrapper = DatabaseWrapper(settings_dict, alias="pooled")
+            with wrapper.cursor() as cursor:
+                cursor.execute("SELECT 1")
+                self.assertEqual(cursor.fetchone(), (1,))
+            self.assertTrue(wrapper.get_autocommit())
+            wrapper.close()
@@ -0,0 +1,141 @@
+import io
+from io import StringIO
+
+from django.core.management import call_command
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from leads.dedup import find_duplicate_lead, find_duplicates
+from leads.importer import import_leads
+from leads.models import User, Lead
+from leads.normalize import normalize_email, normalize_name, normalize_phone
+
+
+class NormalizeTest(TestCase):
+    def test_email(self):
+        self.assertEqual(normalize_email(" John@Example.COM "), "john@example.com")
+        self.assertEqual(normalize_email(None), "")
+
+    def test_phone(self):
+        self.assertEqual(normalize_phone("+1 (555) 123-4567"), "+15551234567")
+        self.assertEqual(normalize_phone("0044 20 7946 0958"), "+442079460958")
+        self.assertEqual(normalize_phone("020 7946 0958"), "02079460958")
+        self.assertEqual(normalize_phone("n/a"), "")
+        with override_settings(LEAD_PHONE_COUNTRY_CODE="44"):
+            self.assertEqual(normalize_phone("020 7946 0958"), "+442079460958")
+
+    def test_phone_fits_the_column(self):
+        # 20 digits, the longest phone_number: with a country code in front it would not fit in phone_normalized
+        long_number = "1" * 20
+        with override_settings(LEAD_PHONE_COUNTRY_CODE="44"):
+            self.assertEqual(normalize_phone(long_number), long_number)
+            self.assertEqual(normalize_phone("+" + "2" * 19), "2" * 19)
+            self.assertEqual(normalize_phone("0044 20 7946 0958"), "+442079460958")
+            organisor = User.objects.create_user(username="organisor", password="password")
+            lead = Lead.objects.create(
+                first_name="John", last_name="Smith", age=30, organisation=organisor.userprofile, phone_number=long_number,
+            )
+        self.assertLessEqual(len(lead.phone_normalized), Lead._meta.get_field("phone_normalized").max_length)
+
+    def test_name(self):
+        self.assertEqual(normalize_name("José", "O'Neil"), normalize_name("oneil", "jose"))
+
+    def test_columns_are_set_on_save(self):
+        organisor = User.objects.create_user(username="organisor", password="password")
+        lead = Lead.objects.create(
+            first_name="John", last_name="Smith", age=30, organisation=organisor.userprofile,
+            email="John@Example.com", phone_number="+1 555 123 4567",
+        )
+        lead.refresh_from_db()
+        self.assertEqual((lead.email_normalized, lead.phone_normalized), ("john@example.com", "+15551234567"))
+
+
+class DuplicateCheckTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        cls.organisation = cls.organisor.userprofile
+        cls.lead = Lead.objects.create(
+            first_name="John", last_name="Smith", age=30, organisation=cls.organisation,
+            email="john@example.com", phone_number="555 123 4567",
+        )
+
+    def create_lead(self, **kwargs):
+        data = {"first_name": "Jane", "last_name": "Doe", "age": 25, "description": "New", "phone_number": "555 000 0000",
+                "email": "jane@example.com", **kwargs}
+        return self.client.post(reverse("leads:lead-create"), data)
+
+    def test_find_duplicate_lead(self):
+        self.assertEqual(find_duplicate_lead(self.organisation, "JOHN@example.com ", ""), (self.lead, "email"))
+        self.assertEqual(find_duplicate_lead(self.organisation, "", "(555) 123-4567"), (self.lead, "phone_number"))
+        self.assertEqual(find_duplicate_lead(self.organisation, "john@example.com", "", exclude_pk=self.lead.pk), (None, None))
+        other = User.objects.create_user(username="other", password="password").userprofile
+        self.assertEqual(find_duplicate_lead(other, "john@example.com", ""), (None, None))
+
+    def test_create_form_rejects_a_duplicate(self):
+        self.client.force_login(self.organisor)
+        response = self.create_lead(email="John@Example.com")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("email", response.context["form"].errors)
+        response = self.create_lead(phone_number="555-123-4567")
+        self.assertIn("phone_number", response.context["form"].errors)
+        self.assertEqual(self.create_lead().status_code, 302)
+
+    def test_update_form_accepts_the_lead_itself(self):
+        self.client.force_login(self.organisor)
+        response = self.client.post(reverse("leads:lead-update", args=[self.lead.pk]), {
+            "first_name": "Johnny", "last_name": "Smith", "age": 31, "description": "Updated",
+            "phone_number": "555 123 4567", "email": "JOHN@example.com",
+        })
+        self.assertEqual(response.status_code, 302)
+
+    def test_import_skips_existing_and_repeated_contacts(self):
+        csv = (
+            "first_name,last_name,age,agent,description,phone_number,email\n"
+            "John,Smith,30,,Imported,555 999 9999,JOHN@example.com\n"  # email of the existing lead
+            "Jane,Doe,25,,Imported,555 111 1111,jane@example.com\n"
+            "Jane,Doe,25,,Imported,555-111-1111,jane.doe@example.com\n"  # phone number of the row above
+            "Jim,Beam,40,,Imported,555 222 2222,jim@example.com\n"
+        )
+        result = import_leads(io.StringIO(csv), "csv", self.organisation, batch_size=2)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([error["row"] for error in result.errors], [2, 4])
+        self.assertIn("email", result.errors[0]["errors"])
+        self.assertIn("phone_number", result.errors[1]["errors"])
+
+
+class FindDuplicatesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        cls.organisation = cls.organisor.userprofile
+        leads = [
+            ("John", "Smith", "john@example.com", "555 1"),
+            ("Jon", "Smith", "JOHN@example.com", "555 2"),  # same email, similar name
+            ("Smith", "John", "john.smith@example.com", "555-2"),  # same phone as the lead above
+            ("Jane", "Doe", "jane@example.com", "555 2"),  # same phone, another name
+            ("Bob", "Brown", "bob@example.com", "555 3"),
+        ]
+        cls.leads = [
+            Lead.objects.create(first_name=first_name, last_name=last_name, age=30, organisation=cls.organisation,
+                                email=email, phone_number=phone_number)
+            for first_name, last_name, email, phone_number in leads
+        ]
+        other = User.objects.create_user(username="other", password="password").userprofile
+        Lead.objects.create(first_name="John", last_name="Smith", age=30, organisation=other, email="john@example.com")
+
+    def test_groups(self):
+        groups, skipped = find_duplicates(self.organisation)
+        self.assertEqual([[row["id"] for row in group] for group in groups], [[lead.pk for lead in self.leads[:3]]])
+        self.assertEqual(skipped, [])
+
+    def test_big_blocks_are_skipped(self):
+        groups, skipped = find_duplicates(self.organisation, max_block_size=2)
+        self.assertEqual(skipped, [("phone_normalized", "5552", 3)])
+        self.assertEqual([[row["id"] for row in group] for group in groups], [[lead.pk for lead in self.leads[:2]]])
+
+    def test_command(self):
+        out, err = StringIO(), StringIO()
+        call_command("find_duplicates", "--organisation", "organisor", "--max-block-size", "2", stdout=out, stderr=err)
+        self.assertIn(f"#{self.leads[0].pk} John Smith", out.getvalue())
+        self.assertIn("Found 1 groups of duplicates (2 leads)", out.getvalue())
+        self.assertIn("Skipped phone_normalized=5552", err.getvalue())
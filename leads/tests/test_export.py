@@ -0,0 +1,79 @@
+import csv
+import io
+import json
+import os
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+
+from django.core.management import call_command
+from django.shortcuts import reverse
+from django.test import TestCase
+from django.utils import timezone
+from leads.exporter import pyarrow
+from leads.models import User, Lead, Agent, Category
+
+
+class LeadExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        organisation = cls.organisor.userprofile
+        agent_user = User.objects.create_user(
+            username="agent", email="agent@test.com", password="password", is_agent=True, is_organisor=False
+        )
+        cls.agent = Agent.objects.create(user=agent_user, organisation=organisation)
+        cls.category = Category.objects.create(name="Contacted", organisation=organisation)
+        for i in range(5):
+            Lead.objects.create(
+                first_name=f"Lead {i}", last_name="Test", organisation=organisation,
+                agent=cls.agent if i % 2 else None, category=cls.category if i < 2 else None,
+                description="", phone_number="555", email=f"lead{i}@test.com",
+            )
+        # a lead of another organisation must never be exported
+        other = User.objects.create_user(username="other", password="password")
+        Lead.objects.create(
+            first_name="Other", last_name="Test", organisation=other.userprofile,
+            description="", phone_number="555", email="other@test.com",
+        )
+
+    def setUp(self):
+        self.client.force_login(self.organisor)
+
+    def export(self, **params):
+        response = self.client.get(reverse("leads:lead-export"), params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def test_csv_export_is_scoped_to_the_organisation(self):
+        rows = list(csv.DictReader(io.StringIO(self.export(format="csv").decode())))
+        self.assertEqual([row["first_name"] for row in rows], [f"Lead {i}" for i in range(5)])
+        self.assertEqual(rows[1]["agent"], "agent@test.com")
+        self.assertEqual(rows[0]["category"], "Contacted")
+
+    def test_ndjson_export_filters(self):
+        content = self.export(format="ndjson", category=self.category.pk, agent=self.agent.pk)
+        rows = [json.loads(line) for line in content.decode().splitlines()]
+        self.assertEqual([row["first_name"] for row in rows], ["Lead 1"])
+
+        tomorrow = (timezone.now() + timedelta(days=1)).date()
+        self.assertEqual(self.export(format="ndjson", date_from=tomorrow.isoformat()), b"")
+
+    def test_form_is_shown_without_format(self):
+        response = self.client.get(reverse("leads:lead-export"))
+        self.assertTemplateUsed(response, "leads/lead_export.html")
+
+    @skipUnless(pyarrow, "pyarrow is not installed")
+    def test_parquet_export(self):
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(io.BytesIO(self.export(format="parquet")))
+        self.assertEqual(table.num_rows, 5)
+        self.assertEqual(table.column("email").to_pylist()[0], "lead0@test.com")
+
+    def test_export_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "leads.ndjson")
+            call_command("export_leads", "--organisation", "organisor", "--format", "ndjson", "--output", path, stdout=StringIO())
+            with open(path) as file:
+                self.assertEqual(len(file.readlines()), 5)
@@ -0,0 +1,82 @@
+import io
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.shortcuts import reverse
+from django.test import TestCase
+from leads.forms import LeadImportForm
+from leads.importer import import_leads
+from leads.models import User, Lead, Agent
+
+CSV = """first_name,last_name,age,agent,description,phone_number,email
+John,Smith,30,agent@test.com,Imported,555 1234,john@test.com
+Jane,Doe,not a number,,Imported,555 9876,jane@test.com
+Jim,Beam,40,,Imported,555 0000,not an email
+Jack,Daniels,50,,Imported,555 1111,jack@test.com
+"""
+
+
+class LeadImportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        agent_user = User.objects.create_user(
+            username="agent", email="agent@test.com", password="password", is_agent=True, is_organisor=False
+        )
+        cls.agent = Agent.objects.create(user=agent_user, organisation=cls.organisor.userprofile)
+
+    def test_csv_rows_are_validated_and_saved_in_batches(self):
+        result = import_leads(io.StringIO(CSV), "csv", self.organisor.userprofile, batch_size=1)
+        self.assertEqual(result.created, 2)
+        self.assertEqual([error["row"] for error in result.errors], [3, 4])
+        self.assertIn("age", result.errors[0]["errors"])
+        self.assertIn("email", result.errors[1]["errors"])
+        self.assertEqual(Lead.objects.get(first_name="John").agent, self.agent)
+
+        # bulk_create doesn't send signals, the importer keeps the counters up to date itself
+        self.agent.refresh_from_db()
+        self.organisor.userprofile.refresh_from_db()
+        self.assertEqual(self.agent.lead_count, 1)
+        self.assertEqual(self.organisor.userprofile.uncategorised_lead_count, 2)
+
+    def test_agent_of_another_organisation_is_rejected(self):
+        other = User.objects.create_user(username="other", password="password")
+        other_agent_user = User.objects.create_user(username="other-agent", password="password", is_agent=True)
+        other_agent = Agent.objects.create(user=other_agent_user, organisation=other.userprofile)
+        row = {
+            "first_name": "John", "last_name": "Smith", "age": 30, "agent": other_agent.pk,
+            "description": "Imported", "phone_number": "555", "email": "john@test.com",
+        }
+        result = import_leads(io.StringIO(json.dumps(row) + "\n{broken\n"), "ndjson", self.organisor.userprofile)
+        self.assertEqual(result.created, 0)
+        self.assertEqual([error["row"] for error in result.errors], [1, 2])
+        self.assertIn("agent", result.errors[0]["errors"])
+
+    def test_form_keeps_its_agent_field(self):
+        # the agent of a row is an id or an email looked up in the organisation's agents, not a ModelChoiceField
+        form = LeadImportForm(data={}, agents={})
+        self.assertFalse(hasattr(form.fields["agent"], "queryset"))
+
+    def test_import_view(self):
+        self.client.force_login(self.organisor)
+        response = self.client.post(reverse("leads:lead-import"), {
+            "file": SimpleUploadedFile("leads.csv", CSV.encode()), "format": "csv",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["result"].created, 2)
+        self.assertEqual(Lead.objects.filter(organisation=self.organisor.userprofile).count(), 2)
+
+    def test_import_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "leads.csv")
+            errors = os.path.join(directory, "errors.ndjson")
+            with open(path, "w") as file:
+                file.write(CSV)
+            call_command("import_leads", path, "--organisation", "organisor", "--errors", errors, stdout=StringIO())
+            with open(errors) as file:
+                self.assertEqual(len(file.readlines()), 2)
+        self.assertEqual(Lead.objects.count(), 2)
@@ -0,0 +1,91 @@
+import socket
+from io import StringIO
+from unittest import skipUnless
+
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+from leads.models import User, OutboxEmail
+from leads.outbox import queue_email, send_queued_emails
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError("SMTP server unavailable")
+
+
+class OutboxTest(TestCase):
+    def test_lead_create_queues_email_instead_of_sending(self):
+        organisor = User.objects.create_user(username="organisor", password="password")
+        self.client.force_login(organisor)
+        self.client.post(reverse("leads:lead-create"), {
+            "first_name": "Lead", "last_name": "Test", "age": 30, "description": "New lead",
+            "phone_number": "123", "email": "lead@test.com",
+        })
+        self.assertEqual(len(mail.outbox), 0) # nothing is sent during the request
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.PENDING).count(), 1)
+
+        call_command("run_outbox", "--once", stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(OutboxEmail.objects.get().status, OutboxEmail.SENT)
+
+    def test_batches_share_one_connection(self):
+        for i in range(5):
+            queue_email("Subject", "Message", "admin@test.com", [f"agent{i}@test.com"])
+        self.assertEqual(send_queued_emails(batch_size=3), 3)
+        self.assertEqual(send_queued_emails(batch_size=3), 2)
+        self.assertEqual(send_queued_emails(batch_size=3), 0)
+        self.assertEqual(len(mail.outbox), 5)
+
+    @override_settings(EMAIL_BACKEND="leads.tests.test_outbox.FailingEmailBackend", OUTBOX_MAX_ATTEMPTS=2)
+    def test_failed_email_is_retried_then_dead(self):
+        email = queue_email("Subject", "Message", "admin@test.com", ["agent@test.com"])
+        send_queued_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.PENDING)
+        self.assertEqual(email.attempts, 1)
+        self.assertIn("SMTP server unavailable", email.last_error)
+        self.assertEqual(send_queued_emails(), 0) # not due again before the backoff delay
+
+        OutboxEmail.objects.update(next_attempt_at=email.created_at)
+        send_queued_emails()
+        email.refresh_from_db()
+        self.assertEqual(email.status, OutboxEmail.DEAD)
+
+
+@skipUnless(Controller, "aiosmtpd is not installed")
+class OutboxSMTPTest(TestCase):
+    # aiosmtpd runs a real SMTP server on localhost, so this goes through Django's SMTP backend end to end
+    def setUp(self):
+        self.received = []
+        received = self.received
+
+        class Handler:
+            async def handle_DATA(self, server, session, envelope):
+                received.append(envelope)
+                return "250 Message accepted for delivery"
+
+        # find a free port for the SMTP server
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.controller = Controller(Handler(), hostname="127.0.0.1", port=self.port)
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+
+    def test_worker_sends_over_smtp(self):
+        for i in range(3):
+            queue_email("Subject", "Message", "admin@test.com", [f"agent{i}@test.com"])
+        with override_settings(
+            EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend", EMAIL_HOST="127.0.0.1", EMAIL_PORT=self.port,
+        ):
+            send_queued_emails()
+        self.assertEqual(len(self.received), 3)
+        self.assertFalse(OutboxEmail.objects.exclude(status=OutboxEmail.SENT).exists())
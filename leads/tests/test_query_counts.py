@@ -0,0 +1,97 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from leads.benchmark import get_benchmark_urls
+from leads.models import Agent
+from leads.seed import Seeder
+
+# Query budget of every page of the leads and agents apps: the status one GET must answer and the queries it runs,
+# as an organisor and as an agent. The pages of the organisors redirect an agent (302), after the same 2 queries
+# (session and user), the change feed refuses them (403) and the bulk actions are POST only (405).
+# The number must not depend on how many leads, agents or categories the organisation has (no N+1 in views or templates).
+# Every budget is the measured count: lower it when a page gets cheaper. A new page needs a budget, QueryCountTest fails
+# until it has one.
+ORGANISOR_ONLY = (302, 2)
+QUERY_BUDGETS = {
+    # the agent and category choices of the bulk action form are queried on the first visit, then cached
+    "leads:lead-list": {"organisor": (200, 6), "agent": (200, 3)},
+    "leads:lead-list?q=smith": {"organisor": (200, 4), "agent": (200, 3)},
+    "leads:lead-detail": {"organisor": (200, 3), "agent": (200, 3)},
+    "leads:lead-update": {"organisor": (200, 3), "agent": ORGANISOR_ONLY},
+    "leads:lead-delete": {"organisor": (200, 3), "agent": ORGANISOR_ONLY},
+    "leads:assign-agent": {"organisor": (200, 3), "agent": ORGANISOR_ONLY},
+    "leads:lead-create": {"organisor": (200, 2), "agent": ORGANISOR_ONLY},
+    "leads:lead-import": {"organisor": (200, 2), "agent": ORGANISOR_ONLY},
+    "leads:lead-export": {"organisor": (200, 2), "agent": ORGANISOR_ONLY},
+    "leads:lead-auto-assign": {"organisor": (200, 2), "agent": ORGANISOR_ONLY},
+    "leads:lead-bulk-action": {"organisor": (405, 2), "agent": ORGANISOR_ONLY},
+    "leads:category_list": {"organisor": (200, 3), "agent": (200, 3)},
+    "leads:category_detail": {"organisor": (200, 4), "agent": (200, 4)},
+    "leads:lead-category-update": {"organisor": (200, 3), "agent": (200, 4)},
+    "agents:agent-list": {"organisor": (200, 3), "agent": ORGANISOR_ONLY},
+    "agents:agent-detail": {"organisor": (200, 3), "agent": ORGANISOR_ONLY},
+    "agents:agent-update": {"organisor": (200, 4), "agent": ORGANISOR_ONLY},
+    "agents:agent-delete": {"organisor": (200, 3), "agent": ORGANISOR_ONLY},
+    "agents:agent-create": {"organisor": (200, 2), "agent": ORGANISOR_ONLY},
+    "api:lead-list": {"organisor": (200, 3), "agent": (200, 3)},
+    "api:lead-detail": {"organisor": (200, 3), "agent": (200, 3)},
+    "api:lead-changes": {"organisor": (200, 4), "agent": (403, 2)},
+    "api:agent-list": {"organisor": (200, 3), "agent": (200, 3)},
+    "api:agent-detail": {"organisor": (200, 3), "agent": (200, 3)},
+    "api:category-list": {"organisor": (200, 3), "agent": (200, 3)},
+    "api:category-detail": {"organisor": (200, 3), "agent": (200, 3)},
+}
+
+# every page is rendered for an organisation of each size, leads, agents and categories alike
+SIZES = (10, 1000)
+
+
+class QueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisations = {
+            size: Seeder(organisations=1, agents=size, categories=size, leads=size, prefix=f"size{size}").run()[0]
+            for size in SIZES
+        }
+
+    def setUp(self):
+        # the counts of a page must not depend on what the tests before it left in the cache
+        cache.clear()
+
+    def get_query_counts(self, user):
+        self.client.force_login(user)
+        counts = {}
+        for name, path, params in get_benchmark_urls(user):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path, params)
+            counts[name] = (response.status_code, len(queries))
+        return counts
+
+    def check_query_counts(self, role, users):
+        counts = {size: self.get_query_counts(user) for size, user in users.items()}
+        small, large = counts[SIZES[0]], counts[SIZES[-1]]
+        table = "\n".join(
+            f"{name:30} budget {'HTTP %s, %s' % QUERY_BUDGETS[name][role] if name in QUERY_BUDGETS else '-':>12} | "
+            + " | ".join(f"{size} rows: HTTP {counts[size][name][0]}, {counts[size][name][1]:>3} queries" for size in SIZES)
+            for name in large
+        )
+        self.assertEqual(set(small), set(large))
+        for name in large:
+            with self.subTest(page=name):
+                self.assertIn(name, QUERY_BUDGETS, f"{name} has no query budget\n{table}")
+                status, budget = QUERY_BUDGETS[name][role]
+                for size in SIZES:
+                    self.assertEqual(counts[size][name][0], status, f"{name} answers an unexpected status\n{table}")
+                self.assertEqual(small[name][1], large[name][1], f"{name} runs more queries for more rows\n{table}")
+                self.assertLessEqual(large[name][1], budget, f"{name} is over its query budget\n{table}")
+
+    def test_organisor(self):
+        self.check_query_counts("organisor", {size: organisation.user for size, organisation in self.organisations.items()})
+
+    def test_agent(self):
+        # the first agent of a seeded organisation has the most leads
+        self.check_query_counts("agent", {
+            size: Agent.objects.filter(organisation=organisation).order_by("id").first().user
+            for size, organisation in self.organisations.items()
+        })
@@ -0,0 +1,144 @@
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connections
+from django.shortcuts import reverse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from leads import replicas
+from leads.models import User, Lead
+from leads.replicas import PIN_COOKIE, ReplicaRouter, RequestWrites, read_from_replica, request_writes
+from leads.views import LeadListView
+
+
+@override_settings(DATABASE_REPLICAS=["replica1", "replica2"], REPLICA_MAX_LAG=30)
+class ReplicaRouterTest(SimpleTestCase):
+    # only the aliases the router returns, no query runs: queryset.db asks the router
+    def setUp(self):
+        self.lags = {"replica1": 0.5, "replica2": None}
+        patcher = mock.patch.object(replicas, "get_replica_lag", lambda alias: self.lags[alias])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_only_reads_inside_the_block(self):
+        self.assertEqual(Lead.objects.all().db, "default")
+        with read_from_replica():
+            self.assertIn(Lead.objects.all().db, ["replica1", "replica2"])
+            self.assertEqual(ReplicaRouter().db_for_write(Lead), "default")
+            with read_from_replica(enabled=False):
+                self.assertEqual(Lead.objects.all().db, "default")
+        with override_settings(DATABASE_REPLICAS=[]), read_from_replica():
+            self.assertEqual(Lead.objects.all().db, "default")
+
+    def test_one_replica_per_block(self):
+        with read_from_replica():
+            self.assertEqual(len({Lead.objects.all().db for _ in range(20)}), 1)
+
+    def test_lagging_replicas_are_skipped(self):
+        self.lags["replica2"] = 60
+        with read_from_replica():
+            self.assertEqual(Lead.objects.all().db, "replica1")
+        self.lags["replica1"] = float("inf") # unreachable
+        with read_from_replica():
+            self.assertEqual(Lead.objects.all().db, "default")
+
+    def test_reads_after_a_write_of_the_request(self):
+        token = request_writes.set(RequestWrites())
+        self.addCleanup(request_writes.reset, token)
+        with read_from_replica():
+            self.assertNotEqual(Lead.objects.all().db, "default")
+            ReplicaRouter().db_for_write(Lead)
+            self.assertEqual(Lead.objects.all().db, "default")
+
+    def test_no_migrations_on_replicas(self):
+        router = ReplicaRouter()
+        self.assertTrue(router.allow_migrate("default", "leads"))
+        self.assertFalse(router.allow_migrate("replica1", "leads"))
+
+
+class ReplicaLagTest(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(replicas.lags, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_measured_once_per_interval(self):
+        with mock.patch.object(replicas, "measure_replica_lag", return_value=2.0) as measure:
+            self.assertEqual(replicas.get_replica_lag("default", max_age=60), 2.0)
+            self.assertEqual(replicas.get_replica_lag("default", max_age=60), 2.0)
+            self.assertEqual(measure.call_count, 1)
+            replicas.get_replica_lag("default", max_age=0)
+            self.assertEqual(measure.call_count, 2)
+
+    def test_unreachable(self):
+        error = connections["default"].Database.OperationalError("connection refused")
+        with mock.patch.object(replicas, "measure_replica_lag", side_effect=error), self.assertLogs("leads.replicas", "WARNING"):
+            self.assertEqual(replicas.get_replica_lag("default", max_age=0), float("inf"))
+
+    def test_command(self):
+        output = StringIO()
+        with override_settings(DATABASE_REPLICAS=["replica1", "replica2"]), \
+                mock.patch.object(replicas, "measure_replica_lag", side_effect=[1.5, None]):
+            call_command("replica_lag", stdout=output)
+        self.assertEqual(output.getvalue(), "replica1: 1.5s\nreplica2: unknown (the database can't tell)\n")
+
+
+@override_settings(DATABASE_REPLICAS=["replica1"])
+class StickyPrimaryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+
+    def setUp(self):
+        self.client.force_login(self.organisor)
+
+    def test_a_write_pins_the_client(self):
+        response = self.client.get(reverse("leads:lead-list"))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+        response = self.client.post(reverse("leads:lead-create"), {
+            "first_name": "John", "last_name": "Smith", "age": 30, "description": "New lead",
+            "phone_number": "555 0100", "email": "john@example.com",
+        })
+        self.assertEqual(response.status_code, 302)
+        cookie = response.cookies[PIN_COOKIE]
+        self.assertEqual(cookie["max-age"], settings.REPLICA_STICKY_SECONDS)
+
+    def test_pinned_client_reads_from_the_default_database(self):
+        request = RequestFactory().get(reverse("leads:lead-list"))
+        view = LeadListView()
+        view.setup(request)
+        with view.read_from_replica():
+            self.assertIsNotNone(replicas.replica_reads.get())
+        request.COOKIES[PIN_COOKIE] = "9999999999"
+        with view.read_from_replica():
+            self.assertIsNone(replicas.replica_reads.get())
+
+
+# DATABASE_REPLICA_URLS=sqlite:////tmp/replica.sqlite3 => replica1, a test mirror of the default database
+@skipUnless(settings.DATABASE_REPLICAS, "no replica configured")
+class ReplicaReadsTest(TransactionTestCase):
+    # outside a transaction, the reads of the default database's transaction never go to a replica
+    databases = "__all__"
+
+    def test_pages_read_from_the_replica(self):
+        organisor = User.objects.create_user(username="organisor", password="password")
+        lead = Lead.objects.create(first_name="John", last_name="Smith", age=30, organisation=organisor.userprofile)
+        self.client.force_login(organisor)
+        replica = connections[settings.DATABASE_REPLICAS[0]]
+        with mock.patch.object(replicas, "get_replica_lag", return_value=None):
+            for url in (reverse("leads:lead-list"), reverse("leads:lead-detail", args=[lead.pk])):
+                with self.subTest(url=url), CaptureQueriesContext(replica) as queries:
+                    self.assertContains(self.client.get(url), "John")
+                self.assertTrue(queries.captured_queries)
+
+            response = self.client.post(reverse("leads:lead-update", args=[lead.pk]), {
+                "first_name": "Johnny", "last_name": "Smith", "age": 30, "description": "Updated",
+                "phone_number": "555 0100", "email": "john@example.com",
+            })
+            self.assertEqual(response.status_code, 302)
+            with CaptureQueriesContext(replica) as queries:
+                self.assertContains(self.client.get(reverse("leads:lead-list")), "Johnny")
+            self.assertFalse(queries.captured_queries) # pinned after the write
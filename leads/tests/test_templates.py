@@ -0,0 +1,62 @@
+import re
+from io import StringIO
+
+from django.conf import settings
+from django.core.management import call_command
+from django.shortcuts import reverse
+from django.template import engines
+from django.template.backends.jinja2 import Jinja2
+from django.template.loader import get_template
+from django.test import SimpleTestCase, TestCase, override_settings
+from djcrm import settings_production
+from leads.models import Category
+from leads.seed import Seeder
+
+
+@override_settings(TEMPLATES=settings_production.TEMPLATES)
+class WarmTemplatesTest(SimpleTestCase):
+    def test_templates_are_compiled_into_the_cached_loader(self):
+        stdout = StringIO()
+        call_command("warm_templates", stdout=stdout)
+        self.assertIn("Compiled", stdout.getvalue())
+        self.assertNotIn("not enabled", stdout.getvalue())
+        loader = engines["django"].engine.template_loaders[0]
+        for name in ("base.html", "navbar.html", "leads/lead_list.html", "agents/agent_list.html", "tailwind/field.html"):
+            self.assertIn(name, loader.get_template_cache)
+
+    def test_production_profile(self):
+        options = settings_production.DJANGO_TEMPLATES["OPTIONS"]
+        self.assertEqual(options["loaders"][0][0], "django.template.loaders.cached.Loader")
+        self.assertFalse(options["debug"])
+
+
+def strip_csrf_tokens(content):
+    # the CSRF token is masked differently every time it's rendered
+    return re.sub(r'name="csrfmiddlewaretoken" value="[^"]*"', 'name="csrfmiddlewaretoken"', content.decode())
+
+
+@override_settings(TEMPLATES=[settings.JINJA2_BACKEND, *settings.TEMPLATES])
+class Jinja2TemplatesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisation = Seeder(organisations=1, agents=3, categories=2, leads=40, prefix="jinja").run()[0]
+
+    def test_same_output_as_django_templates(self):
+        self.client.force_login(self.organisation.user)
+        category = Category.objects.filter(organisation=self.organisation).first()
+        for url in (reverse("leads:lead-list"), reverse("leads:category_detail", args=[category.pk]), reverse("agents:agent-list")):
+            with self.subTest(url=url):
+                jinja2_response = self.client.get(url)
+                with override_settings(TEMPLATES=settings.TEMPLATES[1:]):
+                    django_response = self.client.get(url)
+                self.assertEqual(strip_csrf_tokens(jinja2_response.content), strip_csrf_tokens(django_response.content))
+                self.assertIn("</table>", jinja2_response.content.decode())
+
+    def test_ports_are_rendered_by_jinja2(self):
+        self.assertIsInstance(get_template("leads/lead_list.html").backend, Jinja2)
+        self.assertNotIsInstance(get_template("leads/lead_detail.html").backend, Jinja2)
+
+    def test_benchmark_command(self):
+        stdout = StringIO()
+        call_command("benchmark_templates", "--rows", "10", "--repeat", "1", stdout=stdout)
+        self.assertIn("agents/agent_list.html", stdout.getvalue())
@@ -1,5 +1,11 @@
-from django.test import TestCase
+import json
+from django.test import TestCase, override_settings
+from io import StringIO
+from django.core.management import call_command, CommandError
 from django.shortcuts import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from leads.models import User, Lead, Agent, Category, UserProfile, OutboxEmail
 # Create your tests here.
 
 # LandingPageTest is to test Landing Page
@@ -14,3 +20,333 @@ class LandingPageTest(TestCase):
         # type 'py manage.py test' to run test
 
         
+
+
+class LeadListViewTest(TestCase):
+    # setUpTestData runs once for the whole class instead of once per test method
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        agent_user = User.objects.create_user(username="agent", password="password", is_agent=True, is_organisor=False)
+        cls.agent = Agent.objects.create(user=agent_user, organisation=cls.organisor.userprofile)
+        cls.category = Category.objects.create(name="Contacted", organisation=cls.organisor.userprofile)
+        Lead.objects.bulk_create([
+            Lead(
+                first_name=f"Lead {i}", last_name="Test", organisation=cls.organisor.userprofile,
+                agent=cls.agent, category=cls.category, description="", phone_number="", email=f"lead{i}@test.com",
+            )
+            for i in range(120)
+        ])
+
+    def setUp(self):
+        self.client.force_login(self.organisor)
+
+    def test_pages_cover_every_lead_once(self):
+        seen = []
+        url = reverse("leads:lead-list")
+        response = self.client.get(url)
+        while True:
+            seen.extend(lead.pk for lead in response.context["leads"])
+            if not response.context["page_obj"].has_next():
+                break
+            response = self.client.get(url, {"cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(len(seen), 120)
+        self.assertEqual(len(set(seen)), 120)
+
+    def test_query_count_is_constant_across_pages(self):
+        url = reverse("leads:lead-list")
+        with CaptureQueriesContext(connection) as first_page:
+            response = self.client.get(url)
+        cursor = response.context["page_obj"].next_cursor
+        response = self.client.get(url, {"cursor": cursor})
+        with CaptureQueriesContext(connection) as deep_page:
+            self.client.get(url, {"cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(len(first_page), len(deep_page))
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse("leads:lead-list"), {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_unassigned_leads_are_paginated_too(self):
+        Lead.objects.filter(pk__in=Lead.objects.order_by("id").values("id")[:70]).update(agent=None)
+        seen = []
+        url = reverse("leads:lead-list")
+        response = self.client.get(url)
+        while True:
+            page = response.context["unassigned_page"]
+            self.assertLessEqual(len(response.context["unassigned_leads"]), 50)
+            seen.extend(lead.pk for lead in page)
+            if not page.has_next():
+                break
+            self.assertContains(response, f"unassigned_cursor={page.next_cursor}")
+            response = self.client.get(url, {"unassigned_cursor": page.next_cursor})
+        self.assertEqual(len(set(seen)), 70)
+        self.assertEqual(len(seen), 70)
+
+
+class CategoryListViewTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # a second organisation makes sure the category ids are not 1 and 2 for the organisation under test
+        other = User.objects.create_user(username="other", password="password")
+        Category.objects.create(name="Contacted", organisation=other.userprofile)
+        Category.objects.create(name="Converted", organisation=other.userprofile)
+
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        organisation = cls.organisor.userprofile
+        cls.contacted = Category.objects.create(name="Contacted", organisation=organisation)
+        cls.converted = Category.objects.create(name="Converted", organisation=organisation)
+        cls.follow_up = Category.objects.create(name="Follow up", organisation=organisation)
+        for category, count in ((cls.contacted, 3), (cls.converted, 1), (None, 2)):
+            for i in range(count):
+                Lead.objects.create(
+                    first_name="Lead", last_name=str(i), organisation=organisation, category=category,
+                    description="", phone_number="", email="lead@test.com",
+                )
+
+    def test_lead_count_per_category(self):
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse("leads:category_list"))
+        counts = {category.name: category.lead_count for category in response.context["category_list"]}
+        self.assertEqual(counts, {"Contacted": 3, "Converted": 1, "Follow up": 0})
+        self.assertEqual(response.context["unassigned_lead_count"], 2)
+
+
+class LeadCounterTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        organisation = cls.organisor.userprofile
+        agent_user = User.objects.create_user(username="agent", password="password", is_agent=True, is_organisor=False)
+        cls.agent = Agent.objects.create(user=agent_user, organisation=organisation)
+        cls.category = Category.objects.create(name="Contacted", organisation=organisation)
+
+    def setUp(self):
+        self.client.force_login(self.organisor)
+
+    def assertCounters(self, category, agent, uncategorised):
+        self.category.refresh_from_db()
+        self.agent.refresh_from_db()
+        self.assertEqual(self.category.lead_count, category)
+        self.assertEqual(self.agent.lead_count, agent)
+        self.assertEqual(UserProfile.objects.get(pk=self.organisor.userprofile.pk).uncategorised_lead_count, uncategorised)
+
+    def test_counters_follow_the_lead_views(self):
+        self.client.post(reverse("leads:lead-create"), {
+            "first_name": "Lead", "last_name": "Test", "age": 30, "description": "New lead",
+            "phone_number": "123", "email": "lead@test.com",
+        })
+        lead = Lead.objects.get()
+        self.assertCounters(category=0, agent=0, uncategorised=1)
+
+        self.client.post(reverse("leads:assign-agent", args=[lead.pk]), {"agent": self.agent.pk})
+        self.assertCounters(category=0, agent=1, uncategorised=1)
+
+        self.client.post(reverse("leads:lead-category-update", args=[lead.pk]), {"category": self.category.pk})
+        self.assertCounters(category=1, agent=1, uncategorised=0)
+
+        self.client.post(reverse("leads:lead-delete", args=[lead.pk]))
+        self.assertCounters(category=0, agent=0, uncategorised=0)
+
+    def test_rebuild_command_fixes_drifted_counters(self):
+        Lead.objects.create(
+            first_name="Lead", last_name="Test", organisation=self.organisor.userprofile, agent=self.agent,
+            category=self.category, description="", phone_number="", email="lead@test.com",
+        )
+        Category.objects.filter(pk=self.category.pk).update(lead_count=7) # simulate a counter that drifted
+        with self.assertRaises(CommandError):
+            call_command("rebuild_lead_counters", "--verify", stdout=StringIO())
+        call_command("rebuild_lead_counters", stdout=StringIO())
+        call_command("rebuild_lead_counters", "--verify", stdout=StringIO())
+        self.assertCounters(category=1, agent=1, uncategorised=0)
+
+
+class LeadSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        agent_user = User.objects.create_user(username="agent", password="password", is_agent=True, is_organisor=False)
+        agent = Agent.objects.create(user=agent_user, organisation=cls.organisor.userprofile)
+        cls.john = Lead.objects.create(
+            first_name="John", last_name="Smith", organisation=cls.organisor.userprofile, agent=agent,
+            description="Wants a quote", phone_number="555 1234", email="john@example.com",
+        )
+        cls.jane = Lead.objects.create(
+            first_name="Jane", last_name="Doe", organisation=cls.organisor.userprofile, agent=agent,
+            description="Called back", phone_number="555 9876", email="jane@example.com",
+        )
+
+    def search(self, query):
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse("leads:lead-list"), {"q": query})
+        return {lead.pk for lead in response.context["leads"]}
+
+    def test_search_by_name_prefix_phone_and_description(self):
+        self.assertEqual(self.search("john"), {self.john.pk})
+        self.assertEqual(self.search("smi"), {self.john.pk})
+        self.assertEqual(self.search("9876"), {self.jane.pk})
+        self.assertEqual(self.search("quote"), {self.john.pk})
+        self.assertEqual(self.search("555"), {self.john.pk, self.jane.pk})
+        self.assertEqual(self.search('"john*'), {self.john.pk}) # search syntax in the query is ignored
+
+    def test_index_follows_updates_and_deletes(self):
+        Lead.objects.filter(pk=self.jane.pk).update(last_name="Johnson")
+        self.assertEqual(self.search("johnson"), {self.jane.pk})
+        self.john.delete()
+        self.assertEqual(self.search("john"), {self.jane.pk})
+
+
+class LeadIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        organisation = cls.organisor.userprofile
+        agent_user = User.objects.create_user(username="agent", password="password", is_agent=True, is_organisor=False)
+        agent = Agent.objects.create(user=agent_user, organisation=organisation)
+        cls.category = Category.objects.create(name="Contacted", organisation=organisation)
+        Lead.objects.bulk_create([
+            Lead(
+                first_name=f"Lead {i}", last_name="Test", organisation=organisation, agent=agent if i % 2 else None,
+                category=cls.category if i % 3 else None, description="", phone_number="", email="lead@test.com",
+            )
+            for i in range(100)
+        ])
+
+    def get_lead_query_plans(self, url):
+        self.client.force_login(self.organisor)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        plans = []
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off") # the test tables are too small for the planner to bother with indexes
+            for query in queries:
+                if query["sql"].startswith("SELECT") and 'FROM "leads_lead"' in query["sql"]:
+                    prefix = "EXPLAIN QUERY PLAN " if connection.vendor == "sqlite" else "EXPLAIN "
+                    cursor.execute(prefix + query["sql"])
+                    plans.append(" ".join(str(column) for row in cursor.fetchall() for column in row))
+        return plans
+
+    def assertPlanUses(self, plans, index):
+        self.assertTrue(any(index in plan for plan in plans), f"{index} not used by any of {plans}")
+
+    def test_lead_list_uses_the_date_and_unassigned_indexes(self):
+        plans = self.get_lead_query_plans(reverse("leads:lead-list"))
+        self.assertPlanUses(plans, "lead_org_date_added_idx")
+        self.assertPlanUses(plans, "lead_unassigned_idx")
+
+    def test_category_detail_uses_the_category_index(self):
+        plans = self.get_lead_query_plans(reverse("leads:category_detail", args=[self.category.pk]))
+        self.assertPlanUses(plans, "lead_org_category_idx")
+
+
+class TenantMiddlewareTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        cls.agent_user = User.objects.create_user(username="agent", password="password", is_agent=True, is_organisor=False)
+        cls.agent = Agent.objects.create(user=cls.agent_user, organisation=cls.organisor.userprofile)
+
+    def test_agent_tenant_is_loaded_with_the_user(self):
+        self.client.force_login(self.agent_user)
+        response = self.client.get(reverse("leads:category_list"))
+        tenant = response.wsgi_request.tenant
+        self.assertEqual(tenant.agent, self.agent)
+        self.assertEqual(tenant.organisation, self.organisor.userprofile)
+        # the organisation was joined into the query that loaded the user
+        with self.assertNumQueries(0):
+            tenant.organisation.pk
+
+    def test_identity_costs_one_query(self):
+        self.client.force_login(self.agent_user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse("leads:category_list"))
+        identity_queries = [query for query in queries if 'FROM "leads_user"' in query["sql"] or 'FROM "leads_agent"' in query["sql"]]
+        self.assertEqual(len(identity_queries), 1)
+
+    def test_organisor_tenant(self):
+        self.client.force_login(self.organisor)
+        response = self.client.get(reverse("leads:category_list"))
+        self.assertIsNone(response.wsgi_request.tenant.agent)
+        self.assertEqual(response.wsgi_request.tenant.organisation, self.organisor.userprofile)
+
+
+class OrganisationScopedQuerySetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.organisor = User.objects.create_user(username="organisor", password="password")
+        organisation = cls.organisor.userprofile
+        cls.agent_user = User.objects.create_user(username="agent", password="password", is_agent=True, is_organisor=False)
+        cls.agent = Agent.objects.create(user=cls.agent_user, organisation=organisation)
+        other_agent_user = User.objects.create_user(username="agent2", password="password", is_agent=True, is_organisor=False)
+        other_agent = Agent.objects.create(user=other_agent_user, organisation=organisation)
+        cls.own_lead, cls.other_lead = [
+            Lead.objects.create(
+                first_name="Lead", last_name="Test", organisation=organisation, agent=agent,
+                description="", phone_number="", email="lead@test.com",
+            )
+            for agent in (cls.agent, other_agent)
+        ]
+        cls.other_organisor = User.objects.create_user(username="other", password="password")
+
+    def test_lead_rules(self):
+        self.assertEqual(set(Lead.objects.for_user(self.organisor)), {self.own_lead, self.other_lead})
+        self.assertEqual(list(Lead.objects.for_user(self.agent_user)), [self.own_lead])
+        self.assertEqual(list(Lead.objects.for_user(self.other_organisor)), [])
+
+    def test_agents_of_another_organisation_are_not_found(self):
+        self.client.force_login(self.other_organisor)
+        response = self.client.get(reverse("agents:agent-update", args=[self.agent.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(QUERY_INSTRUMENTATION_SAMPLE_RATE=1.0)
+class QueryInstrumentationMiddlewareTest(TestCase):
+    def test_server_timing_header_and_log_line(self):
+        organisor = User.objects.create_user(username="organisor", password="password")
+        Category.objects.create(name="Contacted", organisation=organisor.userprofile)
+        self.client.force_login(organisor)
+        with self.assertLogs("leads.instrumentation", level="INFO") as logs:
+            response = self.client.get(reverse("leads:category_list"))
+        self.assertRegex(response["Server-Timing"], r'db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+')
+        line = json.loads(logs.records[0].getMessage())
+        self.assertEqual(line["url_name"], "leads:category_list")
+        self.assertGreater(line["queries"], 0)
+        self.assertLessEqual(len(line["slowest"]), 3)
+
+    @override_settings(QUERY_INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_off_by_default(self):
+        response = self.client.get(reverse("landing-page"))
+        self.assertNotIn("Server-Timing", response)
+
+
+class MetricsViewTest(TestCase):
+    @override_settings(METRICS_ALLOWED_IPS=["127.0.0.1"]) # the test client's address
+    def test_request_and_outbox_metrics(self):
+        OutboxEmail.objects.create(subject="Hi", message="", from_email="test@test.com", recipient_list=["a@test.com"])
+        self.client.get(reverse("landing-page"))
+        response = self.client.get(reverse("metrics"))
+        content = response.content.decode()
+        self.assertIn('djcrm_request_duration_seconds_count{method="GET",url_name="landing-page"}', content)
+        self.assertIn('djcrm_outbox_emails{status="pending"} 1.0', content)
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), HTTP_AUTHORIZATION="Bearer secret")
+        self.assertEqual(response.status_code, 200)
+
+    def test_closed_to_the_public_without_a_token(self):
+        # not even to 127.0.0.1 (the test client's address): behind a reverse proxy, every request comes from it
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        user = User.objects.create_user(username="user", password="password")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+    @override_settings(METRICS_ALLOWED_IPS=["10.0.0.5"])
+    def test_allowed_ips(self):
+        self.assertEqual(self.client.get(reverse("metrics"), REMOTE_ADDR="10.0.0.5").status_code, 200)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
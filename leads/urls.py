@@ -1,10 +1,19 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     AssignAgentView, LeadListView, LeadDetailView, 
     LeadCreateView, LeadUpdateView, LeadDeleteView,
-    CategoryListView, CategoryDetailView, LeadCategoryUpdateView
+    CategoryListView, CategoryDetailView, LeadCategoryUpdateView,
+    LeadImportView, LeadExportView, LeadAutoAssignView, LeadBulkActionView,
 )
 
+# ASYNC_VIEWS (the ASGI profile) => the read-only pages are served by their async variants, see async_views.py
+if settings.ASYNC_VIEWS:
+    from .async_views import (
+        AsyncLeadListView as LeadListView, AsyncLeadDetailView as LeadDetailView,
+        AsyncCategoryListView as CategoryListView, AsyncCategoryDetailView as CategoryDetailView,
+    )
+
 app_name = "leads"
 
 urlpatterns = [
@@ -14,6 +23,10 @@ urlpatterns = [
     path('<int:pk>/delete/', LeadDeleteView.as_view(), name='lead-delete'),
     path('<int:pk>/assign-agent/', AssignAgentView.as_view(), name='assign-agent'),
     path('create/', LeadCreateView.as_view(), name='lead-create'),
+    path('import/', LeadImportView.as_view(), name='lead-import'),
+    path('export/', LeadExportView.as_view(), name='lead-export'),
+    path('auto-assign/', LeadAutoAssignView.as_view(), name='lead-auto-assign'),
+    path('bulk/', LeadBulkActionView.as_view(), name='lead-bulk-action'),
     path('categories/', CategoryListView.as_view(), name='category_list'),
     path('categories/<int:pk>/', CategoryDetailView.as_view(), name='category_detail'),
     path('<int:pk>/category/', LeadCategoryUpdateView.as_view(), name='lead-category-update'),
@@ -1,15 +1,24 @@
 from django.contrib import messages
-from django.core.mail import send_mail
+from django.db import router, transaction
 from django.db.models import query
 from django.forms.models import ModelForm
-from django.shortcuts import render, redirect, reverse
+from django.shortcuts import render, redirect, reverse, get_object_or_404
 # mixins = additional functions that can be added to a class/method. Normally, a class only pass in 1 argument which is equivalent to 1 function
 from django.contrib.auth.mixins import LoginRequiredMixin 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import urlencode
 from django.views import generic
 from django.views.generic.edit import CreateView
 from .models import Category, Lead, Agent, Category
-from .forms import LeadForm, LeadModelForm, CustomUserCreationForm, AssignAgentForm, LeadCategoryUpdateForm
+from .forms import LeadForm, LeadModelForm, CustomUserCreationForm, AssignAgentForm, LeadCategoryUpdateForm, LeadImportUploadForm, LeadExportForm, LeadAutoAssignForm, LeadBulkActionForm
+from .pagination import KeysetPaginationMixin
+from .replicas import ReplicaReadMixin
+from .outbox import queue_email
+from .search import search_leads
+from .importer import import_leads, open_text
+from .exporter import EXPORT_FORMATS, get_export_rows
+from .assignment import assign_leads
+from .bulk import bulk_assign_agent, bulk_update_category, bulk_delete_leads
 from agents.mixins import OrganisorAndLoginRequiredMixin
 
 
@@ -30,22 +39,24 @@ def landing_page(request):
 
 
 # pass LoginRequiredMixin first to make sure it check if user is login first, then show the ListView later.
-class LeadListView(LoginRequiredMixin, generic.ListView):
+# KeysetPaginationMixin must come before ListView so that its paginate_queryset is used instead of the OFFSET based one
+# ReplicaReadMixin => the page is read from a replica when DATABASE_REPLICAS are configured (see replicas.py)
+class LeadListView(LoginRequiredMixin, ReplicaReadMixin, KeysetPaginationMixin, generic.ListView):
     template_name = "leads/lead_list.html"
     context_object_name = "leads"
+    paginate_by = 50
+    unassigned_cursor_kwarg = "unassigned_cursor"
 
     
     def get_queryset(self):
-        user = self.request.user
-        # initial queryset of leads for the entire organisation
-        if user.is_organisor:
-            # if user is an organisor, show ALL leads that belong to this organisor
-            queryset = Lead.objects.filter(organisation=user.userprofile, agent__isnull=False) # userprofile = test_admin who is an organisor
-        elif user.is_agent:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation, agent__isnull=False) # user.agent.organisation shows ALL the leads that belong to Agent's organisation)
-            # filter for the agent that is logged in
-            queryset = Lead.objects.filter(agent__user=user) # agent__user shows ONLY the leads that are assigned to Agent
-        return queryset
+        # for_user => an organisor sees ALL leads of the organisation, an agent ONLY the leads assigned to them
+        # (see OrganisationScopedQuerySet in models.py). Unassigned leads are listed separately in get_context_data.
+        queryset = Lead.objects.for_user(self.request.user).filter(agent__isnull=False)
+        # ?q= comes from the search box of lead_list.html
+        if self.request.GET.get("q"):
+            queryset = search_leads(queryset, self.request.GET["q"])
+        # for_lead_list joins agent, agent.user and category and only selects the columns shown in the table
+        return queryset.for_lead_list()
 
     # Since we want to add unassigned_leads to lead_list.html, we need to use get_context_data for it.
     # get_context_data helps you add more context besides the one defined in context_object_name (leads).
@@ -55,12 +66,34 @@ class LeadListView(LoginRequiredMixin, generic.ListView):
         context = super(LeadListView, self).get_context_data(**kwargs) # grab any context existing out there
         # only an organisor get to see unassigned leads
         if user.is_organisor:
-            # if user is an organisor, show ALL leads that belong to this organisor
-            queryset = Lead.objects.filter(organisation=user.userprofile, agent__isnull=True) # agent__isnull is used to check if a lead has an agent or not
+            unassigned_page = self.get_unassigned_page()
             context.update({
-                "unassigned_leads": queryset # add unassigned_leads to the context dictionary
+                "unassigned_leads": unassigned_page.object_list, # add unassigned_leads to the context dictionary
+                "unassigned_page": unassigned_page,
+                "bulk_form": self.get_bulk_form(),
             })
+        context.update({
+            "q": self.request.GET.get("q", ""),
+        })
         return context
+
+    def get_unassigned_queryset(self):
+        # if user is an organisor, show ALL leads that belong to this organisor
+        queryset = Lead.objects.for_user(self.request.user).filter(agent__isnull=True).only(
+            "first_name", "last_name", "description", "date_added"
+        ) # agent__isnull is used to check if a lead has an agent or not
+        # newest first (the keyset ordering), read in order from the partial lead_unassigned_idx index (see Lead.Meta)
+        if self.request.GET.get("q"):
+            queryset = search_leads(queryset, self.request.GET["q"])
+        return queryset
+
+    def get_unassigned_page(self):
+        # keyset paginated like the assigned leads, with its own cursor: a page never loads every unassigned lead
+        return self.paginate_queryset(self.get_unassigned_queryset(), self.paginate_by, self.unassigned_cursor_kwarg)[1]
+
+    def get_bulk_form(self):
+        # the lead checkboxes of the page are submitted with this form (see LeadBulkActionView)
+        return LeadBulkActionForm(request=self.request, initial={"q": self.request.GET.get("q", "")})
     
 def lead_list(request):
     leads = Lead.objects.all()
@@ -71,22 +104,14 @@ def lead_list(request):
     return render(request, "leads/lead_list.html", context)
 
 
-class LeadDetailView(LoginRequiredMixin, generic.DetailView):
+class LeadDetailView(LoginRequiredMixin, ReplicaReadMixin, generic.DetailView):
     # template_name, queryset, context_object_name = what a Class Based View requires
     template_name = "leads/lead_detail.html"
     context_object_name = "lead"
 
     def get_queryset(self):
-        user = self.request.user
-        # initial queryset of leads for the entire organisation
-        if user.is_organisor:
-            # if user is an organisor, show ALL leads that belong to this organisor
-            queryset = Lead.objects.filter(organisation=user.userprofile) # userprofile = test_admin who is an organisor
-        elif user.is_agent:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation) # user.agent.organisation shows ALL the leads that belong to Agent's organisation)
-            # filter for the agent that is logged in
-            queryset = Lead.objects.filter(agent__user=user) # agent__user shows ONLY the leads that are assigned to Agent
-        return queryset
+        # an organisor sees ALL leads of the organisation, an agent ONLY the leads assigned to them
+        return Lead.objects.for_user(self.request.user)
 
 
 def lead_detail(request, pk):
@@ -101,16 +126,26 @@ class LeadCreateView(OrganisorAndLoginRequiredMixin, generic.CreateView):
     template_name = "leads/lead_create.html"
     form_class = LeadModelForm
 
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super(LeadCreateView, self).get_form_kwargs(**kwargs)
+        kwargs.update({
+            "request": self.request # LeadModelForm limits the agent dropdown to the organisation's agents
+        })
+        return kwargs
+
     def get_success_url(self):
         return reverse("leads:lead-list")
 
+    # transaction.atomic => the lead and the lead counters it changes (see models.py) are committed together or not at all
+    @transaction.atomic
     def form_valid(self, form):
         lead = form.save(commit=False)
-        lead.organisation = self.request.user.userprofile
+        lead.organisation = self.request.tenant.organisation
         lead.save()
         # This method is called when valid form data has been POSTed.
-        # TODO send email
-        send_mail(
+        # The email is queued in the same transaction as the lead and sent by the run_outbox worker,
+        # so the request doesn't wait for the SMTP server
+        queue_email(
             subject="A lead has been created", 
             message="Go to the website to see the new lead",
             from_email="test@test.com",
@@ -141,16 +176,74 @@ class LeadUpdateView(OrganisorAndLoginRequiredMixin, generic.UpdateView):
     template_name = "leads/lead_update.html"
     form_class = LeadModelForm
 
-    # only organisor can update lead information
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super(LeadUpdateView, self).get_form_kwargs(**kwargs)
+        kwargs.update({
+            "request": self.request # LeadModelForm limits the agent dropdown to the organisation's agents
+        })
+        return kwargs
+
+    # only organisor can update lead information (OrganisorAndLoginRequiredMixin)
     def get_queryset(self):
-        user = self.request.user
-        return Lead.objects.filter(organisation=user.userprofile) # userprofile = test_admin who is an organisor
+        return Lead.objects.for_user(self.request.user)
 
+    @transaction.atomic # changing the agent of a lead also moves the agent lead counters
+    def form_valid(self, form):
+        return super(LeadUpdateView, self).form_valid(form)
 
     def get_success_url(self):
         return reverse("leads:lead-list")
 
 
+class LeadImportView(OrganisorAndLoginRequiredMixin, generic.FormView):
+    template_name = "leads/lead_import.html"
+    form_class = LeadImportUploadForm
+
+    def form_valid(self, form):
+        # the uploaded file is read line by line and the leads are saved in batches (see importer.py)
+        result = import_leads(
+            open_text(form.cleaned_data["file"].file), form.cleaned_data["format"], self.request.tenant.organisation
+        )
+        # render the same page again with the per-row error report instead of redirecting
+        return self.render_to_response(self.get_context_data(form=form, result=result))
+
+
+class LeadExportView(OrganisorAndLoginRequiredMixin, ReplicaReadMixin, generic.FormView):
+    template_name = "leads/lead_export.html"
+    form_class = LeadExportForm
+
+    def get_form_kwargs(self):
+        kwargs = super(LeadExportView, self).get_form_kwargs()
+        kwargs.update({
+            "organisation": self.request.tenant.organisation,
+            "formats": EXPORT_FORMATS,
+        })
+        # the export form is submitted with GET, so the export URL can be bookmarked or used with curl
+        if "format" in self.request.GET:
+            kwargs.update({"data": self.request.GET})
+        return kwargs
+
+    def get(self, request, *args, **kwargs):
+        form = self.get_form()
+        if form.is_bound and form.is_valid():
+            return self.form_valid(form)
+        return self.render_to_response(self.get_context_data(form=form))
+
+    def form_valid(self, form):
+        data = form.cleaned_data
+        rows = get_export_rows(
+            self.request.tenant.organisation,
+            category=data["category"], agent=data["agent"], date_from=data["date_from"], date_to=data["date_to"],
+            # the rows are read while the response streams, after dispatch: the database is picked now
+            using=router.db_for_read(Lead),
+        )
+        write, content_type, extension = EXPORT_FORMATS[data["format"]]
+        # StreamingHttpResponse sends every chunk as soon as it's produced instead of building the whole file in memory
+        response = StreamingHttpResponse(write(rows), content_type=content_type)
+        response["Content-Disposition"] = f'attachment; filename="leads.{extension}"'
+        return response
+
+
 def lead_update(request, pk):
     lead = Lead.objects.get(id=pk) #updating is specific to one lead, so primary key (pk) is needed.
     form = LeadModelForm(instance=lead) #input instance to let django know we are updating a specific instance instead of creating a new one.
@@ -173,10 +266,14 @@ class LeadDeleteView(OrganisorAndLoginRequiredMixin, generic.DeleteView):
     def get_success_url(self):
         return reverse("leads:lead-list")
 
-    # only organisor can delete lead
+    # only organisor can delete lead (OrganisorAndLoginRequiredMixin)
     def get_queryset(self):
-        user = self.request.user
-        return Lead.objects.filter(organisation=user.userprofile) # userprofile = test_admin who is an organisor
+        return Lead.objects.for_user(self.request.user)
+
+    # the lead and the lead counters it decrements are deleted in the same transaction
+    @transaction.atomic
+    def delete(self, request, *args, **kwargs):
+        return super(LeadDeleteView, self).delete(request, *args, **kwargs)
 
 
 def lead_delete(request, pk):
@@ -198,88 +295,156 @@ class AssignAgentView(OrganisorAndLoginRequiredMixin, generic.FormView):
 
     def get_success_url(self):
         return reverse("leads:lead-list")
+
+    def get_lead(self):
+        # grab primary key from the URL to get the right lead, only among the leads of the organisation (404 otherwise)
+        return get_object_or_404(Lead.objects.for_user(self.request.user), pk=self.kwargs["pk"])
+
+    def get_context_data(self, **kwargs):
+        context = super(AssignAgentView, self).get_context_data(**kwargs)
+        context.update({
+            "lead": self.get_lead()
+        })
+        return context
     
+    @transaction.atomic # the lead and the agent lead counters are committed together
     def form_valid(self, form):
         agent = form.cleaned_data["agent"] # specify the agent. clean_data normalizes the data into a consistent format. Whatever you input will be formatted in the same way.
-        lead = Lead.objects.get(id=self.kwargs["pk"]) # grab primary key from the URL to get the right lead
+        lead = self.get_lead()
         lead.agent = agent # assign lead to the specified agent
         lead.save() # save everything into the database
         return super(AssignAgentView, self).form_valid(form) # call form_valid method from the FormView -> BaseFormView -> FormMixins class to return get_success_url()
 
 
-class CategoryListView(LoginRequiredMixin, generic.ListView):
+class LeadAutoAssignView(OrganisorAndLoginRequiredMixin, generic.FormView):
+    template_name = "leads/lead_auto_assign.html"
+    form_class = LeadAutoAssignForm
+
+    def get_success_url(self):
+        return reverse("leads:lead-list")
+
+    def form_valid(self, form):
+        # all unassigned leads of the organisation are assigned in one transaction, see assignment.py
+        counts = assign_leads(
+            self.request.tenant.organisation, form.cleaned_data["strategy"], limit=form.cleaned_data["limit"]
+        )
+        messages.success(self.request, f"{sum(counts.values())} leads were assigned to {len(counts)} agents")
+        return super(LeadAutoAssignView, self).form_valid(form)
+
+
+class LeadBulkActionView(OrganisorAndLoginRequiredMixin, generic.FormView):
+    # the bulk action form of the lead list posts here, there is no page to GET
+    http_method_names = ["post"]
+    form_class = LeadBulkActionForm
+
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super(LeadBulkActionView, self).get_form_kwargs(**kwargs)
+        kwargs.update({
+            "request": self.request
+        })
+        return kwargs
+
+    def get_success_url(self):
+        q = self.request.POST.get("q")
+        return reverse("leads:lead-list") + (f"?{urlencode({'q': q})}" if q else "")
+
+    def form_valid(self, form):
+        data = form.cleaned_data
+        organisation = self.request.tenant.organisation
+        queryset = Lead.objects.for_organisation(organisation)
+        if data["select_all"]:
+            # every lead of the organisation matching the search, assigned or not, like the two parts of the lead list
+            if data["q"]:
+                queryset = search_leads(queryset, data["q"])
+        else:
+            queryset = queryset.filter(pk__in=data["leads"])
+
+        # one UPDATE/DELETE for all the leads instead of one request per lead, see bulk.py
+        if data["action"] == "assign":
+            count = bulk_assign_agent(organisation, queryset, data["agent"])
+            messages.success(self.request, f"{count} leads were assigned to {data['agent']}")
+        elif data["action"] == "categorize":
+            count = bulk_update_category(organisation, queryset, data["category"])
+            messages.success(self.request, f"{count} leads were moved to {data['category'] or 'no category'}")
+        else:
+            count = bulk_delete_leads(organisation, queryset)
+            messages.success(self.request, f"{count} leads were deleted")
+        return super(LeadBulkActionView, self).form_valid(form)
+
+    def form_invalid(self, form):
+        # back to the lead list with the errors, it's where the form is
+        for errors in form.errors.values():
+            for error in errors:
+                messages.error(self.request, error)
+        return redirect(self.get_success_url())
+
+
+class CategoryListView(LoginRequiredMixin, ReplicaReadMixin, generic.ListView):
     template_name = "leads/category_list.html"
     context_object_name = "category_list"
 
     def get_context_data(self, **kwargs):
         # call parent method to get all the context of the views
         context = super(CategoryListView, self).get_context_data(**kwargs)
-        user = self.request.user
 
-        if user.is_organisor:
-            # if user is an organisor, show ALL categories that belong to this organisor
-            queryset = Lead.objects.filter(organisation=user.userprofile) # userprofile = test_admin who is an organisor
-        elif user.is_agent:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation) # user.agent.organisation shows ALL the categories that belong to Agent's organisation)
+        # request.tenant is set by TenantMiddleware, organisation is the organisor's profile or the agent's organisation
+        organisation = self.request.tenant.organisation
 
+        # The lead counts are denormalized counters (see the Lead signals in models.py), so no query scans the leads table:
+        # every category row already carries its lead_count and the organisation stores the count of uncategorised leads
         context.update({
-            "unassigned_lead_count": queryset.filter(category__isnull=True).count(),
-            "contacted_lead_count": queryset.filter(category=1).count(),
-            "converted_lead_count": queryset.filter(category=2).count(),
+            "unassigned_lead_count": organisation.uncategorised_lead_count,
         })
         return context
     
 
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organisor:
-            # if user is an organisor, show ALL categories that belong to this organisor
-            queryset = Category.objects.filter(organisation=user.userprofile) # userprofile = test_admin who is an organisor
-        elif user.is_agent:
-            queryset = Category.objects.filter(organisation=user.agent.organisation) # user.agent.organisation shows ALL the categories that belong to Agent's organisation)
-        return queryset
+        # ALL categories of the organisation, for organisors and agents alike
+        return Category.objects.for_user(self.request.user)
 
 
-class CategoryDetailView(LoginRequiredMixin, generic.DetailView):
+class CategoryDetailView(LoginRequiredMixin, ReplicaReadMixin, generic.DetailView):
     template_name = "leads/category_detail.html"
     context_object_name = "category"
 
     def get_context_data(self, **kwargs):
         context = super(CategoryDetailView, self).get_context_data(**kwargs)
-        leads = self.get_object().leads.all() # get_object gets the category that user is accessing, and return all leads belong to the category => self.contacted.leads.all()
+        # self.object is the category that user is accessing (already fetched by DetailView, get_object() would query it again)
         context.update({
-            "leads": leads
+            "leads": self.get_category_leads(self.object.organisation_id, self.object.pk)
         })
         return context
 
+    def get_category_leads(self, organisation_id, category_id):
+        # Filtering on organisation + category lets the database use the (organisation, category) index
+        return Lead.objects.filter(organisation_id=organisation_id, category_id=category_id).only("first_name", "last_name")
+
     def get_queryset(self):
-        user = self.request.user
-        if user.is_organisor:
-            # if user is an organisor, show ALL categories that belong to this organisor
-            queryset = Category.objects.filter(organisation=user.userprofile) # userprofile = test_admin who is an organisor
-        elif user.is_agent:
-            queryset = Category.objects.filter(organisation=user.agent.organisation) # user.agent.organisation shows ALL the categories that belong to Agent's organisation)
-        return queryset
+        # ALL categories of the organisation, for organisors and agents alike
+        return Category.objects.for_user(self.request.user)
 
 
 class LeadCategoryUpdateView(LoginRequiredMixin, generic.UpdateView):
     template_name = "leads/lead_category_update.html"
     form_class = LeadCategoryUpdateForm
 
+    def get_form_kwargs(self, **kwargs):
+        kwargs = super(LeadCategoryUpdateView, self).get_form_kwargs(**kwargs)
+        kwargs.update({
+            "request": self.request # LeadCategoryUpdateForm limits the category dropdown to the organisation's categories
+        })
+        return kwargs
+
 
     # only organisor can update lead information
     def get_queryset(self):
-        user = self.request.user
-        # initial queryset of leads for the entire organisation
-        if user.is_organisor:
-            # if user is an organisor, show ALL leads that belong to this organisor
-            queryset = Lead.objects.filter(organisation=user.userprofile) # userprofile = test_admin who is an organisor
-        elif user.is_agent:
-            queryset = Lead.objects.filter(organisation=user.agent.organisation) # user.agent.organisation shows ALL the leads that belong to Agent's organisation)
-            # filter for the agent that is logged in
-            queryset = Lead.objects.filter(agent__user=user) # agent__user shows ONLY the leads that are assigned to Agent
-        return queryset
+        # an organisor sees ALL leads of the organisation, an agent ONLY the leads assigned to them
+        return Lead.objects.for_user(self.request.user)
 
 
+    @transaction.atomic # the lead and the category lead counters are committed together
+    def form_valid(self, form):
+        return super(LeadCategoryUpdateView, self).form_valid(form)
+
     def get_success_url(self):
         return reverse("leads:lead-detail", kwargs={"pk": self.get_object().pk}) # get_object return a single object from queryset. It will return a link /leads/4/